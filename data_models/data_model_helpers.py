@@ -5,6 +5,7 @@ These do data conversion and persistence. Functions from processing_library and
 
 import ast
 import collections
+import os
 
 import astropy.units as u
 import h5py
@@ -18,8 +19,8 @@ from processing_components.griddata.operations import create_griddata_from_array
 from processing_components.griddata.convolution_functions import create_convolutionfunction_from_array
 
 from processing_components.image.operations import export_image_to_fits, import_image_from_fits
-from data_models.memory_data_models import Visibility, BlockVisibility, Configuration, \
-    GainTable, SkyModel, Skycomponent, Image, GridData, ConvolutionFunction
+from data_models.memory_data_models import Visibility, BlockVisibility, ColumnarData, Configuration, \
+    GainTable, SkyModel, Skycomponent, Image, GridData, ConvolutionFunction, DeconvolutionState
 from data_models.polarisation import PolarisationFrame, ReceptorFrame
 
 
@@ -113,11 +114,78 @@ def convert_configuration_from_hdf(f):
                          diameter=diameter, names=names, mount=mount)
 
 
-def convert_visibility_to_hdf(vis, f):
+def convert_visibility_data_to_hdf(data, f, row_chunk=None, channel_chunk=None, compression=None):
+    """ Convert the data columns of a visibility to HDF
+
+    By default the data are written as one structured dataset. If any of row_chunk, channel_chunk or compression
+    is given, each column is written as a separate dataset in the group 'data', chunked along the rows and, for
+    the columns of a BlockVisibility that have a channel axis, along channel. This allows parts of the data to be
+    read without reading the rest.
+
+    :param data: ColumnarData
+    :param f: HDF root
+    :param row_chunk: Number of rows (times for BlockVisibility) per chunk
+    :param channel_chunk: Number of channels per chunk
+    :param compression: HDF5 compression filter e.g. 'gzip', 'lzf' (default None)
+    :return:
+    """
+    if row_chunk is None and channel_chunk is None and compression is None:
+        f['data'] = data.as_structured()
+        return f
+    
+    nrows = max(1, len(data))
+    df = f.create_group('data')
+    df.attrs['columns'] = [numpy.string_(name) for name in data.dtype.names]
+    for name in data.dtype.names:
+        col = data[name]
+        chunks = list(col.shape)
+        chunks[0] = min(row_chunk or nrows, nrows)
+        if channel_chunk is not None and col.ndim == 5:
+            chunks[3] = min(channel_chunk, col.shape[3])
+        df.create_dataset(name, data=col, chunks=tuple(max(1, c) for c in chunks), compression=compression,
+                          shuffle=compression is not None)
+    return f
+
+
+def convert_hdf_to_visibility_data(f, rows=None, channels=None):
+    """ Convert HDF root to the data columns of a visibility
+
+    Only the selected rows and channels are read.
+
+    :param f: HDF root
+    :param rows: slice of rows (times for BlockVisibility), default all
+    :param channels: slice of channels (BlockVisibility only), default all
+    :return: ColumnarData
+    """
+    if rows is None:
+        rows = slice(None)
+    
+    if isinstance(f['data'], h5py.Group):
+        df = f['data']
+        columns = list()
+        for name in df.attrs['columns']:
+            name = name.decode() if isinstance(name, bytes) else str(name)
+            if channels is not None and df[name].ndim == 5:
+                columns.append((name, df[name][rows, :, :, channels, :]))
+            else:
+                columns.append((name, df[name][rows]))
+        return ColumnarData(columns)
+    
+    data = ColumnarData.from_structured(f['data'][rows], copy=True)
+    if channels is not None:
+        for name in data.dtype.names:
+            if data[name].ndim == 5:
+                data.columns[name] = numpy.ascontiguousarray(data[name][:, :, :, channels, :])
+    return data
+
+
+def convert_visibility_to_hdf(vis, f, row_chunk=None, compression=None):
     """ Convert visibility to HDF
 
     :param vis:
     :param f: HDF root
+    :param row_chunk: Number of rows per chunk, see convert_visibility_data_to_hdf
+    :param compression: HDF5 compression filter e.g. 'gzip', 'lzf' (default None)
     :return:
     """
     assert isinstance(vis, Visibility)
@@ -128,15 +196,16 @@ def convert_visibility_to_hdf(vis, f):
     f.attrs['phasecentre_coords'] = vis.phasecentre.to_string()
     f.attrs['phasecentre_frame'] = vis.phasecentre.frame.name
     f.attrs['polarisation_frame'] = vis.polarisation_frame.type
-    f['data'] = vis.data
+    convert_visibility_data_to_hdf(vis.data, f, row_chunk=row_chunk, compression=compression)
     f = convert_configuration_to_hdf(vis.configuration, f)
     return f
 
 
-def convert_hdf_to_visibility(f):
+def convert_hdf_to_visibility(f, rows=None):
     """ Convert HDF root to visibility
 
     :param f:
+    :param rows: slice of rows to read, default all
     :return:
     """
     assert f.attrs['ARL_data_model'] == "Visibility", "Not a Visibility"
@@ -144,18 +213,21 @@ def convert_hdf_to_visibility(f):
     ss = [float(s[0]), float(s[1])] * u.deg
     phasecentre = SkyCoord(ra=ss[0], dec=ss[1], frame=f.attrs['phasecentre_frame'])
     polarisation_frame = PolarisationFrame(f.attrs['polarisation_frame'])
-    data = numpy.array(f['data'])
+    data = convert_hdf_to_visibility_data(f, rows=rows)
     vis = Visibility(data=data, polarisation_frame=polarisation_frame,
                      phasecentre=phasecentre)
     vis.configuration = convert_configuration_from_hdf(f)
     return vis
 
 
-def convert_blockvisibility_to_hdf(vis: BlockVisibility, f):
+def convert_blockvisibility_to_hdf(vis: BlockVisibility, f, time_chunk=None, channel_chunk=None, compression=None):
     """ Convert blockvisibility to HDF
 
     :param vis:
     :param f: HDF root
+    :param time_chunk: Number of times per chunk, see convert_visibility_data_to_hdf
+    :param channel_chunk: Number of channels per chunk
+    :param compression: HDF5 compression filter e.g. 'gzip', 'lzf' (default None)
     :return:
     """
     assert isinstance(vis, BlockVisibility)
@@ -168,15 +240,18 @@ def convert_blockvisibility_to_hdf(vis: BlockVisibility, f):
     f.attrs['polarisation_frame'] = vis.polarisation_frame.type
     f.attrs['frequency'] = vis.frequency
     f.attrs['channel_bandwidth'] = vis.channel_bandwidth
-    f['data'] = vis.data
+    convert_visibility_data_to_hdf(vis.data, f, row_chunk=time_chunk, channel_chunk=channel_chunk,
+                                   compression=compression)
     f = convert_configuration_to_hdf(vis.configuration, f)
     return f
 
 
-def convert_hdf_to_blockvisibility(f):
+def convert_hdf_to_blockvisibility(f, times=None, channels=None):
     """ Convert HDF root to blockvisibility
 
     :param f:
+    :param times: slice of times to read, default all
+    :param channels: slice of channels to read, default all
     :return:
     """
     assert f.attrs['ARL_data_model'] == "BlockVisibility", "Not a BlockVisibility"
@@ -186,7 +261,10 @@ def convert_hdf_to_blockvisibility(f):
     polarisation_frame = PolarisationFrame(f.attrs['polarisation_frame'])
     frequency = f.attrs['frequency']
     channel_bandwidth = f.attrs['channel_bandwidth']
-    data = numpy.array(f['data'])
+    if channels is not None:
+        frequency = frequency[channels]
+        channel_bandwidth = channel_bandwidth[channels]
+    data = convert_hdf_to_visibility_data(f, rows=times, channels=channels)
     vis = BlockVisibility(data=data, polarisation_frame=polarisation_frame,
                           phasecentre=phasecentre, frequency=frequency,
                           channel_bandwidth=channel_bandwidth)
@@ -194,11 +272,13 @@ def convert_hdf_to_blockvisibility(f):
     return vis
 
 
-def export_visibility_to_hdf5(vis, filename):
+def export_visibility_to_hdf5(vis, filename, row_chunk=None, compression=None):
     """ Export a Visibility to HDF5 format
 
     :param vis:
     :param filename:
+    :param row_chunk: Number of rows per chunk, see convert_visibility_data_to_hdf
+    :param compression: HDF5 compression filter e.g. 'gzip', 'lzf' (default None)
     :return:
     """
     
@@ -208,31 +288,53 @@ def export_visibility_to_hdf5(vis, filename):
         f.attrs['number_data_models'] = len(vis)
         for i, v in enumerate(vis):
             vf = f.create_group('Visibility%d' % i)
-            convert_visibility_to_hdf(v, vf)
+            convert_visibility_to_hdf(v, vf, row_chunk=row_chunk, compression=compression)
         f.flush()
 
 
-def import_visibility_from_hdf5(filename):
+def import_visibility_from_hdf5(filename, rows=None):
     """Import a Visibility from HDF5 format
 
     :param filename:
+    :param rows: slice of rows to read, default all
     :return: If only one then a Visibility, otherwise a list of Visibilitys
     """
     
     with h5py.File(filename, 'r') as f:
         nvislist = f.attrs['number_data_models']
-        vislist = [convert_hdf_to_visibility(f['Visibility%d' % i]) for i in range(nvislist)]
+        vislist = [convert_hdf_to_visibility(f['Visibility%d' % i], rows=rows) for i in range(nvislist)]
         if nvislist == 1:
             return vislist[0]
         else:
             return vislist
 
 
-def export_blockvisibility_to_hdf5(vis, filename):
+def visibility_hdf5_iter(filename, row_chunk=100000, index=0):
+    """Iterate through a Visibility in an HDF5 file, reading one chunk of rows at a time
+
+    :param filename:
+    :param row_chunk: Number of rows in each Visibility
+    :param index: Index of the Visibility in the file
+    :return: Visibility for each chunk
+    """
+    with h5py.File(filename, 'r') as f:
+        vf = f['Visibility%d' % index]
+        nvis = vf.attrs['nvis']
+        for start in range(0, nvis, row_chunk):
+            yield convert_hdf_to_visibility(vf, rows=slice(start, min(start + row_chunk, nvis)))
+
+
+def export_blockvisibility_to_hdf5(vis, filename, time_chunk=None, channel_chunk=None, compression=None):
     """ Export a BlockVisibility to HDF5 format
 
+    If any of time_chunk, channel_chunk or compression is given the data are chunked so that they can be
+    read in parts by import_blockvisibility_from_hdf5 or blockvisibility_hdf5_iter.
+
     :param vis:
     :param filename:
+    :param time_chunk: Number of times per chunk
+    :param channel_chunk: Number of channels per chunk
+    :param compression: HDF5 compression filter e.g. 'gzip', 'lzf' (default None)
     :return:
     """
     
@@ -243,26 +345,52 @@ def export_blockvisibility_to_hdf5(vis, filename):
         for i, v in enumerate(vis):
             assert isinstance(v, BlockVisibility)
             vf = f.create_group('BlockVisibility%d' % i)
-            convert_blockvisibility_to_hdf(v, vf)
+            convert_blockvisibility_to_hdf(v, vf, time_chunk=time_chunk, channel_chunk=channel_chunk,
+                                           compression=compression)
         f.flush()
 
 
-def import_blockvisibility_from_hdf5(filename):
+def import_blockvisibility_from_hdf5(filename, times=None, channels=None):
     """Import a Visibility from HDF5 format
 
     :param filename:
+    :param times: slice of times to read, default all
+    :param channels: slice of channels to read, default all
     :return: If only one then a BlockVisibility, otherwise a list of BlockVisibility's
     """
     
     with h5py.File(filename, 'r') as f:
         nvislist = f.attrs['number_data_models']
-        vislist = [convert_hdf_to_blockvisibility(f['BlockVisibility%d' % i]) for i in range(nvislist)]
+        vislist = [convert_hdf_to_blockvisibility(f['BlockVisibility%d' % i], times=times, channels=channels)
+                   for i in range(nvislist)]
         if nvislist == 1:
             return vislist[0]
         else:
             return vislist
 
 
+def blockvisibility_hdf5_iter(filename, time_chunk=1, channels=None, index=0):
+    """Iterate through a BlockVisibility in an HDF5 file, reading one chunk of times at a time
+
+    For example, to calibrate a large observation without holding it all in memory::
+
+        for bvis in blockvisibility_hdf5_iter('observation.hdf', time_chunk=10):
+            gt = solve_gaintable(bvis, model)
+
+    :param filename:
+    :param time_chunk: Number of times in each BlockVisibility
+    :param channels: slice of channels to read, default all
+    :param index: Index of the BlockVisibility in the file
+    :return: BlockVisibility for each chunk
+    """
+    with h5py.File(filename, 'r') as f:
+        vf = f['BlockVisibility%d' % index]
+        ntimes = vf.attrs['nvis']
+        for start in range(0, ntimes, time_chunk):
+            yield convert_hdf_to_blockvisibility(vf, times=slice(start, min(start + time_chunk, ntimes)),
+                                                 channels=channels)
+
+
 def convert_gaintable_to_hdf(gt: GainTable, f):
     """ Convert GainTable to HDF
 
@@ -402,17 +530,24 @@ def import_skycomponent_from_hdf5(filename):
             return sclist
 
 
-def convert_image_to_hdf(im: Image, f):
+def convert_image_to_hdf(im: Image, f, compression=None):
     """ Convert Image to HDF
 
+    If compression is specified, the data are written in chunks of one plane, shuffled and compressed.
+
     :param im: Image
     :param f: HDF root
+    :param compression: HDF5 compression filter e.g. 'gzip', 'lzf' (default None)
     :return:
     """
     assert isinstance(im, Image), im
     
     f.attrs['ARL_data_model'] = 'Image'
-    f['data'] = im.data
+    if compression is None:
+        f['data'] = im.data
+    else:
+        chunks = (1, 1, im.data.shape[2], im.data.shape[3])
+        f.create_dataset('data', data=im.data, chunks=chunks, compression=compression, shuffle=True)
     f.attrs['wcs'] = numpy.string_(im.wcs.to_header_string())
     f.attrs['polarisation_frame'] = im.polarisation_frame.type
     return f
@@ -511,6 +646,77 @@ def import_skymodel_from_hdf5(filename):
         return SkyModel(components=components, images=images)
 
 
+def convert_deconvolutionstate_to_hdf(state: DeconvolutionState, f, compression='lzf'):
+    """ Convert DeconvolutionState to HDF
+
+    :param state: DeconvolutionState
+    :param f: HDF root
+    :param compression: HDF5 compression filter for the images e.g. 'gzip', 'lzf' (default 'lzf')
+    :return:
+    """
+    assert isinstance(state, DeconvolutionState), state
+    
+    f.attrs['ARL_data_model'] = 'DeconvolutionState'
+    f.attrs['niter'] = state.niter
+    f.attrs['threshold'] = state.threshold
+    f.attrs['algorithm'] = state.algorithm
+    f.attrs['scales'] = numpy.array(state.scales, dtype='float')
+    f.attrs['nmoments'] = state.nmoments
+    f.attrs['findpeak'] = state.findpeak
+    if state.fingerprint is not None:
+        f.attrs['fingerprint'] = state.fingerprint
+    convert_image_to_hdf(state.model, f.create_group('model'), compression=compression)
+    convert_image_to_hdf(state.residual, f.create_group('residual'), compression=compression)
+    return f
+
+
+def convert_hdf_to_deconvolutionstate(f):
+    """ Convert HDF root to a DeconvolutionState
+
+    :param f:
+    :return:
+    """
+    assert f.attrs['ARL_data_model'] == "DeconvolutionState", "Not a DeconvolutionState"
+    model = convert_hdf_to_image(f['model'])
+    residual = convert_hdf_to_image(f['residual'])
+    return DeconvolutionState(model=model, residual=residual, niter=int(f.attrs['niter']),
+                              threshold=float(f.attrs['threshold']), algorithm=str(f.attrs['algorithm']),
+                              scales=list(f.attrs['scales']), nmoments=int(f.attrs['nmoments']),
+                              findpeak=str(f.attrs['findpeak']), fingerprint=f.attrs.get('fingerprint', None))
+
+
+def export_deconvolutionstate_to_hdf5(state, filename, compression='lzf'):
+    """ Export a DeconvolutionState to HDF5 format, usually as a checkpoint
+
+    The file is written to a temporary name and then renamed so that an interrupted write does not
+    destroy the previous checkpoint.
+
+    :param state: DeconvolutionState
+    :param filename:
+    :param compression: HDF5 compression filter for the images e.g. 'gzip', 'lzf' (default 'lzf')
+    :return:
+    """
+    tmpfilename = filename + '.tmp'
+    with h5py.File(tmpfilename, 'w') as f:
+        f.attrs['number_data_models'] = 1
+        sf = f.create_group('DeconvolutionState0')
+        convert_deconvolutionstate_to_hdf(state, sf, compression=compression)
+        f.flush()
+        f.close()
+    os.replace(tmpfilename, filename)
+
+
+def import_deconvolutionstate_from_hdf5(filename):
+    """Import DeconvolutionState from HDF5 format
+
+    :param filename:
+    :return: DeconvolutionState
+    """
+    
+    with h5py.File(filename, 'r') as f:
+        return convert_hdf_to_deconvolutionstate(f['DeconvolutionState0'])
+
+
 def memory_data_model_to_buffer(model, jbuff, dm):
     """ Copy a memory data model to a buffer data model
     
@@ -13,9 +13,13 @@
     vector of length equal to the number of polarisations. Everything else is a separate
     column: time, frequency, uvw, channel_bandwidth, integration time.
 
+    The columns of both are held in a :class:`ColumnarData` i.e. as separate contiguous arrays in native byte
+    order. The big-endian numpy structured array form is used only for HDF5 files and the C interface.
+
 
 """
 
+import collections
 import sys
 
 import logging
@@ -604,11 +608,205 @@ class SkyModel:
         return s
 
 
+class DeconvolutionState:
+    """ The state of a deconvolution, sufficient to resume it
+
+    The model and residual are kept in the space in which the minor cycle works, i.e. frequency moments
+    for msmfsclean. The scale context (algorithm, scales, nmoments, findpeak) is kept so that a resumed
+    deconvolution continues with the same settings. Derived quantities such as the scale-scale PSFs are
+    not kept since they are recalculated cheaply from the PSF.
+    """
+    
+    def __init__(self, model: Image = None, residual: Image = None, niter=0, threshold=0.0, algorithm='msclean',
+                 scales=None, nmoments=0, findpeak='ARL', fingerprint=None):
+        """ Deconvolution state
+
+        :param model: Clean component image accumulated so far
+        :param residual: Current residual image
+        :param niter: Number of minor cycle iterations done so far
+        :param threshold: Absolute stopping threshold, fixed at the start of the deconvolution
+        :param algorithm: Deconvolution algorithm
+        :param scales: Scales (in pixels) for multiscale algorithms
+        :param nmoments: Number of frequency moments for msmfsclean
+        :param findpeak: Method of finding peak in msmfsclean
+        :param fingerprint: Identifies the dirty image and PSF being deconvolved, so that a resumed
+            deconvolution can be checked against them
+        """
+        if scales is None:
+            scales = [0]
+        self.model = model
+        self.residual = residual
+        self.niter = niter
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self.scales = [s for s in scales]
+        self.nmoments = nmoments
+        self.findpeak = findpeak
+        self.fingerprint = fingerprint
+    
+    def size(self):
+        """ Return size in GB
+        """
+        size = 0
+        if self.model is not None:
+            size += self.model.size()
+        if self.residual is not None:
+            size += self.residual.size()
+        return size
+    
+    def __str__(self):
+        """Default printer for DeconvolutionState
+
+        """
+        s = "DeconvolutionState:\n"
+        s += "\tAlgorithm: %s\n" % self.algorithm
+        s += "\tIterations: %d\n" % self.niter
+        s += "\tThreshold: %s\n" % self.threshold
+        s += "\tScales: %s\n" % str(self.scales)
+        s += "\tMoments: %d\n" % self.nmoments
+        s += "\tFind peak: %s\n" % self.findpeak
+        if self.model is not None:
+            s += "\tModel shape: %s\n" % str(self.model.shape)
+        return s
+
+
+class ColumnarData:
+    """ Columns of equal length held as separate contiguous arrays in native byte order
+
+    This replaces a numpy structured array for the visibility classes. Indexing by column name returns the column
+    array itself, so in-place updates work as before, and indexing by rows returns a new ColumnarData. The
+    structured array form, with big-endian columns as used in HDF5 files and the C interface, is given by
+    as_structured.
+    
+    The orders of the rows sorted on a column are cached in sort_index by the visibility iterators.
+    """
+    
+    def __init__(self, columns=None):
+        """ColumnarData
+
+        :param columns: Ordered sequence of (name, array) pairs
+        """
+        self.columns = collections.OrderedDict(columns if columns is not None else [])
+        self.sort_index = dict()
+    
+    @classmethod
+    def from_structured(cls, data, copy=False):
+        """ Create from a numpy structured array
+
+        :param data: Structured array
+        :param copy: Copy into native byte order arrays (True) or use the fields as views (False)
+        :return: ColumnarData
+        """
+        if copy:
+            return cls([(name, numpy.ascontiguousarray(data[name], dtype=data.dtype[name].base.newbyteorder('=')))
+                        for name in data.dtype.names])
+        else:
+            return cls([(name, data[name]) for name in data.dtype.names])
+    
+    def as_structured(self, byteorder='>'):
+        """ Return a copy as a numpy structured array
+
+        :param byteorder: Byte order of the fields, default big-endian
+        :return: Structured array
+        """
+        desc = [(name, col.dtype.newbyteorder(byteorder), col.shape[1:]) for name, col in self.columns.items()]
+        data = numpy.zeros(shape=self.shape, dtype=desc)
+        for name, col in self.columns.items():
+            data[name] = col
+        return data
+    
+    def __array__(self, dtype=None, copy=None):
+        data = self.as_structured()
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+    
+    @classmethod
+    def concatenate(cls, data_list, order=None):
+        """ Concatenate along the rows, optionally sorting
+
+        Each column is allocated once at the final size. If order is given, the rows of each input are written
+        directly to their sorted positions so no unsorted intermediate is made.
+
+        :param data_list: List of ColumnarData with the same columns
+        :param order: List of names of the columns to sort on, the first is the primary key (None)
+        :return: ColumnarData
+        """
+        names = data_list[0].columns.keys()
+        if order is None:
+            return cls([(name, numpy.concatenate([data[name] for data in data_list])) for name in names])
+        
+        keys = cls([(name, numpy.concatenate([data[name] for data in data_list])) for name in order])
+        position = numpy.empty(keys.size, dtype='int')
+        position[keys.argsort(order)] = numpy.arange(keys.size)
+        columns = list()
+        for name in names:
+            first = data_list[0][name]
+            col = numpy.empty((keys.size,) + first.shape[1:], dtype=first.dtype)
+            start = 0
+            for data in data_list:
+                col[position[start:start + data.size]] = data[name]
+                start += data.size
+            columns.append((name, col))
+        return cls(columns)
+    
+    def argsort(self, order):
+        """ Return the (stable) order of the rows sorted on the given columns
+
+        :param order: List of names of the columns, the first is the primary key
+        :return: Index array
+        """
+        return numpy.lexsort([self.columns[name] for name in reversed(order)])
+    
+    def copy(self):
+        return ColumnarData([(name, col.copy()) for name, col in self.columns.items()])
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        return ColumnarData([(name, col[key]) for name, col in self.columns.items()])
+    
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            self.columns[key][...] = value
+        else:
+            for name, col in self.columns.items():
+                col[key] = value[name]
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    @property
+    def dtype(self):
+        return numpy.dtype([(name, col.dtype, col.shape[1:]) for name, col in self.columns.items()])
+    
+    @property
+    def shape(self):
+        return next(iter(self.columns.values())).shape[:1]
+    
+    @property
+    def size(self):
+        return self.shape[0]
+    
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self.columns.values())
+
+
+def _column(value, dtype, shape):
+    """ Make a native byte order column of the given shape, broadcasting value
+
+    """
+    col = numpy.empty(shape, dtype=dtype)
+    col[...] = value
+    return col
+
+
 class Visibility:
     """ Visibility table class
 
     Visibility with uvw, time, integration_time, frequency, channel_bandwidth, a1, a2, vis, weight
-    as separate columns in a numpy structured array, The fundemental unit is a complex vector of polarisation.
+    as separate columns in a ColumnarData, The fundemental unit is a complex vector of polarisation.
 
     Visibility is defined to hold an observation with one direction.
     Polarisation frame is the same for the entire data set and can be stokes, circular, linear
@@ -661,31 +859,21 @@ class Visibility:
             assert len(antenna2) == nvis
             
             npol = polarisation_frame.npol
-            desc = [('index', '>i8'),
-                    ('uvw', '>f8', (3,)),
-                    ('time', '>f8'),
-                    ('frequency', '>f8'),
-                    ('channel_bandwidth', '>f8'),
-                    ('integration_time', '>f8'),
-                    ('antenna1', '>i8'),
-                    ('antenna2', '>i8'),
-                    ('vis', '>c16', (npol,)),
-                    ('weight', '>f8', (npol,)),
-                    ('imaging_weight', '>f8', (npol,))]
-            data = numpy.zeros(shape=[nvis], dtype=desc)
-            data['index'] = list(range(nvis))
-            data['uvw'] = uvw
-            data['time'] = time
-            data['frequency'] = frequency
-            data['channel_bandwidth'] = channel_bandwidth
-            data['integration_time'] = integration_time
-            data['antenna1'] = antenna1
-            data['antenna2'] = antenna2
-            data['vis'] = vis
-            data['weight'] = weight
-            data['imaging_weight'] = imaging_weight
+            data = ColumnarData([('index', numpy.arange(nvis, dtype='i8')),
+                                 ('uvw', _column(uvw, 'f8', (nvis, 3))),
+                                 ('time', _column(time, 'f8', (nvis,))),
+                                 ('frequency', _column(frequency, 'f8', (nvis,))),
+                                 ('channel_bandwidth', _column(channel_bandwidth, 'f8', (nvis,))),
+                                 ('integration_time', _column(integration_time, 'f8', (nvis,))),
+                                 ('antenna1', _column(antenna1, 'i8', (nvis,))),
+                                 ('antenna2', _column(antenna2, 'i8', (nvis,))),
+                                 ('vis', _column(vis, 'c16', (nvis, npol))),
+                                 ('weight', _column(weight, 'f8', (nvis, npol))),
+                                 ('imaging_weight', _column(imaging_weight, 'f8', (nvis, npol)))])
+        elif isinstance(data, numpy.ndarray):
+            data = ColumnarData.from_structured(data)
         
-        self.data = data  # numpy structured array
+        self.data = data  # ColumnarData
         self.cindex = cindex
         self.blockvis = blockvis
         self.phasecentre = phasecentre  # Phase centre of observation
@@ -786,7 +974,7 @@ class BlockVisibility:
     """ Block Visibility table class
 
     BlockVisibility with uvw, time, integration_time, frequency, channel_bandwidth, pol,
-    a1, a2, vis, weight Columns in a numpy structured array.
+    a1, a2, vis, weight Columns in a ColumnarData.
     
     BlockVisibility is defined to hold an observation with one direction.
 
@@ -823,21 +1011,16 @@ class BlockVisibility:
             assert vis.shape == weight.shape
             assert len(frequency) == nchan
             assert len(channel_bandwidth) == nchan
-            desc = [('index', '>i8'),
-                    ('uvw', '>f8', (nants, nants, 3)),
-                    ('time', '>f8'),
-                    ('integration_time', '>f8'),
-                    ('vis', '>c16', (nants, nants, nchan, npol)),
-                    ('weight', '>f8', (nants, nants, nchan, npol))]
-            data = numpy.zeros(shape=[ntimes], dtype=desc)
-            data['index'] = list(range(ntimes))
-            data['uvw'] = uvw
-            data['time'] = time
-            data['integration_time'] = integration_time
-            data['vis'] = vis
-            data['weight'] = weight
+            data = ColumnarData([('index', numpy.arange(ntimes, dtype='i8')),
+                                 ('uvw', _column(uvw, 'f8', (ntimes, nants, nants, 3))),
+                                 ('time', _column(time, 'f8', (ntimes,))),
+                                 ('integration_time', _column(integration_time, 'f8', (ntimes,))),
+                                 ('vis', _column(vis, 'c16', (ntimes, nants, nants, nchan, npol))),
+                                 ('weight', _column(weight, 'f8', (ntimes, nants, nants, nchan, npol)))])
+        elif isinstance(data, numpy.ndarray):
+            data = ColumnarData.from_structured(data)
         
-        self.data = data  # numpy structured array
+        self.data = data  # ColumnarData
         self.frequency = frequency
         self.channel_bandwidth = channel_bandwidth
         self.phasecentre = phasecentre  # Phase centre of observation
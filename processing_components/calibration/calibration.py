@@ -1,7 +1,7 @@
 """ Functions to solve for antenna/station gain
 
 This uses an iterative substitution algorithm due to Larry D'Addario c 1980'ish. Used
-in the original VLA Dec-10 Antsol.
+in the original VLA Dec-10 Antsol. StefCal can be selected instead using solver='stefcal'.
 
 For example::
 
@@ -19,19 +19,19 @@ from data_models.memory_data_models import Visibility, Image
 from data_models.parameters import get_parameter
 from data_models.memory_data_models import BlockVisibility, GainTable, assert_vis_gt_compatible
 
-from processing_library.calibration.solvers import solve_from_X
+from processing_library.calibration.solvers import solve_from_X_batch, solve_from_X_stefcal
 
 from ..visibility.base import create_visibility_from_rows
 from ..calibration.operations import apply_gaintable, create_gaintable_from_blockvisibility
 from ..visibility.coalesce import convert_blockvisibility_to_visibility, decoalesce_visibility
 from ..visibility.base import copy_visibility
 from ..imaging.base import predict_skycomponent_visibility, predict_2d
-from ..visibility.operations import divide_visibility
+from ..visibility.operations import divide_visibility, divide_visibility_data
 
 log = logging.getLogger(__name__)
 
 def solve_gaintable(vis: BlockVisibility, modelvis: BlockVisibility = None, gt=None, phase_only=True, niter=30,
-                    tol=1e-8, crosspol=False, normalise_gains=True, **kwargs) -> GainTable:
+                    tol=1e-8, crosspol=False, normalise_gains=True, solver='itsubs', **kwargs) -> GainTable:
     """Solve a gain table by fitting an observed visibility to a model visibility
     
     If modelvis is None, a point source model is assumed.
@@ -43,6 +43,9 @@ def solve_gaintable(vis: BlockVisibility, modelvis: BlockVisibility = None, gt=N
     :param niter: Number of iterations (default 30)
     :param tol: Iteration stops when the fractional change in the gain solution is below this tolerance
     :param crosspol: Do solutions including cross polarisations i.e. XY, YX or RL, LR
+    :param normalise_gains: Normalise the amplitude of the gains to unity on average
+    :param solver: 'itsubs' (iterative substitution) or 'stefcal'
+    :param rows_per_solve: Approximate number of visibility rows to be processed together (default 4)
     :return: GainTable containing solution
 
     """
@@ -55,36 +58,70 @@ def solve_gaintable(vis: BlockVisibility, modelvis: BlockVisibility = None, gt=N
     else:
         log.debug('solve_gaintable: Solving for complex gain')
     
+    if solver == 'stefcal' and crosspol:
+        log.warning("solve_gaintable: StefCal cannot solve for cross polarisation, using iterative substitution")
+        solver = 'itsubs'
+    assert solver in ['itsubs', 'stefcal'], "Unknown gain solver %s" % solver
+    
     if gt is None:
         log.debug("solve_gaintable: creating new gaintable")
         gt = create_gaintable_from_blockvisibility(vis, **kwargs)
     else:
         log.debug("solve_gaintable: starting from existing gaintable")
 
-    for row in range(gt.ntimes):
-        vis_rows = numpy.abs(vis.time - gt.time[row]) < gt.interval[row] / 2.0
-        if numpy.sum(vis_rows) > 0:
-            subvis = create_visibility_from_rows(vis, vis_rows)
-            if modelvis is not None:
-                model_subvis = create_visibility_from_rows(modelvis, vis_rows)
-                pointvis = divide_visibility(subvis, model_subvis)
-                x = numpy.sum(pointvis.vis * pointvis.weight, axis=0)
-                xwt = numpy.sum(pointvis.weight, axis=0)
-            else:
-                x = numpy.sum(subvis.vis * subvis.weight, axis=0)
-                xwt = numpy.sum(subvis.weight, axis=0)
-            
-            mask = numpy.abs(xwt) > 0.0
-            x_shape = x.shape
-            x[mask] = x[mask] / xwt[mask]
-            x[~mask] = 0.0
-            x = x.reshape(x_shape)
-            
-            gt = solve_from_X(gt, x, xwt, row, crosspol, niter, phase_only,
-                              tol, npol=vis.polarisation_frame.npol)
-            if normalise_gains and not phase_only:
-                gabs = numpy.average(numpy.abs(gt.data['gain'][row]))
-                gt.data['gain'][row] /= gabs
+    # Find the gaintable row for each visibility row: the nearest in time, if within the interval
+    vis_bins = numpy.searchsorted(gt.time, vis.time).clip(1, gt.ntimes) - 1
+    later = numpy.minimum(vis_bins + 1, gt.ntimes - 1)
+    nearer = numpy.abs(vis.time - gt.time[later]) < numpy.abs(vis.time - gt.time[vis_bins])
+    vis_bins[nearer] = later[nearer]
+    valid = numpy.abs(vis.time - gt.time[vis_bins]) < gt.interval[vis_bins] / 2.0
+    
+    # Order the rows by solution interval, avoiding a sort if they already are
+    rows = numpy.nonzero(valid)[0]
+    if not numpy.all(numpy.diff(vis_bins[rows]) >= 0):
+        rows = rows[numpy.argsort(vis_bins[rows], kind='stable')]
+    bins = vis_bins[rows]
+    starts = numpy.nonzero(numpy.diff(bins, prepend=-1))[0]
+    ends = numpy.append(starts[1:], len(rows))
+    solved_rows = bins[starts]
+    
+    # Solve blocks of solution intervals together, limiting the memory used for the point source
+    # equivalents. Each block starts with the first interval beginning in a new block of rows_per_solve rows.
+    rows_per_solve = get_parameter(kwargs, 'rows_per_solve', 4)
+    block_edges = numpy.append(numpy.nonzero(numpy.diff(starts // rows_per_solve, prepend=-1))[0], len(starts))
+    npol = vis.polarisation_frame.npol
+    for first, last in zip(block_edges[:-1], block_edges[1:]):
+        block_starts = starts[first:last]
+        block_rows = rows[block_starts[0]:ends[last - 1]]
+        # Contiguous rows can be selected without a copy
+        if numpy.all(numpy.diff(block_rows) == 1):
+            block_rows = slice(block_rows[0], block_rows[-1] + 1)
+        
+        if modelvis is not None:
+            x, xwt = divide_visibility_data(vis.vis[block_rows], vis.weight[block_rows],
+                                            modelvis.vis[block_rows], npol)
+            numpy.multiply(x, xwt, out=x)
+        else:
+            xwt = vis.weight[block_rows]
+            x = vis.vis[block_rows] * xwt
+        
+        # Sum over all rows in each solution interval in one pass
+        x = numpy.add.reduceat(x, block_starts - block_starts[0], axis=0)
+        xwt = numpy.add.reduceat(xwt, block_starts - block_starts[0], axis=0)
+        
+        mask = numpy.abs(xwt) > 0.0
+        x[mask] = x[mask] / xwt[mask]
+        x[~mask] = 0.0
+        
+        chunks = solved_rows[first:last]
+        if solver == 'stefcal':
+            gt = solve_from_X_stefcal(gt, x, xwt, chunks, crosspol, niter, phase_only, tol, npol=npol)
+        else:
+            gt = solve_from_X_batch(gt, x, xwt, chunks, crosspol, niter, phase_only, tol, npol=npol)
+    
+    if normalise_gains and not phase_only and len(solved_rows) > 0:
+        gabs = numpy.average(numpy.abs(gt.data['gain'][solved_rows]), axis=(1, 2, 3, 4))
+        gt.data['gain'][solved_rows] /= gabs[:, numpy.newaxis, numpy.newaxis, numpy.newaxis, numpy.newaxis]
     
     assert isinstance(gt, GainTable), "gt is not a GainTable: %r" % gt
     
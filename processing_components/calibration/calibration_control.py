@@ -8,6 +8,8 @@
 
 import logging
 
+import numpy
+
 from data_models.memory_data_models import Visibility
 
 from ..calibration.operations import create_gaintable_from_blockvisibility, apply_gaintable, qa_gaintable
@@ -27,6 +29,9 @@ def create_calibration_controls(**kwargs):
         B: Bandpass
         I: Ionosphere
 
+    Each has a solver, either 'itsubs' (iterative substitution) or 'stefcal'. StefCal solves only scalar and
+    vector (diagonal) gains.
+
     Get this dictionary and then adjust parameters as desired
     
     The calibrate function takes a context string e.g. TGB. It then calibrates each of these Jones matrices in turn.
@@ -35,28 +40,35 @@ def create_calibration_controls(**kwargs):
     :return:
     """
 
-    controls = {'T': {'shape': 'scalar', 'timeslice': 'auto', 'phase_only': True, 'first_selfcal': 0},
-                'G': {'shape': 'vector', 'timeslice': 60.0, 'phase_only': False, 'first_selfcal': 0},
-                'P': {'shape': 'matrix', 'timeslice': 1e4, 'phase_only': False, 'first_selfcal': 0},
-                'B': {'shape': 'vector', 'timeslice': 1e5, 'phase_only': False, 'first_selfcal': 0},
-                'I': {'shape': 'vector', 'timeslice': 1.0, 'phase_only': True, 'first_selfcal': 0}}
+    controls = {'T': {'shape': 'scalar', 'timeslice': 'auto', 'phase_only': True, 'first_selfcal': 0, 'solver': 'itsubs'},
+                'G': {'shape': 'vector', 'timeslice': 60.0, 'phase_only': False, 'first_selfcal': 0, 'solver': 'itsubs'},
+                'P': {'shape': 'matrix', 'timeslice': 1e4, 'phase_only': False, 'first_selfcal': 0, 'solver': 'itsubs'},
+                'B': {'shape': 'vector', 'timeslice': 1e5, 'phase_only': False, 'first_selfcal': 0, 'solver': 'itsubs'},
+                'I': {'shape': 'vector', 'timeslice': 1.0, 'phase_only': True, 'first_selfcal': 0, 'solver': 'itsubs'}}
 
     return controls
 
 
-def calibrate_function(vis, model_vis, calibration_context='T', controls=None, iteration=0, **kwargs):
+def calibrate_function(vis, model_vis, calibration_context='T', controls=None, iteration=0, gaintables=None,
+                       **kwargs):
     """ Calibrate using algorithm specified by calibration_context
     
     The context string can denote a sequence of calibrations e.g. TGB with different timescales.
+    
+    If gaintables from a previous call (e.g. the previous major cycle) are given, they are used as the
+    initial guesses for the solutions, provided that they are compatible with the new gaintables. The
+    visibility must then be the same uncalibrated data as before.
 
     :param vis:
     :param model_vis:
     :param calibration_context: calibration contexts in order of correction e.g. 'TGB'
     :param control: controls dictionary, modified as necessary
     :param iteration: Iteration number to be compared to the 'first_selfcal' field.
+    :param gaintables: dict(gaintables) from a previous calibration, used to start the solutions
     :param kwargs:
     :return: Calibrated data_models, dict(gaintables)
     """
+    previous_gaintables = gaintables if gaintables is not None else {}
     gaintables = {}
     
     if controls is None:
@@ -79,11 +91,21 @@ def calibrate_function(vis, model_vis, calibration_context='T', controls=None, i
             gaintables[c] = \
                 create_gaintable_from_blockvisibility(avis,
                                                       timeslice=controls[c]['timeslice'])
-            gaintables[c] = solve_gaintable(avis, amvis,
+            warm_start = c in previous_gaintables and \
+                         previous_gaintables[c].gain.shape == gaintables[c].gain.shape and \
+                         numpy.allclose(previous_gaintables[c].time, gaintables[c].time)
+            if warm_start:
+                gaintables[c].data['gain'][...] = previous_gaintables[c].gain
+            initial_gain = numpy.copy(gaintables[c].gain)
+            gaintables[c] = solve_gaintable(avis, amvis, gt=gaintables[c],
                                             timeslice=controls[c]['timeslice'],
                                             phase_only=controls[c]['phase_only'],
-                                            crosspol=controls[c]['shape'] == 'matrix')
-            log.debug('calibrate_function: Jones matrix %s, iteration %d' % (c, iteration))
+                                            crosspol=controls[c]['shape'] == 'matrix',
+                                            solver=controls[c].get('solver', 'itsubs'))
+            log.info('calibrate_function: Jones matrix %s, iteration %d: %s start, maximum change in gain %.3g, '
+                     'maximum residual %.3g' % (c, iteration, {True: 'warm', False: 'cold'}[warm_start],
+                                                numpy.max(numpy.abs(gaintables[c].gain - initial_gain)),
+                                                numpy.max(gaintables[c].residual)))
             log.debug(qa_gaintable(gaintables[c], context='Jones matrix %s, iteration %d' % (c, iteration)))
             avis = apply_gaintable(avis, gaintables[c], inverse=True, timeslice=controls[c]['timeslice'])
         else:
@@ -92,3 +114,30 @@ def calibrate_function(vis, model_vis, calibration_context='T', controls=None, i
         return convert_blockvisibility_to_visibility(avis), gaintables
     else:
         return avis, gaintables
+
+
+def apply_calibration_function(vis, gaintables, calibration_context='T', **kwargs):
+    """ Apply the inverse of the gaintables found by calibrate_function, in the order of the calibration context
+    
+    Jones matrices in the context but not in gaintables, e.g. not yet solved, are skipped.
+
+    :param vis:
+    :param gaintables: dict(gaintables) as returned by calibrate_function
+    :param calibration_context: calibration contexts in order of correction e.g. 'TGB'
+    :param kwargs:
+    :return: Calibrated data_models
+    """
+    isVis = isinstance(vis, Visibility)
+    if isVis:
+        avis = convert_visibility_to_blockvisibility(vis)
+    else:
+        avis = vis
+    
+    for c in calibration_context:
+        if c in gaintables:
+            avis = apply_gaintable(avis, gaintables[c], inverse=True)
+    
+    if isVis:
+        return convert_blockvisibility_to_visibility(avis)
+    else:
+        return avis
@@ -13,16 +13,28 @@ In this code:
 - The M step for a specific partition is the optimisation of the model partition given the model partition. This
     involves fitting a skycomponent and fitting for the gain phases.
 
+The data models for all partitions are held as one stacked array of visibilities [npartitions, ...]. Each iteration
+predicts every partition once, after all the M steps, and forms the residual (observed data minus the summed data
+models) from which all the E steps follow. The M steps are independent given the E step so they may be run in
+parallel.
+
+For several visibilities, for example in different frequency windows, the skymodels fitted independently to each
+visibility may be reconciled by modelpartition_consensus.
+
 """
 
 import logging
 
+import numpy
+from astropy.coordinates import CartesianRepresentation, UnitSphericalRepresentation
+
 from data_models.memory_data_models import BlockVisibility
+from processing_components.calibration.calibration import solve_gaintable
 from processing_components.calibration.operations import copy_gaintable, create_gaintable_from_blockvisibility, \
     qa_gaintable, apply_gaintable
-from processing_components.skymodel.operations import copy_skymodel
+from processing_components.skymodel.operations import copy_skymodel, solve_skymodel, predict_skymodel_visibility
+from processing_components.visibility.coalesce import convert_blockvisibility_to_visibility
 from processing_components.visibility.operations import copy_visibility
-from processing_components.skymodel.base import predict_skymodel_visibility
 
 log = logging.getLogger(__name__)
 
@@ -42,107 +54,129 @@ def create_modelpartitions(vis: BlockVisibility, skymodels, **kwargs):
 def solve_modelpartitions(vis, model_partitions, niter=10, tol=1e-8, gain=0.25, **kwargs):
     """ Solve for model partitions for one visibility
 
-    Solve by iterating, performing E step and M step.
+    Solve by iterating, performing E step and M step. The iteration stops early if the largest change in the
+    residual visibility is less than tol.
 
     :param vis: Initial visibility
-    :param components: Initial components to be used
-    :param gaintables: Initial gain tables to be used
+    :param model_partitions: Initial list of (skymodel, gaintable) tuples
+    :param niter: Number of iterations
+    :param tol: Tolerance on the change in residual visibility
+    :param gain: Gain in step
     :param kwargs:
     :return: The individual data models and the residual visibility
     """
-    
+    predictions = modelpartition_list_predict(vis, model_partitions, **kwargs)
+    residual = modelpartition_list_residual(vis, predictions)
+
     for iter in range(niter):
-        new_modelpartitions = list()
-        evis_all = modelpartition_list_expectation_all(vis, model_partitions)
         log.debug("solve_modelpartition: Iteration %d" % (iter))
+        evis_list = [modelpartition_expectation_step(vis, residual, prediction) for prediction in predictions]
+        model_partitions = [modelpartition_maximisation_step(evis, csm, gain=gain, **kwargs)
+                            for evis, csm in zip(evis_list, model_partitions)]
+
         for window_index, csm in enumerate(model_partitions):
-            evis = modelpartition_list_expectation_step(vis, evis_all, csm, gain=gain, **kwargs)
-            new_csm = modelpartition_list_maximisation_step(evis, csm, **kwargs)
-            new_modelpartitions.append((new_csm[0], new_csm[1]))
-            
-            flux = new_csm[0].components[0].flux[0, 0]
-            qa = qa_gaintable(new_csm[1])
-            residual = qa.data['residual']
-            rms_phase = qa.data['rms-phase']
-            log.debug("solve_modelpartitions:\t Window %d, flux %s, residual %.3f, rms phase %.3f" % (window_index,
-                                                                                                     str(flux),
-                                                                                                     residual,
-                                                                                                     rms_phase))
-        
-        model_partition = [(copy_skymodel(csm[0]), copy_gaintable(csm[1])) for csm in new_modelpartitions]
-    
-    residual_vis = copy_visibility(vis)
-    final_vis = modelpartition_list_expectation_all(vis, model_partitions)
-    residual_vis.data['vis'][...] = vis.data['vis'][...] - final_vis.data['vis'][...]
-    return model_partitions, residual_vis
+            flux = [sc.flux[0, 0] for sc in csm[0].components]
+            qa = qa_gaintable(csm[1])
+            log.debug("solve_modelpartitions:\t Window %d, flux %s, residual %.3f, rms phase %.3f" %
+                      (window_index, str(flux), qa.data['residual'], qa.data['rms-phase']))
 
+        predictions = modelpartition_list_predict(vis, model_partitions, **kwargs)
+        previous_residual = residual
+        residual = modelpartition_list_residual(vis, predictions)
 
-def modelpartition_list_expectation_step(vislist, evis_all_list, modelpartition_list, **kwargs):
-    """Calculates E step in equation A12
+        change = numpy.max(numpy.abs(residual - previous_residual))
+        if change < tol:
+            log.debug("solve_modelpartitions: Converged after %d iterations, change in residual %.3g" %
+                      (iter + 1, change))
+            break
 
-    This is the data model for this window plus the difference between observed data and summed data models
+    return model_partitions, modelpartition_residual_visibility(vis, residual)
+
+
+def modelpartition_predict(vis: BlockVisibility, modelpartition, **kwargs):
+    """Calculate the data model for one model partition
 
-    :param evis_all: Sum data models
-    :param skymodel: skymodel element being fit
+    :param vis: BlockVisibility defining the sampling
+    :param modelpartition: (skymodel, gaintable) tuple
     :param kwargs:
-    :return: Data model (i.e. visibility) for this skymodel
+    :return: Data model as a visibility array with the shape of vis.vis
     """
+    tvis = copy_visibility(vis, zero=True)
+    tvis = predict_skymodel_visibility(tvis, modelpartition[0], **kwargs)
+    tvis = apply_gaintable(tvis, modelpartition[1])
+    return tvis.data['vis']
 
-    def make_e(vis, modelpartition, evis_all):
-        # Return the estep for a given skymodel
-        evis = copy_visibility(vis)
-        tvis = copy_visibility(vis, zero=True)
-        tvis = predict_skymodel_visibility(tvis, modelpartition[0])
-        tvis = apply_gaintable(tvis, modelpartition[1])
-        # E step is the data model for a window plus the difference between the observed data_models
-        # and the summed data models or, put another way, its the observed data minus the
-        # summed visibility for all other windows
-        evis.data['vis'][...] = tvis.data['vis'][...] + vis.data['vis'][...] - evis_all.data['vis'][...]
-        return evis
 
-    return [make_e(vislist, csm, evis_all_list) for csm in modelpartition_list]
+def modelpartition_list_predict(vis: BlockVisibility, modelpartitions, **kwargs):
+    """Calculate the data models for all model partitions
 
+    :param vis: BlockVisibility defining the sampling
+    :param modelpartitions: List of (skymodel, gaintable) tuples
+    :param kwargs:
+    :return: Stacked data models, shape [npartitions] + vis.vis.shape
+    """
+    predictions = numpy.zeros([len(modelpartitions)] + list(vis.vis.shape), dtype='complex')
+    for i, csm in enumerate(modelpartitions):
+        predictions[i] = modelpartition_predict(vis, csm, **kwargs)
+    return predictions
 
-def modelpartition_list_expectation_all(vislist, modelpartition_list):
-    """Calculates E step in equation A12
 
-    This is the sum of the data models over all skymodel, It is a global sync point for modelpartition
+def modelpartition_list_residual(vis: BlockVisibility, predictions):
+    """Calculate the residual: the observed data minus the summed data models
 
-    :param vislist: Visibility list
-    :param modelpartition_list: list of modelpartition
-    :return: Sum of data models (i.e. a single BlockVisibility)
+    :param vis: Observed BlockVisibility
+    :param predictions: Data models, stacked array or list of visibility arrays
+    :return: Residual visibility array
     """
-    
-    def predict_and_apply(ovis, modelpartition):
-        tvis = copy_visibility(ovis, zero=True)
-        tvis = predict_skymodel_visibility(tvis, modelpartition[0])
-        tvis = apply_gaintable(tvis, modelpartition[1])
-        return tvis
+    residual = vis.data['vis'].astype('complex')
+    for prediction in predictions:
+        residual -= prediction
+    return residual
 
-    evislist = [predict_and_apply(vislist, csm) for csm in modelpartition_list]
 
-    return sum_predict_results(evislist)
+def modelpartition_residual_visibility(vis: BlockVisibility, residual):
+    """Make a BlockVisibility holding the residual
 
+    :param vis: Observed BlockVisibility
+    :param residual: Residual visibility array
+    :return: BlockVisibility
+    """
+    residual_vis = copy_visibility(vis)
+    residual_vis.data['vis'][...] = residual
+    return residual_vis
 
-def modelpartition_list_maximisation_step_arlexecute_workflow(evislist, skymodel_list, **kwargs):
-    """Calculates M step in equation A13
 
-    This maximises the likelihood of the skymodel parameters given the existing data model. Note that these are done
-    separately rather than jointly.
+def modelpartition_expectation_step(vis: BlockVisibility, residual, prediction):
+    """Calculates E step in equation A12
 
-    :param skymodel:
-    :param kwargs:
-    :return:
+    This is the data model for this window plus the difference between observed data and summed data models
+
+    :param vis: Observed BlockVisibility
+    :param residual: Residual visibility array i.e. observed data minus summed data models
+    :param prediction: Data model for this partition
+    :return: Data model (i.e. visibility) for this partition
     """
+    evis = copy_visibility(vis)
+    evis.data['vis'][...] = residual + prediction
+    return evis
 
-    def make_skymodel(ev, skymodel):
-        return (modelpartition_list_fit_skymodel(ev, skymodel, **kwargs),
-                modelpartition_list_fit_gaintable(ev, skymodel, **kwargs))
 
-    return [arlexecute.execute(make_skymodel)(evislist[i], skymodel_list[i]) for i, _ in enumerate(evislist)]
+def modelpartition_maximisation_step(evis: BlockVisibility, modelpartition, **kwargs):
+    """Calculates M step in equation A13
 
+    This maximises the likelihood of the ssm parameters given the existing data model. Note that the skymodel and
+    gaintable are done separately rather than jointly.
 
-def modelpartition_list_fit_skymodel(vis, modelpartition, gain=0.1, **kwargs):
+    :param evis: Data model for this partition, from the E step
+    :param modelpartition: (skymodel, gaintable) tuple
+    :param kwargs:
+    :return: New (skymodel, gaintable) tuple
+    """
+    return (modelpartition_fit_skymodel(evis, modelpartition, **kwargs),
+            modelpartition_fit_gaintable(evis, modelpartition, **kwargs))
+
+
+def modelpartition_fit_skymodel(vis, modelpartition, gain=0.1, **kwargs):
     """Fit a single skymodel to a visibility
 
     :param evis: Expected vis for this ssm
@@ -155,10 +189,10 @@ def modelpartition_list_fit_skymodel(vis, modelpartition, gain=0.1, **kwargs):
         return modelpartition[0]
     else:
         cvis = convert_blockvisibility_to_visibility(vis)
-        return solve_skymodel(cvis, modelpartition[0], **kwargs)
+        return solve_skymodel(cvis, modelpartition[0], gain=gain, **kwargs)
 
 
-def modelpartition_list_fit_gaintable(evis, modelpartition, gain=0.1, niter=3, tol=1e-3, **kwargs):
+def modelpartition_fit_gaintable(evis, modelpartition, gain=0.1, niter=3, tol=1e-3, **kwargs):
     """Fit a gaintable to a visibility
 
     This is the update to the gain part of the window
@@ -169,8 +203,8 @@ def modelpartition_list_fit_gaintable(evis, modelpartition, gain=0.1, niter=3, t
     :param niter: Number of iterations
     :param kwargs: Gaintable
     """
-    previous_gt = copy_gaintable(modelpartition[1])
-    gt = copy_gaintable(modelpartition[1])
+    previous_gt = modelpartition[1]
+    gt = copy_gaintable(previous_gt)
     model_vis = copy_visibility(evis, zero=True)
     model_vis = predict_skymodel_visibility(model_vis, modelpartition[0])
     gt = solve_gaintable(evis, model_vis, gt=gt, niter=niter, phase_only=True, gain=0.5, tol=1e-4, **kwargs)
@@ -179,54 +213,34 @@ def modelpartition_list_fit_gaintable(evis, modelpartition, gain=0.1, niter=3, t
     return gt
 
 
-def modelpartition_list_expectation_step(vis: BlockVisibility, evis_all: BlockVisibility, modelpartition, **kwargs):
-    """Calculates E step in equation A12
-
-    This is the data model for this window plus the difference between observed data and summed data models
-
-    :param evis_all: Sum data models
-    :param csm: csm element being fit
-    :param kwargs:
-    :return: Data model (i.e. visibility) for this csm
-    """
-    evis = copy_visibility(evis_all)
-    tvis = copy_visibility(vis, zero=True)
-    tvis = predict_skymodel_visibility(tvis, modelpartition[0], **kwargs)
-    tvis = apply_gaintable(tvis, modelpartition[1])
-    evis.data['vis'][...] = tvis.data['vis'][...] + vis.data['vis'][...] - evis_all.data['vis'][...]
-    return evis
-
-
-def modelpartition_list_expectation_all(vis: BlockVisibility, modelpartitions, **kwargs):
-    """Calculates E step in equation A12
-
-    This is the sum of the data models over all skymodel
-
-    :param vis: Visibility
-    :param csm: List of (skymodel, gaintable) tuples
-    :param kwargs:
-    :return: Sum of data models (i.e. a visibility)
-    """
-    evis = copy_visibility(vis, zero=True)
-    tvis = copy_visibility(vis, zero=True)
-    for csm in modelpartitions:
-        tvis.data['vis'][...] = 0.0
-        tvis = predict_skymodel_visibility(tvis, csm[0], **kwargs)
-        tvis = apply_gaintable(tvis, csm[1])
-        evis.data['vis'][...] += tvis.data['vis'][...]
-    return evis
-
-
-def modelpartition_list_maximisation_step(evis: BlockVisibility, modelpartition, **kwargs):
-    """Calculates M step in equation A13
-
-    This maximises the likelihood of the ssm parameters given the existing data model. Note that the skymodel and
-    gaintable are done separately rather than jointly.
-
-    :param ssm:
-    :param kwargs:
-    :return:
+def modelpartition_consensus(partition_results):
+    """Find the consensus of the skymodels fitted independently to several visibilities
+    
+    For each partition, the component fluxes and directions, and the model images, are averaged over the
+    visibilities. Fixed skymodels are unchanged.
+    
+    :param partition_results: List, one per visibility, of (model partitions, residual visibility) tuples as
+        returned by solve_modelpartitions
+    :return: List of consensus skymodels, one per partition
     """
-    return (modelpartition_list_fit_skymodel(evis, modelpartition, **kwargs),
-            modelpartition_list_fit_gaintable(evis, modelpartition, **kwargs))
-    return skymodel_list
+    modelpartition_lists = [result[0] for result in partition_results]
+    nparts = len(modelpartition_lists[0])
+    for modelpartition_list in modelpartition_lists:
+        assert len(modelpartition_list) == nparts, "Different numbers of partitions"
+    
+    consensus = list()
+    for part in range(nparts):
+        skymodels = [modelpartition_list[part][0] for modelpartition_list in modelpartition_lists]
+        sm = copy_skymodel(skymodels[0])
+        if not sm.fixed:
+            for icomp, comp in enumerate(sm.components):
+                comps = [skymodel.components[icomp] for skymodel in skymodels]
+                comp.flux = numpy.mean([sc.flux for sc in comps], axis=0)
+                xyz = numpy.mean([sc.direction.cartesian.xyz.value for sc in comps], axis=0)
+                xyz = CartesianRepresentation(xyz / numpy.sqrt(numpy.sum(xyz ** 2)))
+                comp.direction = comp.direction.realize_frame(xyz.represent_as(UnitSphericalRepresentation))
+            for iim, im in enumerate(sm.images):
+                im.data[...] = numpy.mean([skymodel.images[iim].data for skymodel in skymodels], axis=0)
+        consensus.append(sm)
+    
+    return consensus
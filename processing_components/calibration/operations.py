@@ -10,6 +10,8 @@ import numpy.linalg
 from data_models.memory_data_models import GainTable, BlockVisibility, QA, assert_vis_gt_compatible
 from data_models.memory_data_models import ReceptorFrame
 
+from processing_library.util.array_functions import invert_2x2
+
 from ..visibility.iterators import vis_timeslice_iter
 
 import logging
@@ -86,7 +88,124 @@ def create_gaintable_from_blockvisibility(vis: BlockVisibility, timeslice = None
     return gt
 
 
-def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, vis_slices=None, **kwargs) -> BlockVisibility:
+def gaintable_time_index(gt: GainTable):
+    """Create an index of the rows of a gaintable, sorted in time
+    
+    The index is built once for each call of apply_gaintable, and passed to interpolate_gaintable and
+    gaintable_slice_rows for each slice of the visibility.
+    
+    :param gt: GainTable
+    :return: sorted times, order of the rows
+    """
+    order = numpy.argsort(gt.time, kind='stable')
+    return gt.time[order], order
+
+
+def gaintable_slice_rows(gt: GainTable, time, time_index=None):
+    """Find the rows of a gaintable whose interval contains a time
+    
+    :param gt: GainTable
+    :param time: time e.g. the average time of a visibility slice
+    :param time_index: (sorted times, order) from gaintable_time_index, calculated if None
+    :return: gaintable row numbers, in the order of the gaintable
+    """
+    if time_index is None:
+        time_index = gaintable_time_index(gt)
+    sorted_time, order = time_index
+    # Only rows within the largest half interval of the time need be checked
+    halfinterval = numpy.max(gt.interval) / 2.0 if len(sorted_time) > 0 else 0.0
+    lo = numpy.searchsorted(sorted_time, time - halfinterval, side='left')
+    hi = numpy.searchsorted(sorted_time, time + halfinterval, side='right')
+    candidates = numpy.sort(order[lo:hi])
+    return candidates[numpy.abs(gt.time[candidates] - time) < gt.interval[candidates] / 2.0]
+
+
+def interpolate_gaintable(gt: GainTable, time, frequency=None, interpolation='interval', frequency_interpolation=None,
+                          time_index=None):
+    """Find the gains of a gaintable at the given times and frequencies
+    
+    The rows are found using searchsorted on the time index. The interpolation in time can be:
+    
+        'interval': the solution whose interval contains the time, other times are flagged as invalid
+        'nearest': the nearest solution in time
+        'linear': linear interpolation in amplitude and phase between the neighbouring solutions
+        
+    Outside the range of the gaintable, the first or last solution is used. The interpolation in frequency
+    can be None (the channels must match), 'nearest' or 'linear'.
+    
+    :param gt: GainTable
+    :param time: times [ntimes]
+    :param frequency: frequencies [nchan], required for interpolation in frequency
+    :param interpolation: Interpolation in time: 'interval', 'nearest' or 'linear'
+    :param frequency_interpolation: Interpolation in frequency: None, 'nearest' or 'linear'
+    :param time_index: (sorted times, order) from gaintable_time_index, calculated if None
+    :return: gain [ntimes, nants, nchan, nrec, nrec], valid [ntimes]
+    """
+    assert interpolation in ['interval', 'nearest', 'linear'], "Unknown interpolation %s" % interpolation
+    
+    time = numpy.atleast_1d(time)
+    if time_index is None:
+        time_index = gaintable_time_index(gt)
+    sorted_time, order = time_index
+    before, after, weight = _neighbours(sorted_time, time)
+    valid = numpy.ones(len(time), dtype='bool')
+    if interpolation == 'linear':
+        gain = _interpolate_gain(gt.gain[order[before]], gt.gain[order[after]],
+                                 weight[:, numpy.newaxis, numpy.newaxis, numpy.newaxis, numpy.newaxis])
+    else:
+        nearest = order[numpy.where(weight > 0.5, after, before)]
+        gain = gt.gain[nearest]
+        if interpolation == 'interval':
+            valid = numpy.abs(time - gt.time[nearest]) < gt.interval[nearest] / 2.0
+    
+    return interpolate_gaintable_frequency(gt, gain, frequency, frequency_interpolation), valid
+
+
+def interpolate_gaintable_frequency(gt: GainTable, gain, frequency=None, frequency_interpolation=None):
+    """Find gains at the given frequencies, from gains at the frequencies of a gaintable
+    
+    :param gt: GainTable
+    :param gain: gains at the gaintable frequencies [ntimes, nants, gt.nchan, nrec, nrec]
+    :param frequency: frequencies [nchan], required for interpolation in frequency
+    :param frequency_interpolation: Interpolation in frequency: None (the channels must match), 'nearest' or 'linear'
+    :return: gain [ntimes, nants, nchan, nrec, nrec]
+    """
+    assert frequency_interpolation in [None, 'nearest', 'linear'], \
+        "Unknown frequency interpolation %s" % frequency_interpolation
+    if frequency_interpolation is None:
+        return gain
+    
+    assert frequency is not None, "Frequencies are required for interpolation in frequency"
+    chan_order = numpy.argsort(gt.frequency)
+    before, after, weight = _neighbours(gt.frequency[chan_order], numpy.atleast_1d(frequency))
+    if frequency_interpolation == 'linear':
+        return _interpolate_gain(gain[:, :, chan_order[before]], gain[:, :, chan_order[after]],
+                                 weight[:, numpy.newaxis, numpy.newaxis])
+    return gain[:, :, chan_order[numpy.where(weight > 0.5, after, before)]]
+
+
+def _neighbours(points, x):
+    """ Indices of the sorted points on either side of x, and the linear weight of the second
+    """
+    after = numpy.searchsorted(points, x).clip(0, len(points) - 1)
+    before = (after - 1).clip(0, len(points) - 1)
+    spacing = points[after] - points[before]
+    weight = numpy.zeros(len(x))
+    spaced = spacing > 0.0
+    weight[spaced] = ((x - points[before])[spaced] / spacing[spaced]).clip(0.0, 1.0)
+    return before, after, weight
+
+
+def _interpolate_gain(g0, g1, weight):
+    """ Interpolate amplitude and phase separately, taking the shortest path in phase
+    """
+    amplitude = (1.0 - weight) * numpy.abs(g0) + weight * numpy.abs(g1)
+    phase = numpy.angle(g0) + weight * numpy.angle(g1 * numpy.conjugate(g0))
+    return amplitude * numpy.exp(1j * phase)
+
+
+def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, vis_slices=None, interpolation=None,
+                    frequency_interpolation=None, **kwargs) -> BlockVisibility:
     """Apply a gain table to a block visibility
     
     The corrected visibility is::
@@ -96,16 +215,30 @@ def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, vis_slic
     If the visibility data are polarised e.g. polarisation_frame("linear") then the inverse operator
     represents an actual inverse of the gains.
     
+    By default (interpolation=None) the gaintable rows whose intervals contain the average time of each
+    visibility slice are applied in turn to the rows of the slice, as when the gaintable is solved for the
+    same slices. Otherwise the gain for each visibility row is found separately, see interpolate_gaintable:
+    'interval' uses the solution whose interval contains the time of the row, leaving rows not covered by
+    the gaintable unchanged, and 'nearest' and 'linear' interpolate in time. The time index of the gaintable
+    is built once for all slices.
+    
     :param vis: Visibility to have gains applied
     :param gt: Gaintable to be applied
     :param inverse: Apply the inverse (default=False)
+    :param vis_slices: Number of time slices to be processed at once (default one per time)
+    :param interpolation: Interpolation in time: None, 'interval', 'nearest' or 'linear'
+    :param frequency_interpolation: Interpolation in frequency: None, 'nearest' or 'linear'
     :return: input vis with gains applied
     
     """
     assert isinstance(vis, BlockVisibility), "vis is not a BlockVisibility: %r" % vis
     assert isinstance(gt, GainTable), "gt is not a GainTable: %r" % gt
+    assert interpolation in [None, 'interval', 'nearest', 'linear'], "Unknown interpolation %s" % interpolation
 
-    assert_vis_gt_compatible(vis, gt)
+    if frequency_interpolation is None:
+        assert_vis_gt_compatible(vis, gt)
+    else:
+        assert vis.npol == gt.nrec * gt.nrec
     
     if inverse:
         log.debug('apply_gaintable: Apply inverse gaintable')
@@ -116,55 +249,66 @@ def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, vis_slic
     if is_scalar:
         log.debug('apply_gaintable: scalar gains')
 
+    # Baselines are held in the lower triangle vis[time, a2, a1, ...] with a2 > a1
+    a2, a1 = numpy.tril_indices(vis.nants, -1)
+    
+    time_index = gaintable_time_index(gt)
+
     for chunk, rows in enumerate(vis_timeslice_iter(vis, vis_slices=vis_slices)):
-        if numpy.sum(rows) > 0:
-            vistime = numpy.average(vis.time[rows])
-            gaintable_rows = abs(gt.time - vistime) < gt.interval / 2.0
-            
-            # Lookup the gain for this set of visibilities
-            gain = gt.data['gain'][gaintable_rows]
+        if len(rows) > 0:
+            # Lookup the gain for each of this set of visibilities
+            if interpolation is None:
+                gaintable_rows = gaintable_slice_rows(gt, numpy.average(vis.time[rows]), time_index)
+                visrows = rows[:len(gaintable_rows)]
+                if len(visrows) == 0:
+                    continue
+                gain = interpolate_gaintable_frequency(gt, gt.gain[gaintable_rows[:len(visrows)]], vis.frequency,
+                                                       frequency_interpolation)
+            else:
+                gain, valid = interpolate_gaintable(gt, vis.time[rows], vis.frequency, interpolation,
+                                                    frequency_interpolation, time_index)
+                if not numpy.any(valid):
+                    continue
+                visrows = rows[valid]
+                gain = gain[valid]
+            nrec = gain.shape[-1]
             
-            # The shape of the mueller matrix is
-            ntimes, nant, nchan, nrec, _ = gain.shape
+            # Gather all baselines at once: shape [ntimes, nbaselines, nchan, npol]
+            index = (visrows[:, numpy.newaxis], a2[numpy.newaxis, :], a1[numpy.newaxis, :])
+            original = vis.data['vis'][index]
+            g1 = gain[:, a1]
+            g2 = numpy.conjugate(gain[:, a2])
             
-            original = vis.vis[rows]
-            applied = copy.deepcopy(original)
-            for time in range(ntimes):
-                for a1 in range(vis.nants - 1):
-                    for a2 in range(a1 + 1, vis.nants):
-                        if is_scalar:
-                            smueller = gain[time, a1, :, 0] * numpy.conjugate(gain[time, a2, :, 0])
-                            if inverse:
-                                if numpy.abs(smueller).all() > 0.0:
-                                    applied[time, a2, a1, :, 0][..., numpy.newaxis] = \
-                                        original[time, a2, a1, :, 0][..., numpy.newaxis] / smueller
-                            else:
-                                applied[time, a2, a1, :, 0][..., numpy.newaxis] = \
-                                    original[time, a2, a1, :, 0][..., numpy.newaxis] * smueller
-                        else:
-                            for chan in range(nchan):
-                                mueller = numpy.kron(gain[time, a1, chan, :, :],
-                                                     numpy.conjugate(gain[time, a2, chan, :, :]))
-                                if inverse:
-                                    # If the Mueller is singular, ignore it
-                                    try:
-                                        mueller = numpy.linalg.inv(mueller)
-                                        applied[time, a2, a1, chan, :] = \
-                                            numpy.matmul(mueller, original[time, a2, a1, chan, :])
-                                    except numpy.linalg.linalg.LinAlgError:
-                                        applied[time, a2, a1, chan, :] = \
-                                            original[time, a2, a1, chan, :]
-                                else:
-                                    applied[time, a2, a1, chan, :] = \
-                                        numpy.matmul(mueller, original[time, a2, a1, chan, :])
+            if is_scalar:
+                smueller = g1[..., 0, 0] * g2[..., 0, 0]
+                if inverse:
+                    # Only correct baselines where the gain product is non-zero for all channels
+                    valid = numpy.all(numpy.abs(smueller) > 0.0, axis=-1)
+                    original[..., 0][valid] /= smueller[valid]
+                else:
+                    original[..., 0] *= smueller
+            else:
+                # kron(g1, g2^*) applied to the 4-vector is g1 V g2^H for V the 2x2 form of the visibility
+                if inverse:
+                    g1, valid1 = invert_2x2(g1)
+                    g2, valid2 = invert_2x2(g2)
+                    # If the Mueller is singular, ignore it
+                    valid = valid1 & valid2
+                else:
+                    valid = numpy.ones(g1.shape[:-2], dtype='bool')
+                v = original.reshape(original.shape[:-1] + (nrec, nrec))
+                applied = numpy.einsum('...pr,...rs,...qs->...pq', g1[valid], v[valid], g2[valid])
+                original[valid] = applied.reshape(applied.shape[:-2] + (nrec * nrec,))
             
-            vis.data['vis'][rows] = applied
+            vis.data['vis'][index] = original
     return vis
 
 
 def append_gaintable(gt: GainTable, othergt: GainTable) -> GainTable:
     """Append othergt to gt
 
+    This copies all the rows of gt, so to accumulate many gaintables use GainTableBuilder instead.
+
     :param gt:
     :param othergt:
     :return: GainTable gt + othergt
@@ -174,6 +318,77 @@ def append_gaintable(gt: GainTable, othergt: GainTable) -> GainTable:
     return gt
 
 
+class GainTableBuilder:
+    """ Accumulate the rows of a sequence of GainTables
+    
+    The rows are held in a buffer whose capacity doubles when full, so each row is copied a bounded number of
+    times however many gaintables are appended. Use as::
+    
+        builder = GainTableBuilder()
+        for gt in gt_iter:
+            builder.append(gt)
+        fullgt = builder.finalize()
+    """
+    
+    def __init__(self, capacity=0):
+        """ GainTableBuilder
+        
+        :param capacity: Initial number of rows to allocate, if known
+        """
+        self.capacity = capacity
+        self.nrows = 0
+        self.gt = None
+        self.buffer = None
+    
+    def append(self, gt: GainTable):
+        """ Append the rows of gt
+        
+        The first gaintable appended supplies the other attributes of the final gaintable.
+        
+        :param gt: GainTable
+        :return: self
+        """
+        assert isinstance(gt, GainTable), gt
+        if self.gt is None:
+            self.gt = gt
+            self.capacity = max(self.capacity, gt.data.size)
+            self.buffer = numpy.empty(self.capacity, dtype=gt.data.dtype)
+        else:
+            assert self.gt.receptor_frame == gt.receptor_frame
+        
+        nrows = self.nrows + gt.data.size
+        if nrows > self.capacity:
+            self.capacity = max(nrows, 2 * self.capacity)
+            log.debug("GainTableBuilder: growing to %d rows" % self.capacity)
+            buffer = numpy.empty(self.capacity, dtype=self.buffer.dtype)
+            buffer[:self.nrows] = self.buffer[:self.nrows]
+            self.buffer = buffer
+        
+        self.buffer[self.nrows:nrows] = gt.data
+        self.nrows = nrows
+        return self
+    
+    def finalize(self) -> GainTable:
+        """ Return the accumulated gaintable, and reset the builder
+        
+        :return: GainTable, None if nothing has been appended
+        """
+        if self.gt is None:
+            return None
+        
+        newgt = copy.copy(self.gt)
+        if self.nrows < self.capacity:
+            newgt.data = self.buffer[:self.nrows].copy()
+        else:
+            newgt.data = self.buffer
+        
+        self.capacity = 0
+        self.nrows = 0
+        self.gt = None
+        self.buffer = None
+        return newgt
+
+
 def copy_gaintable(gt: GainTable, zero=False) -> GainTable:
     """Copy a GainTable
 
@@ -2,13 +2,22 @@
 
 """
 
-import collections
+import collections.abc
+import logging
+import queue
+import threading
+import time
+
+import numpy
 
 from data_models.memory_data_models import BlockVisibility, GainTable
 from processing_components.visibility.operations import copy_visibility
 from processing_components.calibration.calibration import solve_gaintable
 from processing_components.imaging.base import predict_skycomponent_visibility
 
+log = logging.getLogger(__name__)
+
+
 def rcal(vis: BlockVisibility, components, **kwargs) -> GainTable:
     """ Real-time calibration pipeline.
 
@@ -22,7 +31,7 @@ def rcal(vis: BlockVisibility, components, **kwargs) -> GainTable:
     :return: gaintable
    """
     
-    if not isinstance(vis, collections.Iterable):
+    if not isinstance(vis, collections.abc.Iterable):
         vis = [vis]
     
     for ichunk, vischunk in enumerate(vis):
@@ -30,3 +39,161 @@ def rcal(vis: BlockVisibility, components, **kwargs) -> GainTable:
         vispred = predict_skycomponent_visibility(vispred, components)
         gt = solve_gaintable(vischunk, vispred, **kwargs)
         yield gt
+
+
+class _StreamEnd:
+    """ Marks the end of a stream, carrying any exception raised upstream
+    """
+    
+    def __init__(self, error=None):
+        self.error = error
+
+
+def _put(q, item, stop):
+    """ Put on a bounded queue, blocking until there is space or the stream is stopped
+
+    :return: Time spent waiting (s)
+    """
+    start = time.time()
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            break
+        except queue.Full:
+            pass
+    return time.time() - start
+
+
+def _get(q, stop):
+    """ Get from a queue, blocking until an item is available or the stream is stopped
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _StreamEnd()
+
+
+def rcal_stream(vis, components, queue_size=2, rate=None, statistics=None, join_timeout=1.0,
+                **kwargs) -> GainTable:
+    """ Streaming real-time calibration pipeline.
+
+    As rcal but the stages run concurrently: a reader thread takes BlockVisibility chunks from the
+    iterator (e.g. create_blockvisibility_iterator) into a bounded queue, a predict thread calculates the
+    model visibilities for the next chunks while the calling thread solves the current one. When the solver
+    falls behind, the queues fill and the reader blocks, so no more than 2 * queue_size chunks are held
+    in memory at once.
+
+    To replay at a fixed real-time rate, set rate to the number of chunks per second to be read.
+    Chunks read more than half a chunk after their scheduled time, usually because the queues were full,
+    are counted as late.
+    
+    For example::
+
+        vis_iter = create_blockvisibility_iterator(config, times, frequency, channel_bandwidth,
+                                                   phasecentre=phasecentre, components=comps)
+        stats = list()
+        for gt in rcal_stream(vis_iter, comps, rate=10.0, statistics=stats):
+            ...
+
+    :param vis: Visibility or Union(Visibility, Iterable)
+    :param components: Component-based sky model
+    :param queue_size: Maximum number of chunks waiting in each queue
+    :param rate: Rate at which chunks are read (per second), None for as fast as possible
+    :param statistics: Optional list to which a dictionary of timings (s) is appended for each chunk
+    :param join_timeout: Time (s) to wait for each stage thread to stop once the stream ends or is closed
+    :param kwargs: Parameters for solve_gaintable
+    :return: gaintable
+    """
+    
+    if not isinstance(vis, collections.abc.Iterable):
+        vis = [vis]
+    
+    assert queue_size > 0, "queue_size must be positive: %d" % queue_size
+    assert rate is None or rate > 0.0, "rate must be positive: %s" % rate
+    
+    input_queue = queue.Queue(maxsize=queue_size)
+    predicted_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    
+    def reader():
+        try:
+            start = time.time()
+            for ichunk, vischunk in enumerate(vis):
+                if stop.is_set():
+                    return
+                if rate is not None:
+                    scheduled = start + ichunk / rate
+                    delay = scheduled - time.time()
+                    if delay > 0.0 and stop.wait(delay):
+                        return
+                else:
+                    scheduled = time.time()
+                arrival = time.time()
+                stats = {'chunk': ichunk, 'arrival': arrival, 'lag': max(0.0, arrival - scheduled)}
+                stats['input_wait'] = _put(input_queue, (vischunk, stats), stop)
+            _put(input_queue, _StreamEnd(), stop)
+        except Exception as error:
+            _put(input_queue, _StreamEnd(error), stop)
+    
+    def predictor():
+        while True:
+            item = _get(input_queue, stop)
+            if isinstance(item, _StreamEnd):
+                _put(predicted_queue, item, stop)
+                return
+            vischunk, stats = item
+            try:
+                start = time.time()
+                vispred = copy_visibility(vischunk, zero=True)
+                vispred = predict_skycomponent_visibility(vispred, components)
+                stats['predict'] = time.time() - start
+            except Exception as error:
+                _put(predicted_queue, _StreamEnd(error), stop)
+                return
+            stats['predicted_wait'] = _put(predicted_queue, (vischunk, vispred, stats), stop)
+    
+    threads = [threading.Thread(target=reader, name='rcal_stream_reader', daemon=True),
+               threading.Thread(target=predictor, name='rcal_stream_predictor', daemon=True)]
+    for thread in threads:
+        thread.start()
+    
+    latencies = list()
+    nlate = 0
+    start = time.time()
+    try:
+        while True:
+            item = _get(predicted_queue, stop)
+            if isinstance(item, _StreamEnd):
+                if item.error is not None:
+                    raise item.error
+                break
+            vischunk, vispred, stats = item
+            solve_start = time.time()
+            gt = solve_gaintable(vischunk, vispred, **kwargs)
+            stats['solve'] = time.time() - solve_start
+            stats['latency'] = time.time() - stats['arrival']
+            latencies.append(stats['latency'])
+            # Allow half a chunk of jitter before counting a chunk as late
+            if rate is not None and stats['lag'] > 0.5 / rate:
+                nlate += 1
+            if statistics is not None:
+                statistics.append(stats)
+            log.debug("rcal_stream: chunk %d, latency %.3f s, predict %.3f s, solve %.3f s" %
+                      (stats['chunk'], stats['latency'], stats['predict'], stats['solve']))
+            yield gt
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=join_timeout)
+            if thread.is_alive():
+                # Most likely blocked inside the visibility iterator. The thread is a daemon, and stops at
+                # its next check of the stop event.
+                log.warning("rcal_stream: thread %s did not stop within %.1f s" % (thread.name, join_timeout))
+        if len(latencies) > 0:
+            elapsed = time.time() - start
+            log.info("rcal_stream: %d chunks in %.3f s (%.3f chunks/s), mean latency %.3f s, "
+                     "maximum latency %.3f s, %d chunks read late" %
+                     (len(latencies), elapsed, len(latencies) / elapsed, numpy.mean(latencies),
+                      numpy.max(latencies), nlate))
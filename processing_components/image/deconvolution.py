@@ -23,17 +23,20 @@ For example to make dirty image and PSF, deconvolve, and then restore::
 
 """
 
+import hashlib
 import logging
+import os
 
 from data_models.polarisation import PolarisationFrame
 
 import numpy
-from astropy.convolution import Gaussian2DKernel, convolve_fft
+from astropy.convolution import Gaussian2DKernel
 from photutils import fit_2dgaussian
 
-from data_models.memory_data_models import Image
+from data_models.memory_data_models import Image, DeconvolutionState
 from data_models.parameters import get_parameter
-from processing_library.arrays.cleaners import hogbom, hogbom_complex, msclean, msmfsclean
+from processing_library.arrays.cleaners import hogbom, hogbom_polarisation, msclean, msmfsclean, \
+    create_msclean_psf_stack, create_msmfsclean_psf_stack
 from processing_library.image.operations import create_image_from_array, copy_image
 from ..image.operations import calculate_image_frequency_moments, calculate_image_from_frequency_moments
 
@@ -63,7 +66,8 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
     
     :param dirty: Image dirty image
     :param psf: Image Point Spread Function
-    :param window: Window image (Bool) - clean where True
+    :param window_shape: Window shape: 'quarter' cleans the inner quarter of each plane (None)
+    :param mask: Window image (Bool) - clean where True, overrides window_shape (None)
     :param algorithm: Cleaning algorithm: 'msclean'|'hogbom'|'mfsmsclean'
     :param gain: loop gain (float) 0.7
     :param threshold: Clean threshold (0.0)
@@ -71,6 +75,11 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
     :param scales: Scales (in pixels) for multiscale ([0, 3, 10, 30])
     :param nmoments: Number of frequency moments (default 3)
     :param findpeak: Method of finding peak in mfsclean: 'Algorithm1'|'ASKAPSoft'|'CASA'|'ARL', Default is ARL.
+    :param checkpoint_interval: Number of iterations between checkpoints (None)
+    :param checkpoint_file: HDF5 file to hold the DeconvolutionState checkpoints (None)
+    :param checkpoint_resume: Resume from checkpoint_file if it exists (False)
+    :param deconvolution_state: DeconvolutionState from which to resume (None)
+    :param psf_stacks: dict in which the multiscale PSF stacks are kept for later calls with the same PSF (None)
     :return: componentimage, residual
     
     """
@@ -78,15 +87,11 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
     assert isinstance(dirty, Image), dirty
     assert isinstance(psf, Image), psf
     
-    window_shape = get_parameter(kwargs, 'window_shape', None)
-    if window_shape == 'quarter':
-        qx = dirty.shape[3] // 4
-        qy = dirty.shape[2] // 4
-        window = numpy.zeros_like(dirty.data)
-        window[..., (qy + 1):3 * qy, (qx + 1):3 * qx] = 1.0
-        log.info('deconvolve_cube %s: Cleaning inner quarter of each sky plane' % prefix)
-    else:
-        window = None
+    if get_parameter(kwargs, 'checkpoint_interval', None) is not None or \
+            get_parameter(kwargs, 'deconvolution_state', None) is not None:
+        return deconvolve_cube_checkpointed(dirty, psf, prefix, **kwargs)
+    
+    window = create_window(dirty, prefix, **kwargs)
     
     psf_support = get_parameter(kwargs, 'psf_support', max(dirty.shape[2] // 2, dirty.shape[3] // 2))
     if (psf_support <= psf.shape[2] // 2) and ((psf_support <= psf.shape[3] // 2)):
@@ -97,6 +102,7 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
         log.info('deconvolve_cube %s: PSF shape %s' % (prefix, str(psf.data.shape)))
     
     algorithm = get_parameter(kwargs, 'algorithm', 'msclean')
+    psf_stacks = get_parameter(kwargs, 'psf_stacks', None)
 
     if algorithm == 'msclean':
         log.info("deconvolve_cube %s: Multi-scale clean of each polarisation and channel separately" %
@@ -109,7 +115,7 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
         assert niter > 0
         scales = get_parameter(kwargs, 'scales', [0, 3, 10, 30])
         fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.01)
-        assert 0.0 < fracthresh < 1.0
+        assert 0.0 <= fracthresh < 1.0
         
         comp_array = numpy.zeros_like(dirty.data)
         residual_array = numpy.zeros_like(dirty.data)
@@ -117,15 +123,21 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
             for pol in range(dirty.data.shape[1]):
                 if psf.data[channel, pol, :, :].max():
                     log.info("deconvolve_cube %s: Processing pol %d, channel %d" % (prefix, pol, channel))
+                    psf_stack = None
+                    if psf_stacks is not None:
+                        if (channel, pol) not in psf_stacks:
+                            psf_stacks[(channel, pol)] = create_msclean_psf_stack(psf.data[channel, pol, :, :],
+                                                                                  scales)
+                        psf_stack = psf_stacks[(channel, pol)]
                     if window is None:
                         comp_array[channel, pol, :, :], residual_array[channel, pol, :, :] = \
                             msclean(dirty.data[channel, pol, :, :], psf.data[channel, pol, :, :],
-                                    None, gain, thresh, niter, scales, fracthresh, prefix)
+                                    None, gain, thresh, niter, scales, fracthresh, prefix, psf_stack)
                     else:
                         comp_array[channel, pol, :, :], residual_array[channel, pol, :, :] = \
                             msclean(dirty.data[channel, pol, :, :], psf.data[channel, pol, :, :],
                                     window[channel, pol, :, :], gain, thresh, niter, scales, fracthresh,
-                                    prefix)
+                                    prefix, psf_stack)
                 else:
                     log.info("deconvolve_cube %s: Skipping pol %d, channel %d" % (prefix, pol, channel))
         
@@ -139,13 +151,18 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
                  % prefix)
         nmoments = get_parameter(kwargs, "nmoments", 3)
         assert nmoments > 0, "Number of frequency moments must be greater than zero"
-        nchan = dirty.shape[0]
+        nchan = psf.shape[0]
         assert nchan > 2 * nmoments, "Require nchan %d > 2 * nmoments %d" % (nchan, 2 * nmoments)
-        dirty_taylor = calculate_image_frequency_moments(dirty, nmoments=nmoments)
         psf_taylor = calculate_image_frequency_moments(psf, nmoments=2 * nmoments)
         psf_peak = numpy.max(psf_taylor.data)
-        dirty_taylor.data /= psf_peak
         psf_taylor.data /= psf_peak
+        if dirty.wcs.wcs.ctype[3] == 'MOMENT':
+            # Already moments, normalised by the PSF peak, e.g. the residual of a previous deconvolution
+            assert dirty.shape[0] == nmoments, "Dirty moment image must have %d moments" % nmoments
+            dirty_taylor = copy_image(dirty)
+        else:
+            dirty_taylor = calculate_image_frequency_moments(dirty, nmoments=nmoments)
+            dirty_taylor.data /= psf_peak
         log.info("deconvolve_cube %s: Shape of Dirty moments image %s" %
                  (prefix, str(dirty_taylor.shape)))
         log.info("deconvolve_cube %s: Shape of PSF moments image %s" % (prefix, str(psf_taylor.shape)))
@@ -157,29 +174,27 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
         assert niter > 0
         scales = get_parameter(kwargs, 'scales', [0, 3, 10, 30])
         fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.1)
-        assert 0.0 < fracthresh < 1.0
+        assert 0.0 <= fracthresh < 1.0
         
         comp_array = numpy.zeros(dirty_taylor.data.shape)
         residual_array = numpy.zeros(dirty_taylor.data.shape)
         for pol in range(dirty_taylor.data.shape[1]):
             if psf_taylor.data[0, pol, :, :].max():
                 log.info("deconvolve_cube %s: Processing pol %d" % (prefix, pol))
+                psf_stack = None
+                if psf_stacks is not None:
+                    if pol not in psf_stacks:
+                        psf_stacks[pol] = create_msmfsclean_psf_stack(psf_taylor.data[:, pol, :, :], scales)
+                    psf_stack = psf_stacks[pol]
                 if window is None:
                     comp_array[:, pol, :, :], residual_array[:, pol, :, :] = \
                         msmfsclean(dirty_taylor.data[:, pol, :, :], psf_taylor.data[:, pol, :, :],
-                                   None, gain, thresh, niter, scales, fracthresh, findpeak, prefix)
+                                   None, gain, thresh, niter, scales, fracthresh, findpeak, prefix, psf_stack)
                 else:
-                    qx = dirty.shape[3] // 4
-                    qy = dirty.shape[2] // 4
-                    window_taylor = numpy.zeros_like(dirty_taylor.data)
-                    window_taylor[..., (qy + 1):3 * qy, (qx + 1):3 * qx] = 1.0
-                    log.info('deconvolve_cube %s: Cleaning inner quarter of each moment plane'
-                             % prefix)
-                    
                     comp_array[:, pol, :, :], residual_array[:, pol, :, :] = \
                         msmfsclean(dirty_taylor.data[:, pol, :, :], psf_taylor.data[:, pol, :, :],
-                                   window_taylor[0, pol, :, :], gain, thresh, niter, scales, fracthresh,
-                                   findpeak, prefix)
+                                   window[0, pol, :, :], gain, thresh, niter, scales, fracthresh,
+                                   findpeak, prefix, psf_stack)
             else:
                 log.info("deconvolve_cube %s: Skipping pol %d" % (prefix, pol))
         
@@ -204,7 +219,7 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
         niter = get_parameter(kwargs, 'niter', 100)
         assert niter > 0
         fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.1)
-        assert 0.0 < fracthresh < 1.0
+        assert 0.0 <= fracthresh < 1.0
         
         comp_array = numpy.zeros(dirty.data.shape)
         residual_array = numpy.zeros(dirty.data.shape)
@@ -226,7 +241,7 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
         comp_image = create_image_from_array(comp_array, dirty.wcs, dirty.polarisation_frame)
         residual_image = create_image_from_array(residual_array, dirty.wcs, dirty.polarisation_frame)
     elif algorithm == 'hogbom-complex':
-        log.info("deconvolve_cube_complex: Hogbom-complex clean of each polarisation and channel separately")
+        log.info("deconvolve_cube_complex: Hogbom-complex clean of I, Q+iU and V for each channel together")
         gain = get_parameter(kwargs, 'gain', 0.7)
         assert 0.0 < gain < 2.0, "Loop gain must be between 0 and 2"
         thresh = get_parameter(kwargs, 'threshold', 0.0)
@@ -236,42 +251,35 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
         fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.1)
         assert 0.0 <= fracthresh < 1.0
     
+        assert dirty.data.shape[1] == 4, "hogbom-complex requires a full Stokes IQUV cube"
+        
         comp_array = numpy.zeros(dirty.data.shape)
         residual_array = numpy.zeros(dirty.data.shape)
         for channel in range(dirty.data.shape[0]):
-            for pol in range(dirty.data.shape[1]):
-                if pol == 0 or pol == 3:
-                    if psf.data[channel, pol, :, :].max():
-                        log.info("deconvolve_cube_complex: Processing pol %d, channel %d" % (pol, channel))
-                        if window is None:
-                            comp_array[channel, pol, :, :], residual_array[channel, pol, :, :] = \
-                                hogbom(dirty.data[channel, pol, :, :], psf.data[channel, pol, :, :],
-                                       None, gain, thresh, niter, fracthresh)
-                        else:
-                            comp_array[channel, pol, :, :], residual_array[channel, pol, :, :] = \
-                                hogbom(dirty.data[channel, pol, :, :], psf.data[channel, pol, :, :],
-                                       window[channel, pol, :, :], gain, thresh, niter, fracthresh)
-                    else:
-                        log.info("deconvolve_cube_complex: Skipping pol %d, channel %d" % (pol, channel))
+            # I, Q+iU and V are cleaned with the PSFs for I, Q and V respectively
+            planes = [(0, dirty.data[channel, 0, :, :]),
+                      (1, dirty.data[channel, 1, :, :] + 1j * dirty.data[channel, 2, :, :]),
+                      (3, dirty.data[channel, 3, :, :])]
+            planes = [(pol, plane) for pol, plane in planes if psf.data[channel, pol, :, :].max()]
+            if len(planes) == 0:
+                log.info("deconvolve_cube_complex: Skipping channel %d" % channel)
+                continue
+            log.info("deconvolve_cube_complex: Processing pols %s for channel %d" %
+                     (str([pol for pol, _ in planes]), channel))
+            psfs = [psf.data[channel, pol, :, :] for pol, _ in planes]
+            if window is None:
+                comps, residuals = hogbom_polarisation([plane for _, plane in planes], psfs, None, gain, thresh,
+                                                       niter, fracthresh, prefix)
+            else:
+                comps, residuals = hogbom_polarisation([plane for _, plane in planes], psfs,
+                                                       window[channel, 0, :, :], gain, thresh, niter,
+                                                       fracthresh, prefix)
+            for (pol, _), comp, residual in zip(planes, comps, residuals):
                 if pol == 1:
-                    if psf.data[channel, 1:2, :, :].max():
-                        log.info("deconvolve_cube_complex: Processing pol 1 and 2, channel %d" % (channel))
-                        if window is None:
-                            comp_array[channel, 1, :, :], comp_array[channel, 2, :, :], residual_array[channel, 1, :,
-                                                                                        :], residual_array[channel, 2,
-                                                                                            :, :] = hogbom_complex(
-                                dirty.data[channel, 1, :, :], dirty.data[channel, 2, :, :], psf.data[channel, 1, :, :],
-                                psf.data[channel, 2, :, :], None, gain, thresh, niter, fracthresh)
-                        else:
-                            comp_array[channel, 1, :, :], comp_array[channel, 2, :, :], residual_array[channel, 1, :,
-                                                                                        :], residual_array[channel, 2,
-                                                                                            :, :] = hogbom_complex(
-                                dirty.data[channel, 1, :, :], dirty.data[channel, 2, :, :], psf.data[channel, 1, :, :],
-                                psf.data[channel, 2, :, :], window[channel, pol, :, :], gain, thresh, niter, fracthresh)
-                    else:
-                        log.info("deconvolve_cube_complex: Skipping pol 1 and 2, channel %d" % (channel))
-                if pol == 2:
-                    continue
+                    comp_array[channel, 1, :, :], residual_array[channel, 1, :, :] = comp.real, residual.real
+                    comp_array[channel, 2, :, :], residual_array[channel, 2, :, :] = comp.imag, residual.imag
+                else:
+                    comp_array[channel, pol, :, :], residual_array[channel, pol, :, :] = comp, residual
     
         comp_image = create_image_from_array(comp_array, dirty.wcs, polarisation_frame=PolarisationFrame('stokesIQUV'))
         residual_image = create_image_from_array(residual_array, dirty.wcs,
@@ -284,8 +292,243 @@ def deconvolve_cube(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Im
     return comp_image, residual_image
 
 
+def create_window(dirty: Image, prefix='', **kwargs):
+    """ Create the clean window for a dirty image from window_shape and mask
+
+    :param dirty: Image dirty image
+    :param window_shape: Window shape: 'quarter' cleans the inner quarter of each plane (None)
+    :param mask: Window image (Bool) - clean where True, overrides window_shape (None)
+    :return: window array, same shape as dirty, or None
+    """
+    window_shape = get_parameter(kwargs, 'window_shape', None)
+    if window_shape == 'quarter':
+        qx = dirty.shape[3] // 4
+        qy = dirty.shape[2] // 4
+        window = numpy.zeros_like(dirty.data)
+        window[..., (qy + 1):3 * qy, (qx + 1):3 * qx] = 1.0
+        log.info('deconvolve_cube %s: Cleaning inner quarter of each sky plane' % prefix)
+    else:
+        window = None
+    
+    mask = get_parameter(kwargs, 'mask', None)
+    if isinstance(mask, Image):
+        if window is not None:
+            log.warning('deconvolve_cube %s: Overriding window_shape with mask image' % prefix)
+        window = numpy.broadcast_to(mask.data, dirty.shape)
+        log.info('deconvolve_cube %s: Cleaning inside mask image, fill factor %.3f' %
+                 (prefix, numpy.count_nonzero(mask.data) / float(mask.data.size)))
+    return window
+
+
+def deconvolution_fingerprint(dirty: Image, psf: Image):
+    """ Identify the dirty image and PSF of a deconvolution by their shapes and a hash of their pixels
+    
+    :param dirty: Image dirty image
+    :param psf: Image Point Spread Function
+    :return: string
+    """
+    return ' '.join('%s %s' % (str(im.shape), hashlib.sha1(numpy.ascontiguousarray(im.data)).hexdigest())
+                    for im in [dirty, psf])
+
+
+def create_deconvolution_state(dirty: Image, psf: Image, **kwargs) -> DeconvolutionState:
+    """ Create the initial state for a checkpointed deconvolution
+    
+    The absolute stopping threshold is fixed here from threshold and fractional_threshold, using the peak of the
+    whole cube, so that it does not drift as the deconvolution is resumed. For msclean, as in the minor cycle, the
+    peak and threshold are for each plane normalised to unit PSF peak.
+
+    :param dirty: Image dirty image
+    :param psf: Image Point Spread Function
+    :param kwargs: As for deconvolve_cube
+    :return: DeconvolutionState
+    """
+    algorithm = get_parameter(kwargs, 'algorithm', 'msclean')
+    scales = get_parameter(kwargs, 'scales', [0, 3, 10, 30])
+    findpeak = get_parameter(kwargs, "findpeak", 'ARL')
+    threshold = get_parameter(kwargs, 'threshold', 0.0)
+    
+    if algorithm in ['msmfsclean', 'mfsmsclean', 'mmclean']:
+        nmoments = get_parameter(kwargs, "nmoments", 3)
+        fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.1)
+        residual = calculate_image_frequency_moments(dirty, nmoments=nmoments)
+        residual.data /= numpy.max(calculate_image_frequency_moments(psf, nmoments=2 * nmoments).data)
+        peak = numpy.max(numpy.abs(residual.data[0, ...]))
+    else:
+        nmoments = 0
+        residual = copy_image(dirty)
+        if algorithm == 'msclean':
+            fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.01)
+        else:
+            fracthresh = get_parameter(kwargs, 'fractional_threshold', 0.1)
+        peak = residual_peak(algorithm, dirty, psf)
+    
+    model = copy_image(residual)
+    model.data = numpy.zeros_like(residual.data)
+    return DeconvolutionState(model=model, residual=residual, niter=0, threshold=max(threshold, fracthresh * peak),
+                              algorithm=algorithm, scales=scales, nmoments=nmoments, findpeak=findpeak,
+                              fingerprint=deconvolution_fingerprint(dirty, psf))
+
+
+def residual_peak(algorithm, residual: Image, psf: Image, window=None):
+    """ Peak absolute residual, as compared with the stopping threshold in the minor cycle of the algorithm
+    
+    For msclean each plane is normalised to unit PSF peak. For the moment algorithms, the residual is the
+    moment image and only the zeroth moment is used.
+
+    :param algorithm: Deconvolution algorithm
+    :param residual: Image residual image
+    :param psf: Image Point Spread Function
+    :param window: window array, as from create_window (None)
+    :return: peak
+    """
+    data = residual.data if window is None else residual.data * window
+    if algorithm in ['msmfsclean', 'mfsmsclean', 'mmclean']:
+        return numpy.max(numpy.abs(data[0, ...]))
+    
+    peaks = numpy.max(numpy.abs(data), axis=(2, 3))
+    if algorithm == 'msclean':
+        # Planes with no PSF are not cleaned
+        psf_peaks = numpy.max(psf.data, axis=(2, 3))
+        peaks = numpy.where(psf_peaks > 0.0, peaks / numpy.where(psf_peaks > 0.0, psf_peaks, 1.0), 0.0)
+    return numpy.max(peaks)
+
+
+def deconvolve_cube_checkpointed(dirty: Image, psf: Image, prefix='', **kwargs) -> (Image, Image):
+    """ Clean in chunks of checkpoint_interval iterations, checkpointing the state between chunks
+    
+    The state is written to checkpoint_file (if given) after every chunk, using chunked, compressed HDF5, and the
+    file is deleted once the deconvolution is complete. A deconvolution can be resumed either by passing
+    deconvolution_state, or by setting checkpoint_resume=True with an existing checkpoint_file. The state records a
+    fingerprint of the dirty image and psf, and resuming with different ones raises a ValueError. The deconvolution
+    finishes after niter iterations in total, or when the peak residual inside the window falls below the
+    threshold fixed at the start. The multiscale PSF stacks are calculated once for all the chunks. Since each chunk
+    starts a new minor cycle, the result is close to but not identical to that of a single deconvolve_cube of niter
+    iterations.
+    
+    :param dirty: Image dirty image
+    :param psf: Image Point Spread Function
+    :param kwargs: As for deconvolve_cube
+    :return: componentimage, residual
+    """
+    niter = get_parameter(kwargs, 'niter', 100)
+    assert niter > 0
+    interval = get_parameter(kwargs, 'checkpoint_interval', None)
+    if interval is None:
+        interval = niter
+    assert interval > 0, "Checkpoint interval must be positive"
+    checkpoint_file = get_parameter(kwargs, 'checkpoint_file', None)
+    compression = get_parameter(kwargs, 'checkpoint_compression', 'lzf')
+    if checkpoint_file is not None:
+        from data_models.data_model_helpers import export_deconvolutionstate_to_hdf5, \
+            import_deconvolutionstate_from_hdf5
+    
+    state = get_parameter(kwargs, 'deconvolution_state', None)
+    if state is None and checkpoint_file is not None and get_parameter(kwargs, 'checkpoint_resume', False) \
+            and os.path.exists(checkpoint_file):
+        state = import_deconvolutionstate_from_hdf5(checkpoint_file)
+    if state is None:
+        state = create_deconvolution_state(dirty, psf, **kwargs)
+    else:
+        assert isinstance(state, DeconvolutionState), state
+        if state.fingerprint is not None and state.fingerprint != deconvolution_fingerprint(dirty, psf):
+            raise ValueError('deconvolve_cube %s: Cannot resume, the dirty image or psf differs from that of the '
+                             'deconvolution state' % prefix)
+        log.info('deconvolve_cube %s: Resuming %s deconvolution at iteration %d' % (prefix, state.algorithm,
+                                                                                      state.niter))
+    
+    window = create_window(state.residual, prefix, **kwargs)
+    
+    chunk_kwargs = dict(kwargs)
+    for key in ['checkpoint_interval', 'checkpoint_file', 'checkpoint_resume', 'checkpoint_compression',
+                'deconvolution_state']:
+        chunk_kwargs.pop(key, None)
+    chunk_kwargs.update({'algorithm': state.algorithm, 'scales': state.scales, 'findpeak': state.findpeak,
+                         'nmoments': state.nmoments, 'threshold': state.threshold, 'fractional_threshold': 0.0,
+                         'return_moments': True, 'psf_stacks': dict()})
+    # deconvolve_cube trims the psf to the psf support, so the caller's psf is left as it is
+    chunk_psf = copy_image(psf)
+    
+    # msclean stops at 0.9 of the threshold
+    stop = 0.9 * state.threshold if state.algorithm == 'msclean' else state.threshold
+    while state.niter < niter:
+        peak = residual_peak(state.algorithm, state.residual, psf, window)
+        if peak < stop:
+            log.info('deconvolve_cube %s: Peak %.6f is below threshold %.6f at iteration %d' %
+                     (prefix, peak, stop, state.niter))
+            break
+        
+        chunk_kwargs['niter'] = min(interval, niter - state.niter)
+        comp, residual = deconvolve_cube(state.residual, chunk_psf, prefix=prefix, **chunk_kwargs)
+        state.model.data += comp.data
+        state.residual = residual
+        state.niter += chunk_kwargs['niter']
+        
+        if checkpoint_file is not None:
+            export_deconvolutionstate_to_hdf5(state, checkpoint_file, compression=compression)
+            log.info('deconvolve_cube %s: Checkpointed state at iteration %d to %s' %
+                     (prefix, state.niter, checkpoint_file))
+    
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+        log.info('deconvolve_cube %s: Deconvolution complete, removed checkpoint %s' % (prefix, checkpoint_file))
+    
+    if state.algorithm in ['msmfsclean', 'mfsmsclean', 'mmclean'] and not get_parameter(kwargs, "return_moments",
+                                                                                           False):
+        log.info("deconvolve_cube %s: calculating spectral cubes" % prefix)
+        return calculate_image_from_frequency_moments(dirty, state.model), \
+               calculate_image_from_frequency_moments(dirty, state.residual)
+    
+    return copy_image(state.model), copy_image(state.residual)
+
+
+_psf_fit_cache = dict()
+
+
+def fit_psf(psf: Image):
+    """ Fit a Gaussian to the central part of the PSF, returning the width
+    
+    The fit is cached on the central pixels of the PSF so that restoring many images with the same PSF fits only
+    once.
+
+    :param psf: Input PSF
+    :return: Gaussian stddev in pixels (isotropic)
+    """
+    npixel = psf.data.shape[3]
+    sl = slice(npixel // 2 - 7, npixel // 2 + 8)
+    centre = numpy.ascontiguousarray(psf.data[0, 0, sl, sl])
+    key = (centre.shape, centre.tobytes())
+    if key in _psf_fit_cache:
+        return _psf_fit_cache[key]
+    
+    # isotropic at the moment!
+    from scipy.optimize import minpack
+    try:
+        fit = fit_2dgaussian(centre)
+        if fit.x_stddev <= 0.0 or fit.y_stddev <= 0.0:
+            log.debug('fit_psf: error in fitting to psf, using 1 pixel stddev')
+            size = 1.0
+        else:
+            size = max(fit.x_stddev, fit.y_stddev)
+            log.debug('fit_psf: psfwidth = %s' % (size))
+    except minpack.error as err:
+        log.debug('fit_psf: minpack error, using 1 pixel stddev')
+        size = 1.0
+    except ValueError as err:
+        log.debug('fit_psf: warning in fit to psf, using 1 pixel stddev')
+        size = 1.0
+    
+    if len(_psf_fit_cache) >= 16:
+        _psf_fit_cache.clear()
+    _psf_fit_cache[key] = size
+    return size
+
+
 def restore_cube(model: Image, psf: Image, residual=None, **kwargs) -> Image:
     """ Restore the model image to the residuals
+    
+    All channels and polarisations are convolved together by a single FFT multiply with the transform of the
+    restoring beam.
 
     :params psf: Input PSF
     :return: restored image
@@ -297,43 +540,27 @@ def restore_cube(model: Image, psf: Image, residual=None, **kwargs) -> Image:
     
     restored = copy_image(model)
     
-    npixel = psf.data.shape[3]
-    sl = slice(npixel // 2 - 7, npixel // 2 + 8)
-    
     size = get_parameter(kwargs, "psfwidth", None)
     
     if size is None:
-        # isotropic at the moment!
-        from scipy.optimize import minpack
-        try:
-            fit = fit_2dgaussian(psf.data[0, 0, sl, sl])
-            if fit.x_stddev <= 0.0 or fit.y_stddev <= 0.0:
-                log.debug('restore_cube: error in fitting to psf, using 1 pixel stddev')
-                size = 1.0
-            else:
-                size = max(fit.x_stddev, fit.y_stddev)
-                log.debug('restore_cube: psfwidth = %s' % (size))
-        except minpack.error as err:
-            log.debug('restore_cube: minpack error, using 1 pixel stddev')
-            size = 1.0
-        except ValueError as err:
-            log.debug('restore_cube: warning in fit to psf, using 1 pixel stddev')
-            size = 1.0
+        size = fit_psf(psf)
     else:
         log.debug('restore_cube: Using specified psfwidth = %s' % (size))
 
-    # TODO: Remove filter when astropy fixes convolve
-    import warnings
-    warnings.simplefilter(action='ignore', category=FutureWarning)
-    from astropy.convolution import Gaussian2DKernel, convolve_fft
-
     # By convention, we normalise the peak not the integral so this is the volume of the Gaussian
     norm = 2.0 * numpy.pi * size ** 2
     gk = Gaussian2DKernel(size)
-    for chan in range(model.shape[0]):
-        for pol in range(model.shape[1]):
-            restored.data[chan, pol, :, :] = norm * convolve_fft(model.data[chan, pol, :, :], gk,
-                                                                 normalize_kernel=False)
+    kernel = norm * gk.array
+    
+    # Zero pad to avoid wrap-around, then convolve all planes in one batched FFT
+    ny, nx = model.shape[2], model.shape[3]
+    ky, kx = kernel.shape
+    shape = [ny + ky, nx + kx]
+    xkernel = numpy.fft.rfft2(kernel, shape)
+    xmodel = numpy.fft.rfft2(model.data, shape, axes=(-2, -1))
+    convolved = numpy.fft.irfft2(xmodel * xkernel, shape, axes=(-2, -1))
+    restored.data[...] = convolved[..., (ky // 2):(ky // 2 + ny), (kx // 2):(kx // 2 + nx)]
+
     if residual is not None:
         restored.data += residual.data
     return restored
@@ -197,7 +197,22 @@ def smooth_image(model: Image, width=1.0):
     return cmodel
 
 
-def calculate_image_frequency_moments(im: Image, reference_frequency=None, nmoments=3) -> Image:
+def calculate_frequency_moment_weights(freq, reference_frequency, nmoments):
+    """Calculate the matrix of frequency moment weights
+
+    Weights are ((freq-reference_frequency)/reference_frequency)**moment
+
+    :param freq: Channel frequencies
+    :param reference_frequency: Reference frequency
+    :param nmoments: Number of moments
+    :return: Weights [nmoments, nchan]
+    """
+    x = (numpy.asarray(freq) - reference_frequency) / reference_frequency
+    return numpy.power(x[numpy.newaxis, :], numpy.arange(nmoments)[:, numpy.newaxis])
+
+
+def calculate_image_frequency_moments(im: Image, reference_frequency=None, nmoments=3, out=None,
+                                      dtype='float64') -> Image:
     """Calculate frequency weighted moments
     
     Weights are ((freq-reference_frequency)/reference_frequency)**moment
@@ -212,6 +227,8 @@ def calculate_image_frequency_moments(im: Image, reference_frequency=None, nmome
     :param im: Image cube
     :param reference_frequency: Reference frequency (default None uses average)
     :param nmoments: Number of moments to calculate
+    :param out: Optional array [nmoments, npol, ny, nx] to hold the moments
+    :param dtype: Data type of the moments e.g. 'float32' (default 'float64')
     :return: Moments image
     """
     assert isinstance(im, Image)
@@ -225,12 +242,12 @@ def calculate_image_frequency_moments(im: Image, reference_frequency=None, nmome
         reference_frequency = numpy.average(freq)
     log.debug("calculate_image_frequency_moments: Reference frequency = %.3f (MHz)" % (reference_frequency/1e6))
     
-    moment_data = numpy.zeros([nmoments, npol, ny, nx])
+    if out is None:
+        out = numpy.empty([nmoments, npol, ny, nx], dtype=dtype)
+    assert out.shape == (nmoments, npol, ny, nx), "Output array has wrong shape %s" % str(out.shape)
     
-    for moment in range(nmoments):
-        for chan in range(nchan):
-            weight = numpy.power((freq[chan] - reference_frequency) / reference_frequency, moment)
-            moment_data[moment, ...] += im.data[chan, ...] * weight
+    weights = calculate_frequency_moment_weights(freq, reference_frequency, nmoments).astype(out.dtype)
+    out[...] = numpy.tensordot(weights, im.data.astype(out.dtype, copy=False), axes=(1, 0))
     
     moment_wcs = copy.deepcopy(im.wcs)
     moment_wcs.wcs.ctype[3] = 'MOMENT'
@@ -239,10 +256,11 @@ def calculate_image_frequency_moments(im: Image, reference_frequency=None, nmome
     moment_wcs.wcs.cdelt[3] = 1.0
     moment_wcs.wcs.cunit[3] = ''
     
-    return create_image_from_array(moment_data, moment_wcs, im.polarisation_frame)
+    return create_image_from_array(out, moment_wcs, im.polarisation_frame)
 
 
-def calculate_image_from_frequency_moments(im: Image, moment_image: Image, reference_frequency=None) -> Image:
+def calculate_image_from_frequency_moments(im: Image, moment_image: Image, reference_frequency=None,
+                                           out=None) -> Image:
     """Calculate image from frequency weighted moments
 
     Weights are ((freq-reference_frequency)/reference_frequency)**moment
@@ -258,6 +276,7 @@ def calculate_image_from_frequency_moments(im: Image, moment_image: Image, refer
     :param im: Image cube to be reconstructed
     :param moment_image: Moment cube (constructed using calculate_image_frequency_moments)
     :param reference_frequency: Reference frequency (default None uses average)
+    :param out: Optional array [nchan, npol, ny, nx] to hold the reconstructed cube
     :return: reconstructed image
     """
     assert isinstance(im, Image)
@@ -277,16 +296,14 @@ def calculate_image_from_frequency_moments(im: Image, moment_image: Image, refer
         reference_frequency = numpy.average(freq)
     log.debug("calculate_image_from_frequency_moments: Reference frequency = %.3f (MHz)" % (reference_frequency))
     
-    newim = copy_image(im)
+    if out is None:
+        out = numpy.empty(im.shape, dtype=im.data.dtype)
+    assert out.shape == im.shape, "Output array has wrong shape %s" % str(out.shape)
     
-    newim.data[...] = 0.0
-    
-    for moment in range(nmoments):
-        for chan in range(nchan):
-            weight = numpy.power((freq[chan] - reference_frequency) / reference_frequency, moment)
-            newim.data[chan, ...] += moment_image.data[moment, ...] * weight
+    weights = calculate_frequency_moment_weights(freq, reference_frequency, nmoments).astype(out.dtype)
+    out[...] = numpy.tensordot(weights, moment_image.data.astype(out.dtype, copy=False), axes=(0, 0))
     
-    return newim
+    return create_image_from_array(out, copy.deepcopy(im.wcs), im.polarisation_frame)
 
 
 def remove_continuum_image(im: Image, degree=1, mask=None):
@@ -555,11 +555,10 @@ def create_blockvisibility_iterator(config: Configuration, times: numpy.array, f
         vis_iter = create_blockvisibility_iterator(config, times, frequency, channel_bandwidth, phasecentre=phasecentre,
                                               weight=1.0, integration_time=30.0, number_integrations=3)
 
-        for i, vis in enumerate(vis_iter):
-        if i == 0:
-            fullvis = vis
-        else:
-            fullvis = append_visibility(fullvis, vis)
+        builder = VisibilityBuilder()
+        for vis in vis_iter:
+            builder.append(vis)
+        fullvis = builder.finalize()
 
 
     :param config: Configuration of antennas
@@ -601,60 +600,79 @@ def create_blockvisibility_iterator(config: Configuration, times: numpy.array, f
         yield bvis
 
 
+def create_random_streams(seed=None, nstreams=1):
+    """ Create independent, reproducible random streams e.g. one per frequency window
+    
+    The stream for a given index depends only on the seed and the index, so the results do not depend on the
+    order in which (possibly parallel) simulations are run. If seed is None, fresh entropy is used.
+    
+    :param seed: Seed
+    :param nstreams: Number of streams
+    :return: List of numpy.random.RandomState
+    """
+    return [numpy.random.RandomState(numpy.random.MT19937(sequence))
+            for sequence in numpy.random.SeedSequence(seed).spawn(nstreams)]
+
+
 def simulate_gaintable(gt: GainTable, phase_error=0.1, amplitude_error=0.0, smooth_channels=1,
-                       leakage=0.0, seed=None, **kwargs) -> GainTable:
+                       leakage=0.0, seed=None, rng=None, **kwargs) -> GainTable:
     """ Simulate a gain table
     
+    The random numbers are drawn from rng if given, otherwise from the global numpy random state. For
+    reproducible simulations in parallel, give each gaintable its own stream, see create_random_streams.
+    
     :type gt: GainTable
     :param phase_error: std of normal distribution, zero mean
     :param amplitude_error: std of log normal distribution
     :param leakage: std of cross hand leakage
-    :param seed: Seed for random numbers def: 180555
-    :param smooth_channels: Use bspline over smooth_channels
+    :param seed: Seed for the global random state, ignored if rng is given
+    :param rng: numpy.random.RandomState to draw from
+    :param smooth_channels: Use boxcar smoothing over smooth_channels
     :param kwargs:
     :return: Gaintable
     
     """
     
     def moving_average(a, n=3):
-        return numpy.convolve(a, numpy.ones((n,)) / n, mode='valid')
+        # Boxcar convolution along the channel (last) axis, keeping only the fully overlapping values
+        c = numpy.cumsum(a, axis=-1)
+        c[..., n:] = c[..., n:] - c[..., :-n]
+        return c[..., n - 1:] / n
     
-    if seed is not None:
-        numpy.random.seed(seed)
+    if rng is None:
+        if seed is not None:
+            numpy.random.seed(seed)
+        rng = numpy.random
     
     log.debug("simulate_gaintable: Simulating amplitude error = %.4f, phase error = %.4f"
               % (amplitude_error, phase_error))
     amps = 1.0
-    phases = 1.0
+    phases = 0.0
     ntimes, nant, nchan, nrec, _ = gt.data['gain'].shape
+    smooth_channels = int(smooth_channels)
+    # The draws are made in the same order as a loop over time and antenna
     if phase_error > 0.0:
-        phases = numpy.zeros(gt.data['gain'].shape)
-        for time in range(ntimes):
-            for ant in range(nant):
-                phase = numpy.random.normal(0, phase_error, nchan + int(smooth_channels) - 1)
-                if smooth_channels > 1:
-                    phase = moving_average(phase, smooth_channels)
-                phases[time, ant, ...] = phase[..., numpy.newaxis, numpy.newaxis]
+        phases = rng.normal(0, phase_error, [ntimes, nant, nchan + smooth_channels - 1])
+        if smooth_channels > 1:
+            phases = moving_average(phases, smooth_channels)
+        phases = phases[..., numpy.newaxis, numpy.newaxis]
     
     if amplitude_error > 0.0:
-        amps = numpy.ones(gt.data['gain'].shape, dtype='complex')
-        for time in range(ntimes):
-            for ant in range(nant):
-                amp = numpy.random.lognormal(mean=0.0, sigma=amplitude_error, size=nchan + int(smooth_channels) - 1)
-                if smooth_channels > 1:
-                    amp = moving_average(amp, smooth_channels)
-                    amp = amp / numpy.average(amp)
-                amps[time, ant, ...] = amp[..., numpy.newaxis, numpy.newaxis]
-    
-    gt.data['gain'] = amps * numpy.exp(0 + 1j * phases)
+        amps = rng.lognormal(mean=0.0, sigma=amplitude_error, size=[ntimes, nant, nchan + smooth_channels - 1])
+        if smooth_channels > 1:
+            amps = moving_average(amps, smooth_channels)
+            amps = amps / numpy.average(amps, axis=-1)[..., numpy.newaxis]
+        amps = amps[..., numpy.newaxis, numpy.newaxis]
+    
+    gt.data['gain'] = amps * numpy.exp(0 + 1j * phases) * numpy.ones(gt.data['gain'].shape)
     nrec = gt.data['gain'].shape[-1]
     if nrec > 1:
         if leakage > 0.0:
-            leak = numpy.random.normal(0, leakage, gt.data['gain'][..., 0, 0].shape) + 1j * \
-                   numpy.random.normal(0, leakage, gt.data['gain'][..., 0, 0].shape)
+            leak = rng.normal(0, leakage, gt.data['gain'][..., 0, 0].shape) + 1j * \
+                   rng.normal(0, leakage, gt.data['gain'][..., 0, 0].shape)
             gt.data['gain'][..., 0, 1] = gt.data['gain'][..., 0, 0] * leak
-            leak = numpy.random.normal(0, leakage, gt.data['gain'][..., 1, 1].shape) + 1j * \
-                   numpy.random.normal(0, leakage, gt.data['gain'][..., 1, 1].shape)
+            leak = rng.normal(0, leakage, gt.data['gain'][..., 1, 1].shape) + 1j * \
+                   rng.normal(0, leakage, gt.data['gain'][..., 1, 1].shape)
             gt.data['gain'][..., 1, 0] = gt.data['gain'][..., 1, 1] * leak
         else:
             gt.data['gain'][..., 0, 1] = 0.0
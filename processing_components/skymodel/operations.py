@@ -8,8 +8,10 @@ from data_models.memory_data_models import SkyModel
 
 from processing_library.image.operations import copy_image
 from ..visibility.visibility_fitting import fit_visibility
+from ..imaging.base import predict_2d, predict_skycomponent_visibility
 
 from ..skycomponent.base import copy_skycomponent
+from ..visibility.base import copy_visibility
 
 log = logging.getLogger(__name__)
 
@@ -48,4 +50,25 @@ def solve_skymodel(vis, skymodel, gain=0.1, **kwargs):
 #        new_image = solve_image_arlexecute_workflow(vis, new_image, **kwargs)
         new_images.append(new_image)
     
-    return SkyModel(components=new_comps, images=new_images)
\ No newline at end of file
+    return SkyModel(components=new_comps, images=new_images)
+
+
+def predict_skymodel_visibility(vis, skymodel, **kwargs):
+    """Predict the visibility for a skymodel, adding to the existing visibility
+
+    The components are predicted directly and the images by predict_2d.
+
+    :param vis: Visibility or BlockVisibility to be predicted into
+    :param skymodel: SkyModel
+    :param kwargs: Parameters for predict_2d
+    :return: vis
+    """
+    if len(skymodel.components) > 0:
+        vis = predict_skycomponent_visibility(vis, skymodel.components)
+    
+    for im in skymodel.images:
+        imvis = copy_visibility(vis, zero=True)
+        imvis = predict_2d(imvis, im, **kwargs)
+        vis.data['vis'] += imvis.data['vis']
+    
+    return vis
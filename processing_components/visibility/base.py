@@ -13,7 +13,8 @@ from astropy.coordinates import SkyCoord
 
 from data_models.memory_data_models import Visibility, BlockVisibility, Configuration
 from data_models.polarisation import PolarisationFrame, ReceptorFrame, correlate_polarisation
-from processing_library.util.coordinate_support import xyz_to_uvw, uvw_to_xyz, skycoord_to_lmn, simulate_point
+from processing_library.util.coordinate_support import xyz_to_uvw, uvw_to_xyz, skycoord_to_lmn, simulate_point, \
+    xyz_to_antenna_uvw, baselines
 
 log = logging.getLogger(__name__)
 
@@ -33,7 +34,7 @@ def copy_visibility(vis: Union[Visibility, BlockVisibility], zero=False) -> Unio
     assert isinstance(vis, Visibility) or isinstance(vis, BlockVisibility), vis
     
     newvis = copy.copy(vis)
-    newvis.data = numpy.copy(vis.data)
+    newvis.data = vis.data.copy()
     if isinstance(vis, Visibility):
         newvis.cindex = vis.cindex
         newvis.blockvis = vis.blockvis
@@ -73,43 +74,29 @@ def create_visibility(config: Configuration, times: numpy.array, frequency: nump
     ntimes = len(times)
     npol = polarisation_frame.npol
     nrows = nbaselines * ntimes * nch
-    nrowsperintegration = nbaselines * nch
-    row = 0
     rvis = numpy.zeros([nrows, npol], dtype='complex')
     rweight = weight * numpy.ones([nrows, npol])
-    rtimes = numpy.zeros([nrows])
-    rfrequency = numpy.zeros([nrows])
-    rchannel_bandwidth = numpy.zeros([nrows])
-    rantenna1 = numpy.zeros([nrows], dtype='int')
-    rantenna2 = numpy.zeros([nrows], dtype='int')
-    ruvw = numpy.zeros([nrows, 3])
-    
-    # Do each hour angle in turn
-    for iha, ha in enumerate(times):
-        
-        # Calculate the positions of the antennas as seen for this hour angle
-        # and declination
-        ant_pos = xyz_to_uvw(ants_xyz, ha, phasecentre.dec.rad)
-        rtimes[row:row + nrowsperintegration] = ha * 43200.0 / numpy.pi
-        
-        # Loop over all pairs of antennas. Note that a2>a1
-        for a1 in range(nants):
-            for a2 in range(a1 + 1, nants):
-                rantenna1[row:row + nch] = a1
-                rantenna2[row:row + nch] = a2
-                
-                # Loop over all frequencies and polarisations
-                for ch in range(nch):
-                    # noinspection PyUnresolvedReferences
-                    k = frequency[ch] / constants.c.value
-                    ruvw[row, :] = (ant_pos[a2, :] - ant_pos[a1, :]) * k
-                    rfrequency[row] = frequency[ch]
-                    rchannel_bandwidth[row] = channel_bandwidth[ch]
-                    row += 1
+    
+    # Rows are ordered by hour angle, then pairs of antennas (a2>a1), then frequency
+    times = numpy.asarray(times)
+    frequency = numpy.asarray(frequency)
+    rtimes = numpy.repeat(times * 43200.0 / numpy.pi, nbaselines * nch)
+    rfrequency = numpy.tile(frequency, ntimes * nbaselines)
+    rchannel_bandwidth = numpy.tile(numpy.asarray(channel_bandwidth), ntimes * nbaselines)
+    a1, a2 = numpy.triu_indices(nants, 1)
+    rantenna1 = numpy.tile(numpy.repeat(a1, nch), ntimes)
+    rantenna2 = numpy.tile(numpy.repeat(a2, nch), ntimes)
+    
+    # Calculate the positions of the antennas as seen for all hour angles and the declination,
+    # then the baselines in wavelengths
+    ant_pos = xyz_to_antenna_uvw(ants_xyz, times, phasecentre.dec.rad)
+    # noinspection PyUnresolvedReferences
+    k = frequency / constants.c.value
+    ruvw = (baselines(ant_pos)[:, :, numpy.newaxis, :] * k[numpy.newaxis, numpy.newaxis, :, numpy.newaxis])
+    ruvw = ruvw.reshape([nrows, 3])
     
     if zerow:
         ruvw[..., 2] = 0.0
-    assert row == nrows
     rintegration_time = numpy.full_like(rtimes, integration_time)
     vis = Visibility(uvw=ruvw, time=rtimes, antenna1=rantenna1, antenna2=rantenna2,
                      frequency=rfrequency, vis=rvis,
@@ -159,22 +146,12 @@ def create_blockvisibility(config: Configuration,
     visshape = [ntimes, nants, nants, nch, npol]
     rvis = numpy.zeros(visshape, dtype='complex')
     rweight = weight * numpy.ones(visshape)
-    rtimes = numpy.zeros([ntimes])
-    ruvw = numpy.zeros([ntimes, nants, nants, 3])
+    rtimes = numpy.asarray(times) * 43200.0 / numpy.pi
     
-    # Do each hour angle in turn
-    for iha, ha in enumerate(times):
-        
-        # Calculate the positions of the antennas as seen for this hour angle
-        # and declination
-        ant_pos = xyz_to_uvw(ants_xyz, ha, phasecentre.dec.rad)
-        rtimes[iha] = ha * 43200.0 / numpy.pi
-        
-        # Loop over all pairs of antennas. Note that a2>a1
-        for a1 in range(nants):
-            for a2 in range(a1 + 1, nants):
-                ruvw[iha, a2, a1, :] = (ant_pos[a2, :] - ant_pos[a1, :])
-                ruvw[iha, a1, a2, :] = (ant_pos[a1, :] - ant_pos[a2, :])
+    # Calculate the positions of the antennas as seen for all hour angles and the declination.
+    # ruvw[:, a2, a1] holds the baseline from a1 to a2, and ruvw[:, a1, a2] its negative
+    ant_pos = xyz_to_antenna_uvw(ants_xyz, times, phasecentre.dec.rad)
+    ruvw = ant_pos[:, :, numpy.newaxis, :] - ant_pos[:, numpy.newaxis, :, :]
     
     rintegration_time = numpy.full_like(rtimes, integration_time)
     rchannel_bandwidth = numpy.full_like(frequency, channel_bandwidth)
@@ -191,48 +168,68 @@ def create_blockvisibility(config: Configuration,
     return vis
 
 
-def create_visibility_from_rows(vis: Union[Visibility, BlockVisibility], rows: numpy.ndarray, makecopy=True) \
-        -> None:
+def create_visibility_from_rows(vis: Union[Visibility, BlockVisibility], rows, makecopy=True) \
+        -> Union[Visibility, BlockVisibility]:
     """ Create a Visibility from selected rows
 
+    Only the selected rows are touched: the new visibility shares all other attributes with vis. If makecopy is
+    False and the selected rows are contiguous, the data columns are views on those of vis so no data is copied and
+    changes are seen in vis. Otherwise the selected rows are copied.
+
     :param vis: Visibility
-    :param rows: Boolean array of row selction
-    :param makecopy: Make a deep copy (True)
+    :param rows: Boolean array of row selection, array of row indices, or slice
+    :param makecopy: Copy the selected rows (True) or view them where possible (False)
     :return: Visibility
     """
     
-    if rows is None or numpy.sum(rows) == 0:
+    if isinstance(rows, numpy.ndarray) and rows.dtype == bool:
+        assert len(rows) == vis.nvis, "Length of rows does not agree with length of visibility"
+    
+    rows = vis_rows_selection(rows, vis.nvis)
+    if rows is None:
         return None
     
-    assert len(rows) == vis.nvis, "Length of rows does not agree with length of visibility"
+    newvis = copy.copy(vis)
+    newvis.data = vis.data[rows]
+    if makecopy and isinstance(rows, slice):
+        newvis.data = newvis.data.copy()
     
     if isinstance(vis, Visibility):
-        
-        if makecopy:
-            newvis = copy_visibility(vis)
-            if vis.cindex is not None and len(rows) == len(vis.cindex):
-                newvis.cindex = vis.cindex[rows]
-            else:
-                newvis.cindex = None
-            if vis.blockvis is not None:
-                newvis.blockvis = vis.blockvis
-            newvis.data = copy.deepcopy(vis.data[rows])
-            return newvis
+        if vis.cindex is not None and len(vis.cindex) == vis.nvis:
+            newvis.cindex = vis.cindex[rows]
         else:
-            vis.data = copy.deepcopy(vis.data[rows])
-            if vis.cindex is not None:
-                vis.cindex = vis.cindex[rows]
-            return vis
-    else:
-        
-        if makecopy:
-            newvis = copy_visibility(vis)
-            newvis.data = copy.deepcopy(vis.data[rows])
-            return newvis
+            newvis.cindex = None
+    
+    return newvis
+
+
+def vis_rows_selection(rows, nvis):
+    """ Convert a row selection to a slice if the selected rows are contiguous, otherwise to an index array
+
+    Selecting with a slice gives views rather than copies.
+
+    :param rows: Boolean array of row selection, array of row indices, or slice
+    :param nvis: Number of rows
+    :return: slice or index array, None if no rows are selected
+    """
+    if isinstance(rows, slice):
+        start, stop, step = rows.indices(nvis)
+        if step != 1:
+            rows = numpy.arange(start, stop, step)
+        elif stop > start:
+            return slice(start, stop)
         else:
-            vis.data = copy.deepcopy(vis.data[rows])
-            
-            return vis
+            return None
+    
+    rows = numpy.asarray(rows)
+    if rows.dtype == bool:
+        rows = numpy.flatnonzero(rows)
+    if rows.size == 0:
+        return None
+    
+    if rows[-1] - rows[0] + 1 == rows.size and numpy.all(numpy.diff(rows) == 1):
+        return slice(int(rows[0]), int(rows[-1]) + 1)
+    return rows
 
 
 def phaserotate_visibility(vis: Visibility, newphasecentre: SkyCoord, tangent=True, inverse=False) -> Visibility:
@@ -314,97 +311,197 @@ def create_blockvisibility_from_ms(msname, channum=None, ack=False):
         str(fields), str(dds)))
     vis_list = list()
     for dd in dds:
-        dtab = table(msname, ack=ack).query('DATA_DESC_ID==%d' % dd, style='')
+        dtab = tab.query('DATA_DESC_ID==%d' % dd, style='')
         for field in fields:
             ms = dtab.query('FIELD_ID==%d' % field, style='')
             assert ms.nrows() > 0, "Empty selection for FIELD_ID=%d and DATA_DESC_ID=%d" % (field, dd)
             log.debug("create_blockvisibility_from_ms: Found %d rows" % (ms.nrows()))
-            time = ms.getcol('TIME')
-            channels = ms.getcol('DATA').shape[-2]
-            log.debug("create_visibility_from_ms: Found %d channels" % (channels))
             if channum is None:
-                channum = range(channels)
-            try:
-                ms_vis = ms.getcol('DATA')[:, channum, :]
-                ms_weight = ms.getcol('WEIGHT')[:, :]
-            except IndexError:
-                raise IndexError("channel number exceeds max. within ms")
-            uvw = -1 * ms.getcol('UVW')
-            antenna1 = ms.getcol('ANTENNA1')
-            antenna2 = ms.getcol('ANTENNA2')
-            integration_time = ms.getcol('INTERVAL')
-            
-            # Now get info from the subtables
-            spwtab = table('%s/SPECTRAL_WINDOW' % msname, ack=False)
-            cfrequency = spwtab.getcol('CHAN_FREQ')[dd][channum]
-            cchannel_bandwidth = spwtab.getcol('CHAN_WIDTH')[dd][channum]
-            nchan = cfrequency.shape[0]
-            
-            # Get polarisation info
-            poltab = table('%s/POLARIZATION' % msname, ack=False)
-            corr_type = poltab.getcol('CORR_TYPE')
-            # These correspond to the CASA Stokes enumerations
-            if numpy.array_equal(corr_type[0], [1, 2, 3, 4]):
-                polarisation_frame = PolarisationFrame('stokesIQUV')
-            elif numpy.array_equal(corr_type[0], [5, 6, 7, 8]):
-                polarisation_frame = PolarisationFrame('circular')
-            elif numpy.array_equal(corr_type[0], [9, 10, 11, 12]):
-                polarisation_frame = PolarisationFrame('linear')
-            else:
-                raise KeyError("Polarisation not understood: %s" % str(corr_type))
-            
-            npol = 4
-            
-            # Get configuration
-            anttab = table('%s/ANTENNA' % msname, ack=False)
-            nants = anttab.nrows()
-            mount = anttab.getcol('MOUNT')
-            names = anttab.getcol('NAME')
-            diameter = anttab.getcol('DISH_DIAMETER')
-            xyz = anttab.getcol('POSITION')
-            configuration = Configuration(name='', data=None, location=None,
-                                          names=names, xyz=xyz, mount=mount, frame=None,
-                                          receptor_frame=ReceptorFrame("linear"),
-                                          diameter=diameter)
-            
-            # Get phasecentres
-            fieldtab = table('%s/FIELD' % msname, ack=False)
-            pc = fieldtab.getcol('PHASE_DIR')[field, 0, :]
-            phasecentre = SkyCoord(ra=[pc[0]] * u.rad, dec=pc[1] * u.rad, frame='icrs', equinox='J2000')
-            
-            bv_times = numpy.unique(time)
-            ntimes = len(bv_times)
-            
-            bv_vis = numpy.zeros([ntimes, nants, nants, nchan, npol]).astype('complex')
-            bv_weight = numpy.zeros([ntimes, nants, nants, nchan, npol])
-            bv_uvw = numpy.zeros([ntimes, nants, nants, 3])
-            
-            time_last = time[0]
-            time_index = 0
-            for row, _ in enumerate(ms_vis):
-                # MS has shape [row, npol, nchan]
-                # BV has shape [ntimes, nants, nants, nchan, npol]
-                if time[row] != time_last:
-                    assert time[row] > time_last, "MS is not time-sorted - cannot convert"
-                    time_index += 1
-                    time_last = time[row]
-                bv_vis[time_index, antenna2[row], antenna1[row], ...] = ms_vis[row, ...]
-                bv_weight[time_index, antenna2[row], antenna1[row], :, ...] = ms_weight[row, numpy.newaxis, ...]
-                bv_uvw[time_index, antenna2[row], antenna1[row], :] = uvw[row, :]
-    
-            vis_list.append(BlockVisibility(uvw=bv_uvw,
-                                            time=bv_times,
-                                            frequency=cfrequency,
-                                            channel_bandwidth=cchannel_bandwidth,
-                                            vis=bv_vis,
-                                            weight=bv_weight,
-                                            configuration=configuration,
-                                            phasecentre=phasecentre,
-                                            polarisation_frame=polarisation_frame))
-        tab.close()
+                channum = range(ms.getcell('DATA', 0).shape[0])
+            log.debug("create_visibility_from_ms: Found %d channels" % (len(channum)))
+            metadata = _ms_metadata(msname, dd, field, channum)
+            vis_list.append(_ms_rows_to_blockvisibility(ms, 0, ms.nrows(), channum, metadata))
+    tab.close()
     return vis_list
 
 
+def create_blockvisibility_from_ms_iterator(msname, ntimes=1, channum=None, prefetch=True, ack=False):
+    """ Iterate through an MS, yielding BlockVisibility's of ntimes integrations
+
+    Only the rows and channels of one chunk are read at a time, using getcol/getcolslice with startrow and nrow,
+    so large MS can be processed in bounded memory. The chunks of each spectral window and field are returned in
+    turn. The MS must be time-sorted. If prefetch is True the next chunk is read on a background thread while the
+    caller processes the current one. For example::
+
+        for bvis in create_blockvisibility_from_ms_iterator(msname, ntimes=10, channum=range(0, 16)):
+            gt = solve_gaintable(bvis, model)
+
+    :param msname: File name of MS
+    :param ntimes: Number of integrations in each BlockVisibility
+    :param channum: range of channels e.g. range(17,32), default is None meaning all
+    :param prefetch: Read the next chunk in the background (True)
+    :return: BlockVisibility for each chunk
+    """
+    try:
+        from casacore.tables import table  # pylint: disable=import-error
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("casacore is not installed")
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    tab = table(msname, ack=ack)
+    fields = numpy.unique(tab.getcol('FIELD_ID'))
+    dds = numpy.unique(tab.getcol('DATA_DESC_ID'))
+    
+    def chunks():
+        """ Describe the chunks as (table, startrow, nrow, channum, metadata), reading only TIME """
+        for dd in dds:
+            dtab = tab.query('DATA_DESC_ID==%d' % dd, style='')
+            for field in fields:
+                ms = dtab.query('FIELD_ID==%d' % field, style='')
+                if ms.nrows() == 0:
+                    continue
+                chans = channum
+                if chans is None:
+                    chans = range(ms.getcell('DATA', 0).shape[0])
+                metadata = _ms_metadata(msname, dd, field, chans)
+                time = ms.getcol('TIME')
+                assert numpy.all(numpy.diff(time) >= 0.0), "MS is not time-sorted - cannot convert"
+                bv_times = numpy.unique(time)
+                for start in range(0, len(bv_times), ntimes):
+                    startrow = numpy.searchsorted(time, bv_times[start], side='left')
+                    endrow = numpy.searchsorted(time, bv_times[min(start + ntimes, len(bv_times)) - 1], side='right')
+                    yield ms, int(startrow), int(endrow - startrow), chans, metadata
+    
+    try:
+        if not prefetch:
+            for chunk in chunks():
+                yield _ms_rows_to_blockvisibility(*chunk)
+        else:
+            # Find all the chunks first so that only the background thread reads the MS while the caller works
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = None
+                for chunk in list(chunks()):
+                    next_future = executor.submit(_ms_rows_to_blockvisibility, *chunk)
+                    if future is not None:
+                        yield future.result()
+                    future = next_future
+                if future is not None:
+                    yield future.result()
+    finally:
+        tab.close()
+
+
+def _ms_metadata(msname, dd, field, channum):
+    """ Read the subtables of an MS for one spectral window and field
+
+    :return: dict of configuration, phasecentre, polarisation_frame, frequency, channel_bandwidth
+    """
+    from casacore.tables import table  # pylint: disable=import-error
+    
+    spwtab = table('%s/SPECTRAL_WINDOW' % msname, ack=False)
+    try:
+        cfrequency = spwtab.getcol('CHAN_FREQ')[dd][channum]
+        cchannel_bandwidth = spwtab.getcol('CHAN_WIDTH')[dd][channum]
+    except IndexError:
+        raise IndexError("channel number exceeds max. within ms")
+    
+    # Get polarisation info
+    poltab = table('%s/POLARIZATION' % msname, ack=False)
+    corr_type = poltab.getcol('CORR_TYPE')
+    # These correspond to the CASA Stokes enumerations
+    if numpy.array_equal(corr_type[0], [1, 2, 3, 4]):
+        polarisation_frame = PolarisationFrame('stokesIQUV')
+    elif numpy.array_equal(corr_type[0], [5, 6, 7, 8]):
+        polarisation_frame = PolarisationFrame('circular')
+    elif numpy.array_equal(corr_type[0], [9, 10, 11, 12]):
+        polarisation_frame = PolarisationFrame('linear')
+    else:
+        raise KeyError("Polarisation not understood: %s" % str(corr_type))
+    
+    # Get configuration
+    anttab = table('%s/ANTENNA' % msname, ack=False)
+    mount = anttab.getcol('MOUNT')
+    names = anttab.getcol('NAME')
+    diameter = anttab.getcol('DISH_DIAMETER')
+    xyz = anttab.getcol('POSITION')
+    configuration = Configuration(name='', data=None, location=None,
+                                  names=names, xyz=xyz, mount=mount, frame=None,
+                                  receptor_frame=ReceptorFrame("linear"),
+                                  diameter=diameter)
+    
+    # Get phasecentres
+    fieldtab = table('%s/FIELD' % msname, ack=False)
+    pc = fieldtab.getcol('PHASE_DIR')[field, 0, :]
+    phasecentre = SkyCoord(ra=[pc[0]] * u.rad, dec=pc[1] * u.rad, frame='icrs', equinox='J2000')
+    
+    return {'configuration': configuration, 'phasecentre': phasecentre, 'polarisation_frame': polarisation_frame,
+            'frequency': cfrequency, 'channel_bandwidth': cchannel_bandwidth, 'nants': anttab.nrows()}
+
+
+def _ms_getcol_channels(ms, column, channum, startrow, nrow):
+    """ Read a [row, chan, pol] column for the selected channels only
+
+    A range of channels is read with getcolslice, otherwise the span covering the channels is read and indexed.
+    """
+    npol = ms.getcell(column, startrow).shape[-1]
+    if isinstance(channum, range) and channum.step > 0:
+        return ms.getcolslice(column, blc=[channum.start, 0], trc=[channum[-1], npol - 1], inc=[channum.step, 1],
+                              startrow=startrow, nrow=nrow)
+    channum = numpy.asarray(channum)
+    cmin, cmax = numpy.min(channum), numpy.max(channum)
+    data = ms.getcolslice(column, blc=[cmin, 0], trc=[cmax, npol - 1], startrow=startrow, nrow=nrow)
+    return data[:, channum - cmin, :]
+
+
+def _ms_rows_to_blockvisibility(ms, startrow, nrow, channum, metadata):
+    """ Convert nrow time-sorted rows of an MS starting at startrow to a BlockVisibility
+
+    :param ms: casacore table, selected for one spectral window and field
+    :param startrow: First row
+    :param nrow: Number of rows
+    :param channum: Channels to read
+    :param metadata: From _ms_metadata
+    :return: BlockVisibility
+    """
+    time = ms.getcol('TIME', startrow=startrow, nrow=nrow)
+    assert numpy.all(numpy.diff(time) >= 0.0), "MS is not time-sorted - cannot convert"
+    try:
+        ms_vis = _ms_getcol_channels(ms, 'DATA', channum, startrow, nrow)
+    except IndexError:
+        raise IndexError("channel number exceeds max. within ms")
+    ms_weight = ms.getcol('WEIGHT', startrow=startrow, nrow=nrow)
+    uvw = -1 * ms.getcol('UVW', startrow=startrow, nrow=nrow)
+    antenna1 = ms.getcol('ANTENNA1', startrow=startrow, nrow=nrow)
+    antenna2 = ms.getcol('ANTENNA2', startrow=startrow, nrow=nrow)
+    
+    nants = metadata['nants']
+    nchan = len(metadata['frequency'])
+    npol = 4
+    
+    bv_times = numpy.unique(time)
+    ntimes = len(bv_times)
+    
+    # MS has shape [row, nchan, npol], BV has shape [ntimes, nants, nants, nchan, npol]
+    time_index = numpy.searchsorted(bv_times, time)
+    bv_vis = numpy.zeros([ntimes, nants, nants, nchan, npol], dtype='complex')
+    bv_weight = numpy.zeros([ntimes, nants, nants, nchan, npol])
+    bv_uvw = numpy.zeros([ntimes, nants, nants, 3])
+    bv_vis[time_index, antenna2, antenna1, ...] = ms_vis
+    bv_weight[time_index, antenna2, antenna1, ...] = ms_weight[:, numpy.newaxis, :]
+    bv_uvw[time_index, antenna2, antenna1, :] = uvw
+    
+    return BlockVisibility(uvw=bv_uvw,
+                           time=bv_times,
+                           frequency=metadata['frequency'],
+                           channel_bandwidth=metadata['channel_bandwidth'],
+                           vis=bv_vis,
+                           weight=bv_weight,
+                           configuration=metadata['configuration'],
+                           phasecentre=metadata['phasecentre'],
+                           polarisation_frame=metadata['polarisation_frame'])
+
+
 def create_visibility_from_ms(msname, channum=None, ack=False):
     """ Minimal MS to BlockVisibility converter
 
@@ -22,8 +22,6 @@ import numpy
 
 from astropy import constants
 
-from processing_library.util.array_functions import average_chunks, average_chunks2
-
 from data_models.memory_data_models import Visibility, BlockVisibility
 from data_models.parameters import get_parameter
 
@@ -131,11 +129,10 @@ def decoalesce_visibility(vis: Visibility, overwrite=False, **kwargs) -> BlockVi
     vshape = decomp_vis.data['vis'].shape
 
     npol = vshape[-1]
-    dvis = numpy.zeros(vshape, dtype='complex')
-    assert numpy.max(vis.cindex) < dvis.size
+    assert numpy.max(vis.cindex) < numpy.prod(vshape)
     assert numpy.max(vis.cindex) < vis.vis.shape[0], "Incorrect template used in decoalescing"
-    for i in range(dvis.size // npol):
-        decomp_vis.data['vis'].flat[i:i + npol] = vis.data['vis'][vis.cindex[i]]
+    # Each [time, ant2, ant1, channel] cell takes all polarisations of its coalesced row
+    decomp_vis.data['vis'][...] = vis.data['vis'][vis.cindex].reshape(vshape)
 
     log.debug('decoalesce_visibility: Coalesced %s, decoalesced %s' % (vis_summary(vis),
                                                                        vis_summary(
@@ -157,50 +154,35 @@ def average_in_blocks(vis, uvw, wts, times, integration_time, frequency, channel
 
     # Pol independent weighting
     allpwtsgrid = numpy.sum(wts, axis=4)
-    # Pol and frequency independent weighting
-    allcpwtsgrid = numpy.sum(allpwtsgrid, axis=3)
-    # Pol and time independent weighting
-    alltpwtsgrid = numpy.sum(allpwtsgrid, axis=0)
+
+    # Only baselines with some non-zero weight are coalesced, in the order a2, a1
+    a2s, a1s = numpy.nonzero(numpy.any(allpwtsgrid != 0.0, axis=(0, 3)))
 
     # Now calculate on a baseline basis the time and frequency averaging. We do this by looking at
     # the maximum uv distance for all data and for a given baseline. The integration time and
     # channel bandwidth are scale appropriately.
     uvmax = numpy.sqrt(numpy.max(uvw[:, 0] ** 2 + uvw[:, 1] ** 2 + uvw[:, 2] ** 2))
-    time_average = numpy.ones([nant, nant], dtype='int')
-    frequency_average = numpy.ones([nant, nant], dtype='int')
-    ua = numpy.arange(nant)
-    for a2 in ua:
-        for a1 in ua:
-            if allpwtsgrid[:, a2, a1, :].any() > 0.0:
-                uvdist = numpy.max(numpy.sqrt(uvw[:, a2, a1, 0] ** 2 + uvw[:, a2, a1, 1] ** 2), axis=0)
-                if uvdist > 0.0:
-                    time_average[a2, a1] = min(max_time_coal,
-                                               max(1, int(round((time_coal * uvmax / uvdist)))))
-                    frequency_average[a2, a1] = min(max_frequency_coal,
-                                                    max(1, int(round(frequency_coal * uvmax / uvdist))))
-                else:
-                    time_average[a2, a1] = max_time_coal
-                    frequency_average[a2, a1] = max_frequency_coal
-
-    # See how many time chunks and frequency we need for each baseline. To do this we use the same averaging that
-    # we will use later for the actual data_models. This tells us the number of chunks required for each baseline.
-    frequency_grid, time_grid = numpy.meshgrid(frequency, times)
-    channel_bandwidth_grid, integration_time_grid = numpy.meshgrid(channel_bandwidth, integration_time)
-    cnvis = 0
-    time_chunk_len = numpy.ones([nant, nant], dtype='int')
-    frequency_chunk_len = numpy.ones([nant, nant], dtype='int')
-    for a2 in ua:
-        for a1 in ua:
-            if (time_average[a2, a1] > 0) & (frequency_average[a2, a1] > 0 & (allpwtsgrid[:, a2, a1, ...].any() > 0.0)):
-                time_chunks, _ = average_chunks(times, allcpwtsgrid[:, a2, a1], time_average[a2, a1])
-                time_chunk_len[a2, a1] = time_chunks.shape[0]
-                frequency_chunks, _ = average_chunks(frequency, alltpwtsgrid[a2, a1, :], frequency_average[a2, a1])
-                frequency_chunk_len[a2, a1] = frequency_chunks.shape[0]
-                nrows = time_chunk_len[a2, a1] * frequency_chunk_len[a2, a1]
-                cnvis += nrows
-
-    # Now we know enough to define the output coalesced arrays. The shape will be
+    uvdist = numpy.max(numpy.sqrt(uvw[:, a2s, a1s, 0] ** 2 + uvw[:, a2s, a1s, 1] ** 2), axis=0)
+    time_average = numpy.full(len(a2s), max_time_coal, dtype='int')
+    frequency_average = numpy.full(len(a2s), max_frequency_coal, dtype='int')
+    nonzero = uvdist > 0.0
+    time_average[nonzero] = numpy.minimum(max_time_coal,
+                                          numpy.maximum(1, numpy.round(time_coal * uvmax / uvdist[nonzero])))
+    frequency_average[nonzero] = numpy.minimum(max_frequency_coal,
+                                               numpy.maximum(1, numpy.round(frequency_coal * uvmax /
+                                                                            uvdist[nonzero])))
+
+    # The number of time and frequency chunks for each baseline. The output shape will be
     # succesive a1, a2: [len_time_chunks[a2,a1], a2, a1, len_frequency_chunks[a2,a1]]
+    def nchunks(n, average):
+        return numpy.where(average > 1, (n + average - 1) // numpy.maximum(average, 1), n)
+
+    time_chunk_len = nchunks(ntimes, time_average)
+    frequency_chunk_len = nchunks(nchan, frequency_average)
+    nrows = time_chunk_len * frequency_chunk_len
+    visstart = numpy.cumsum(nrows) - nrows
+    cnvis = int(numpy.sum(nrows))
+
     ctime = numpy.zeros([cnvis])
     cfrequency = numpy.zeros([cnvis])
     cchannel_bandwidth = numpy.zeros([cnvis])
@@ -217,57 +199,64 @@ def average_in_blocks(vis, uvw, wts, times, integration_time, frequency, channel
 
     cindex = numpy.zeros([rowgrid.size], dtype='int')
 
-    # Now go through, chunking up the various arrays. Everything is converted into an array with
-    # axes [time, channel] and then it is averaged over time and frequency chunks for
-    # this baseline.
+    # Everything is converted into an array with axes [baseline, time, channel] and then it is averaged over
+    # time and frequency chunks. Baselines with the same averaging factors are averaged together, first over
+    # frequency and then over time, as in average_chunks2.
     # To aid decoalescence we will need an index of which output elements a given input element
     # contributes to. This is a many to one. The decoalescence will then just consist of using
     # this index to extract the coalesced value that a given input element contributes towards.
 
-    visstart = 0
-    for a2 in ua:
-        for a1 in ua:
-            if (time_chunk_len[a2, a1] > 0) & (frequency_chunk_len[a2, a1] > 0) & \
-                    (allpwtsgrid[:, a2, a1, :].any() > 0.0):
-
-                nrows = time_chunk_len[a2, a1] * frequency_chunk_len[a2, a1]
-                rows = slice(visstart, visstart + nrows)
-
-                cindex.flat[rowgrid[:, a2, a1, :]] = numpy.array(range(visstart, visstart + nrows))
-
-                ca1[rows] = a1
-                ca2[rows] = a2
-
-                # Average over time and frequency for case where polarisation isn't an issue
-                def average_from_grid(arr):
-                    return average_chunks2(arr, allpwtsgrid[:, a2, a1, :],
-                                           (time_average[a2, a1], frequency_average[a2, a1]))[0]
-
-                ctime[rows] = average_from_grid(time_grid).flatten()
-                cfrequency[rows] = average_from_grid(frequency_grid).flatten()
-
-                for axis in range(3):
-                    uvwgrid = numpy.outer(uvw[:, a2, a1, axis], frequency / constants.c.value)
-                    cuvw[rows, axis] = average_from_grid(uvwgrid).flatten()
-
-                # For some variables, we need the sum not the average
-                def sum_from_grid(arr):
-                    result = average_chunks2(arr, allpwtsgrid[:, a2, a1, :],
-                                             (time_average[a2, a1], frequency_average[a2, a1]))
-                    return result[0] * result[0].size
-
-                cintegration_time[rows] = sum_from_grid(integration_time_grid).flatten()
-                cchannel_bandwidth[rows] = sum_from_grid(channel_bandwidth_grid).flatten()
-
-                # For the polarisations we have to perform the time-frequency average separately for each polarisation
-                for pol in range(npol):
-                    result = average_chunks2(vis[:, a2, a1, :, pol], wts[:, a2, a1, :, pol],
-                                             (time_average[a2, a1], frequency_average[a2, a1]))
-                    cvis[rows, pol], cwts[rows, pol] = result[0].flatten(), result[1].flatten()
-
-                visstart += nrows
-
-    assert cnvis == visstart, "Mismatch between number of rows in coalesced visibility and index"
+    def average_along(arr, wt, chunksize, axis):
+        if chunksize <= 1:
+            return arr, wt
+        places = numpy.arange(0, arr.shape[axis], chunksize)
+        chunks = numpy.add.reduceat(wt * arr, places, axis=axis)
+        weights = numpy.add.reduceat(wt, places, axis=axis)
+        chunks[weights > 0.0] = chunks[weights > 0.0] / weights[weights > 0.0]
+        return chunks, weights
+
+    def average_from_grid(arr, wt, ta, fa):
+        arr = numpy.broadcast_to(arr, wt.shape).astype(arr.dtype)
+        arr, wt = average_along(arr, wt, fa, axis=2)
+        return average_along(arr, wt, ta, axis=1)
+
+    frequency_grid = numpy.broadcast_to(frequency[numpy.newaxis, numpy.newaxis, :], (1, ntimes, nchan))
+    time_grid = numpy.broadcast_to(times[numpy.newaxis, :, numpy.newaxis], (1, ntimes, nchan))
+    channel_bandwidth_grid = numpy.broadcast_to(channel_bandwidth[numpy.newaxis, numpy.newaxis, :], (1, ntimes, nchan))
+    integration_time_grid = numpy.broadcast_to(integration_time[numpy.newaxis, :, numpy.newaxis], (1, ntimes, nchan))
+
+    factors = numpy.stack([time_average, frequency_average], axis=1)
+    for ta, fa in numpy.unique(factors, axis=0):
+        group = numpy.nonzero((time_average == ta) & (frequency_average == fa))[0]
+        a2, a1 = a2s[group], a1s[group]
+        n = nrows[group[0]]
+        rows = (visstart[group][:, numpy.newaxis] + numpy.arange(n)[numpy.newaxis, :]).flatten()
+
+        # The index is assigned as by cindex.flat[rowgrid[:, a2, a1, :]] = range(visstart, visstart + nrows),
+        # which repeats the row numbers cyclically over [time, channel]
+        cells = rowgrid[:, a2, a1, :].transpose(1, 0, 2).reshape(len(group), ntimes * nchan)
+        cindex[cells] = visstart[group][:, numpy.newaxis] + numpy.arange(ntimes * nchan)[numpy.newaxis, :] % n
+
+        ca1[rows] = numpy.repeat(a1, n)
+        ca2[rows] = numpy.repeat(a2, n)
+
+        # Average over time and frequency for case where polarisation isn't an issue
+        pwts = allpwtsgrid[:, a2, a1, :].transpose(1, 0, 2)
+        ctime[rows] = average_from_grid(time_grid, pwts, ta, fa)[0].flatten()
+        cfrequency[rows] = average_from_grid(frequency_grid, pwts, ta, fa)[0].flatten()
+
+        for axis in range(3):
+            uvwgrid = uvw[:, a2, a1, axis].T[:, :, numpy.newaxis] * (frequency / constants.c.value)
+            cuvw[rows, axis] = average_from_grid(uvwgrid, pwts, ta, fa)[0].flatten()
+
+        # For some variables, we need the sum not the average
+        cintegration_time[rows] = (average_from_grid(integration_time_grid, pwts, ta, fa)[0] * n).flatten()
+        cchannel_bandwidth[rows] = (average_from_grid(channel_bandwidth_grid, pwts, ta, fa)[0] * n).flatten()
+
+        # For the polarisations we perform the time-frequency average using the weights for each polarisation
+        result = average_from_grid(vis[:, a2, a1, ...].transpose(1, 0, 2, 3),
+                                   wts[:, a2, a1, ...].transpose(1, 0, 2, 3), ta, fa)
+        cvis[rows, :], cwts[rows, :] = result[0].reshape(-1, npol), result[1].reshape(-1, npol)
 
     return cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex
 
@@ -276,6 +265,12 @@ def convert_blocks(vis, uvw, wts, times, integration_time, frequency, channel_ba
     # The input visibility is a block of shape [ntimes, nant, nant, nchan, npol]. We will map this
     # into rows like vis[npol] and with additional columns antenna1, antenna2, frequency
 
+    # The BlockVisibility may hold any of these as lists
+    times = numpy.asarray(times)
+    integration_time = numpy.asarray(integration_time)
+    frequency = numpy.asarray(frequency)
+    channel_bandwidth = numpy.asarray(channel_bandwidth)
+
     ntimes, nant, _, nchan, npol = vis.shape
     assert nchan == len(frequency)
 
@@ -299,31 +294,28 @@ def convert_blocks(vis, uvw, wts, times, integration_time, frequency, channel_ba
 
     cindex = numpy.zeros([rowgrid.size], dtype='int')
 
-    # Now go through, chunking up the various arrays. Everything is converted into an array with
-    # axes [time, channel] and then it is averaged over time and frequency chunks for
-    # this baseline.
     # To aid decoalescence we will need an index of which output elements a given input element
     # contributes to. This is a many to one. The decoalescence will then just consist of using
     # this index to extract the coalesced value that a given input element contributes towards.
 
-    row = 0
-    for itime in range(ntimes):
-        for a1 in range(nant):
-            for a2 in range(a1 + 1, nant):
-                for chan in range(nchan):
-                    ca1[row] = a1
-                    ca2[row] = a2
-                    cfrequency[row] = frequency[chan]
-                    ctime[row] = times[itime]
-
-                    cuvw[row, :] = uvw[itime, a2, a1, :] * frequency[chan] / constants.c.value
-
-                    cindex.flat[rowgrid[itime, a2, a1, chan]] = row
-                    cintegration_time[row] = integration_time[itime]
-                    cchannel_bandwidth[row] = channel_bandwidth[chan]
-                    cvis[row, :] = vis[itime, a2, a1, chan, :]
-                    cwts[row, :] = wts[itime, a2, a1, chan, :]
-                    row += 1
+    # The rows are ordered by time, a1, a2 (a2 > a1), channel so every column is a gather from the block
+    # using the upper triangle baseline indices
+    a1, a2 = numpy.triu_indices(nant, 1)
+    nbaselines = len(a1)
+
+    ca1[...] = numpy.tile(numpy.repeat(a1, nchan), ntimes)
+    ca2[...] = numpy.tile(numpy.repeat(a2, nchan), ntimes)
+    cfrequency[...] = numpy.tile(frequency, ntimes * nbaselines)
+    cchannel_bandwidth[...] = numpy.tile(channel_bandwidth, ntimes * nbaselines)
+    ctime[...] = numpy.repeat(times, nbaselines * nchan)
+    cintegration_time[...] = numpy.repeat(integration_time, nbaselines * nchan)
+
+    cuvw[...] = (uvw[:, a2, a1, numpy.newaxis, :] * frequency[numpy.newaxis, numpy.newaxis, :, numpy.newaxis]
+                 / constants.c.value).reshape([cnvis, 3])
+    cvis[...] = vis[:, a2, a1, ...].reshape([cnvis, npol])
+    cwts[...] = wts[:, a2, a1, ...].reshape([cnvis, npol])
+
+    cindex[rowgrid[:, a2, a1, :].flatten()] = numpy.arange(cnvis)
 
     return cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex
 
@@ -342,8 +334,7 @@ def decoalesce_vis(vshape, cvis, cindex):
     npol = vshape[-1]
     dvis = numpy.zeros(vshape, dtype='complex')
     assert numpy.max(cindex) < dvis.size
-    for i in range(dvis.size // npol):
-        dvis.flat[i:i + npol] = cvis[cindex[i]]
+    dvis.reshape([dvis.size // npol, npol])[...] = cvis[cindex]
 
     return dvis
 
@@ -19,20 +19,25 @@ from data_models.memory_data_models import Visibility, BlockVisibility
 
 from ..visibility.coalesce import coalesce_visibility, decoalesce_visibility
 from ..visibility.iterators import vis_timeslice_iter, vis_wslice_iter
-from ..visibility.base import create_visibility_from_rows
+from ..visibility.base import create_visibility_from_rows, vis_rows_selection
 
 log = logging.getLogger(__name__)
 
 
-def visibility_scatter(vis: Visibility, vis_iter, vis_slices=1) -> List[Visibility]:
+def visibility_scatter(vis: Visibility, vis_iter, vis_slices=1, makecopy=True) -> List[Visibility]:
     """Scatter a visibility into a list of subvisibilities
     
     If vis_iter is over time then the type of the outvisibilities will be the same as inout
     If vis_iter is over w then the type of the output visibilities will always be Visibility
+    
+    Only the rows of each slice are copied. If makecopy is False, slices of contiguous rows are views on vis instead
+    so that changes are written back directly. This is safe only if the consumers do not rely on the slices being
+    independent, e.g. the time slices share the rows on their boundaries.
 
     :param vis: Visibility
     :param vis_iter: visibility iterator
     :param vis_slices: Number of slices to be made
+    :param makecopy: Copy the rows of each slice (True) or view them where possible (False)
     :return: list of subvisibilitys
     """
     
@@ -48,7 +53,7 @@ def visibility_scatter(vis: Visibility, vis_iter, vis_slices=1) -> List[Visibili
         
     visibility_list = list()
     for i, rows in enumerate(vis_iter(avis, vis_slices=vis_slices)):
-        subvis = create_visibility_from_rows(avis, rows)
+        subvis = create_visibility_from_rows(avis, rows, makecopy=makecopy)
         visibility_list.append(subvis)
         
     return visibility_list
@@ -77,15 +82,18 @@ def visibility_gather(visibility_list: List[Visibility], vis: Visibility, vis_it
     else:
         cvis = vis
 
-    rowses = []
     for i, rows in enumerate(vis_iter(cvis, vis_slices=vis_slices)):
-        rowses.append(rows)
-
-    for i, rows in enumerate(rowses):
         assert i < len(visibility_list), "Gather not consistent with scatter for slice %d" % i
-        if visibility_list[i] is not None and numpy.sum(rows):
-            assert numpy.sum(rows) == visibility_list[i].nvis, "Mismatch in number of rows in gather for slice %d" % i
-            cvis.data[rows] = visibility_list[i].data[...]
+        rows = vis_rows_selection(rows, cvis.nvis)
+        if visibility_list[i] is not None and rows is not None:
+            if isinstance(rows, slice):
+                nrows = rows.stop - rows.start
+            else:
+                nrows = len(rows)
+            assert nrows == visibility_list[i].nvis, "Mismatch in number of rows in gather for slice %d" % i
+            # Slices that are views on cvis already hold the data in place
+            if not numpy.may_share_memory(visibility_list[i].data['vis'], cvis.data['vis']):
+                cvis.data[rows] = visibility_list[i].data
     
     if vis_iter == vis_wslice_iter and isinstance(vis, BlockVisibility):
         return decoalesce_visibility(cvis)
@@ -35,9 +35,11 @@ def vis_null_iter(vis: Union[Visibility, BlockVisibility], vis_slices=1) -> nump
 def vis_timeslice_iter(vis: Visibility, vis_slices=None) -> numpy.ndarray:
     """ Time slice iterator
 
+    The rows of each slice are found by binary search in the rows sorted on time, see vis_sort_index.
+
     :param vis:
     :param vis_slices: Number of time slices
-    :return: Boolean array with selected rows=True
+    :return: Array of the indices of the selected rows, in ascending order
     """
     assert vis is not None
     assert isinstance(vis, Visibility) or isinstance(vis, BlockVisibility), vis
@@ -53,8 +55,7 @@ def vis_timeslice_iter(vis: Visibility, vis_slices=None) -> numpy.ndarray:
     else:
         timeslice = timemax - timemin
     
-    for box in boxes:
-        rows = numpy.abs(vis.time - box) <= 0.5 * timeslice
+    for rows in vis_slice_rows(vis.time, vis_sort_index(vis, 'time'), boxes, 0.5 * timeslice, inclusive=True):
         yield rows
 
 
@@ -91,9 +92,11 @@ def vis_wslices(vis: Visibility, wslice=10.0) -> int:
 def vis_wslice_iter(vis: Visibility, vis_slices=1) -> numpy.ndarray:
     """ W slice iterator
 
+    The rows of each slice are found by binary search in the rows sorted on w, see vis_sort_index.
+
     :param vis:
     :param vis_slices: Number of slices
-    :return: Boolean array with selected rows=True
+    :return: Array of the indices of the selected rows, in ascending order
     """
     assert isinstance(vis, Visibility), vis
     wmaxabs = numpy.max(numpy.abs(vis.w))
@@ -104,6 +107,82 @@ def vis_wslice_iter(vis: Visibility, vis_slices=1) -> numpy.ndarray:
     else:
         wstack = 2 * wmaxabs
     
+    for rows in vis_slice_rows(vis.w, vis_sort_index(vis, 'w'), boxes, 0.5 * wstack, inclusive=False):
+        yield rows
+
+
+def vis_sort_index(vis: Union[Visibility, BlockVisibility], name='time'):
+    """ Order of the rows sorted on time or w
+
+    The order is cached on vis.data. Before it is reused it is checked against the current values, which is
+    O(nvis), so that changes to the data in place (e.g. to w) are safe.
+
+    :param vis: Visibility or BlockVisibility
+    :param name: 'time' or 'w'
+    :return: Index array, or None if the rows are already in order
+    """
+    if name == 'time':
+        values = vis.time
+    else:
+        values = vis.w
+    
+    cache = getattr(vis.data, 'sort_index', None)
+    index = None
+    if cache is not None:
+        index = cache.get(name)
+    if index is not None and len(index) == len(values) and _is_sorted(values[index]):
+        return index
+    
+    if _is_sorted(values):
+        index = None
+    else:
+        index = numpy.argsort(values, kind='stable')
+    if cache is not None:
+        cache[name] = index
+    return index
+
+
+def vis_slice_rows(values, index, boxes, halfwidth, inclusive=True):
+    """ Iterate over the rows with values within halfwidth of each box centre
+
+    :param values: Values for each row e.g. time
+    :param index: Order of the rows sorted on values, None if already in order
+    :param boxes: Centres of the slices
+    :param halfwidth: Half width of the slices
+    :param inclusive: Include rows at exactly halfwidth from the centre
+    :return: Array of the indices of the selected rows, in ascending order
+    """
+    if index is None:
+        svalues = values
+    else:
+        svalues = values[index]
+    nvalues = len(svalues)
+    
     for box in boxes:
-        rows = numpy.abs(vis.w - box) < 0.5 * wstack
-        yield rows
\ No newline at end of file
+        
+        def inside(value):
+            if inclusive:
+                return numpy.abs(value - box) <= halfwidth
+            else:
+                return numpy.abs(value - box) < halfwidth
+        
+        lo = numpy.searchsorted(svalues, box - halfwidth, side='left')
+        hi = numpy.searchsorted(svalues, box + halfwidth, side='right')
+        # Correct the ends for rounding in box -/+ halfwidth so that the selection is exactly that of inside
+        while lo > 0 and inside(svalues[lo - 1]):
+            lo -= 1
+        while lo < hi and not inside(svalues[lo]):
+            lo += 1
+        while hi < nvalues and inside(svalues[hi]):
+            hi += 1
+        while hi > lo and not inside(svalues[hi - 1]):
+            hi -= 1
+        
+        if index is None:
+            yield numpy.arange(lo, hi)
+        else:
+            yield numpy.sort(index[lo:hi])
+
+
+def _is_sorted(values):
+    return numpy.all(values[1:] >= values[:-1])
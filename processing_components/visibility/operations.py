@@ -2,6 +2,7 @@
 
 """
 
+import copy
 import logging
 from typing import Union
 
@@ -12,9 +13,10 @@ warnings.simplefilter(action='ignore', category=PendingDeprecationWarning)
 import numpy
 from astropy.coordinates import SkyCoord
 
-from data_models.memory_data_models import BlockVisibility, Visibility, QA
+from data_models.memory_data_models import BlockVisibility, Visibility, ColumnarData, QA
 
 from processing_library.imaging.imaging_params import get_frequency_map
+from processing_library.util.array_functions import invert_2x2
 from processing_library.util.coordinate_support import skycoord_to_lmn, simulate_point
 
 from ..visibility.base import copy_visibility
@@ -28,6 +30,9 @@ def append_visibility(vis: Union[Visibility, BlockVisibility], othervis: Union[V
         -> Union[Visibility, BlockVisibility]:
     """Append othervis to vis
     
+    This copies all the rows of vis, so to accumulate many visibilities use VisibilityBuilder or
+    concatenate_visibility instead.
+    
     :param vis:
     :param othervis:
     :return: Visibility vis + othervis
@@ -37,12 +42,102 @@ def append_visibility(vis: Union[Visibility, BlockVisibility], othervis: Union[V
         return othervis
     
     assert isinstance(vis, Visibility) or isinstance(vis, BlockVisibility), vis
+    assert_vis_appendable(vis, othervis)
+    vis.data = ColumnarData.concatenate([vis.data, othervis.data])
+    return vis
+
+
+def assert_vis_appendable(vis, othervis):
+    """ Assert that the rows of othervis may be appended to vis
+    
+    :param vis:
+    :param othervis:
+    """
     assert vis.polarisation_frame == othervis.polarisation_frame
     assert abs(vis.phasecentre.ra.value - othervis.phasecentre.ra.value) < 1e-15
     assert abs(vis.phasecentre.dec.value - othervis.phasecentre.dec.value) < 1e-15
     assert vis.phasecentre.separation(othervis.phasecentre).value < 1e-15
-    vis.data = numpy.hstack((vis.data, othervis.data))
-    return vis
+
+
+class VisibilityBuilder:
+    """ Accumulate the rows of a sequence of Visibility or BlockVisibility
+    
+    The columns are held in buffers whose capacity doubles when full, so each row is copied a bounded number of
+    times however many visibilities are appended. Repeated append_visibility copies all the rows accumulated so far
+    on every call. Use as::
+    
+        builder = VisibilityBuilder()
+        for vis in vis_iter:
+            builder.append(vis)
+        fullvis = builder.finalize()
+    """
+    
+    def __init__(self, capacity=0):
+        """ VisibilityBuilder
+        
+        :param capacity: Initial number of rows to allocate, if known
+        """
+        self.capacity = capacity
+        self.nrows = 0
+        self.vis = None
+        self.buffers = None
+    
+    def append(self, vis: Union[Visibility, BlockVisibility]):
+        """ Append the rows of vis
+        
+        The first visibility appended supplies the other attributes of the final visibility.
+        
+        :param vis: Visibility or BlockVisibility
+        :return: self
+        """
+        assert isinstance(vis, Visibility) or isinstance(vis, BlockVisibility), vis
+        if self.vis is None:
+            self.vis = vis
+            self.capacity = max(self.capacity, vis.data.size)
+            self.buffers = [(name, numpy.empty((self.capacity,) + col.shape[1:], dtype=col.dtype))
+                            for name, col in vis.data.columns.items()]
+        else:
+            assert type(vis) == type(self.vis), "Cannot append %s to %s" % (type(vis), type(self.vis))
+            assert_vis_appendable(self.vis, vis)
+        
+        nrows = self.nrows + vis.data.size
+        if nrows > self.capacity:
+            self.capacity = max(nrows, 2 * self.capacity)
+            log.debug("VisibilityBuilder: growing to %d rows" % self.capacity)
+            for i, (name, buffer) in enumerate(self.buffers):
+                newbuffer = numpy.empty((self.capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+                newbuffer[:self.nrows] = buffer[:self.nrows]
+                self.buffers[i] = (name, newbuffer)
+        
+        for name, buffer in self.buffers:
+            buffer[self.nrows:nrows] = vis.data[name]
+        self.nrows = nrows
+        return self
+    
+    def finalize(self, sort=False) -> Union[Visibility, BlockVisibility]:
+        """ Return the accumulated visibility, and reset the builder
+        
+        :param sort: Sort back to index order
+        :return: Visibility or BlockVisibility, None if nothing has been appended
+        """
+        if self.vis is None:
+            return None
+        
+        columns = list()
+        for name, buffer in self.buffers:
+            if self.nrows < self.capacity:
+                buffer = buffer[:self.nrows].copy()
+            columns.append((name, buffer))
+        newvis = copy.copy(self.vis)
+        newvis.data = ColumnarData(columns)
+        if sort:
+            newvis = sort_visibility(newvis, ['index'])
+        
+        self.capacity = 0
+        self.nrows = 0
+        self.vis = None
+        self.buffers = None
+        return newvis
 
 
 def sort_visibility(vis, order=None):
@@ -54,13 +149,16 @@ def sort_visibility(vis, order=None):
     """
     if order is None:
         order = ['index']
-    vis.data = numpy.sort(vis.data, order=order)
+    vis.data = vis.data[vis.data.argsort(order)]
     return vis
 
 
 def concatenate_visibility(vis_list, sort=True):
     """Concatenate a list of visibilities, with an optional sort back to index order
 
+    The columns are allocated once at the final size and, if sorting, the rows are written directly to their
+    sorted positions.
+
     :param vis_list:
     :return: Visibility
     """
@@ -69,19 +167,13 @@ def concatenate_visibility(vis_list, sort=True):
     
     assert len(vis_list) > 0
     
-    vis = None
-    for v in vis_list:
-        if vis is None:
-            vis = v
-        else:
-            assert v.polarisation_frame == vis.polarisation_frame
-            assert v.phasecentre.separation(vis.phasecentre).value < 1e-15
-            vis.data = numpy.hstack((vis.data, v.data))
+    vis = vis_list[0]
+    for v in vis_list[1:]:
+        assert v.polarisation_frame == vis.polarisation_frame
+        assert v.phasecentre.separation(vis.phasecentre).value < 1e-15
     
-    assert vis is not None
-    
-    if sort:
-        vis = sort_visibility(vis, ['index'])
+    order = ['index'] if sort else None
+    vis.data = ColumnarData.concatenate([v.data for v in vis_list], order=order)
     
     return vis
 
@@ -207,7 +299,9 @@ def divide_visibility(vis: BlockVisibility, modelvis: BlockVisibility):
     frequency due to the model structure is removed and the data can be averaged to a limit determined
     by the instrumental stability. The weight is adjusted to compensate for the division.
     
-    Zero divisions are avoided and the corresponding weight set to zero.
+    Zero divisions are avoided and the corresponding weight set to zero. For polarised data, the 2x2
+    division is done in one batch over all baselines and channels, and singular model matrices are
+    handled likewise by zeroing the weight.
 
     :param vis:
     :param modelvis:
@@ -215,39 +309,58 @@ def divide_visibility(vis: BlockVisibility, modelvis: BlockVisibility):
     """
     assert isinstance(vis, Visibility) or isinstance(vis, BlockVisibility), vis
     
+    x, xwt = divide_visibility_data(vis.vis, vis.weight, modelvis.vis, vis.polarisation_frame.npol)
+    
+    pointsource_vis = BlockVisibility(data=None, frequency=vis.frequency, channel_bandwidth=vis.channel_bandwidth,
+                                      phasecentre=vis.phasecentre, configuration=vis.configuration,
+                                      uvw=vis.uvw, time=vis.time, integration_time=vis.integration_time, vis=x,
+                                      weight=xwt)
+    return pointsource_vis
+
+
+def divide_visibility_data(vis, weight, modelvis, npol):
+    """ Divide visibility data by model data forming the equivalent point source visibility and weight
+
+    This works on the arrays [nrows, nants, nants, nchan, npol] so that a subset of rows can be processed
+    without creating a BlockVisibility.
+
+    :param vis: Visibility data
+    :param weight: Visibility weight
+    :param modelvis: Model visibility data
+    :param npol: Number of polarisations
+    :return: point source visibility, point source weight
+    """
     # Different for scalar and vector/matrix cases
-    isscalar = vis.polarisation_frame.npol == 1
+    isscalar = npol == 1
     
     if isscalar:
         # Scalar case is straightforward
-        x = numpy.zeros_like(vis.vis)
-        xwt = numpy.abs(modelvis.vis) ** 2 * vis.weight
+        x = numpy.zeros_like(vis)
+        xwt = numpy.abs(modelvis) ** 2 * weight
         mask = xwt > 0.0
-        x[mask] = vis.vis[mask] / modelvis.vis[mask]
+        x[mask] = vis[mask] / modelvis[mask]
     else:
-        nrows, nants, _, nchan, npol = vis.vis.shape
+        nrows, nants, _, nchan, _ = vis.shape
         nrec = 2
         assert nrec * nrec == npol
         xshape = (nrows, nants, nants, nchan, nrec, nrec)
         x = numpy.zeros(xshape, dtype='complex')
         xwt = numpy.zeros(xshape)
-        for row in range(nrows):
-            for ant1 in range(nants):
-                for ant2 in range(ant1 + 1, nants):
-                    for chan in range(nchan):
-                        ovis = numpy.matrix(vis.vis[row, ant2, ant1, chan].reshape([2, 2]))
-                        mvis = numpy.matrix(modelvis.vis[row, ant2, ant1, chan].reshape([2, 2]))
-                        wt = numpy.matrix(vis.weight[row, ant2, ant1, chan].reshape([2, 2]))
-                        x[row, ant2, ant1, chan] = numpy.matmul(numpy.linalg.inv(mvis), ovis)
-                        xwt[row, ant2, ant1, chan] = numpy.dot(mvis, numpy.multiply(wt, mvis.H)).real
+        # Only the lower triangle vis[row, ant2, ant1] with ant2 > ant1 is filled
+        ant2, ant1 = numpy.tril_indices(nants, -1)
+        ovis = vis[:, ant2, ant1].reshape((nrows, len(ant1), nchan, nrec, nrec))
+        mvis = modelvis[:, ant2, ant1].reshape((nrows, len(ant1), nchan, nrec, nrec))
+        wt = weight[:, ant2, ant1].reshape((nrows, len(ant1), nchan, nrec, nrec))
+        # Singular model matrices cannot be divided out so the weight is set to zero
+        imvis, valid = invert_2x2(mvis)
+        x[:, ant2, ant1] = numpy.einsum('...ij,...jk->...ik', imvis, ovis)
+        pwt = numpy.einsum('...ij,...jk->...ik', mvis, wt * numpy.conjugate(numpy.swapaxes(mvis, -1, -2))).real
+        pwt[~valid] = 0.0
+        xwt[:, ant2, ant1] = pwt
         x = x.reshape((nrows, nants, nants, nchan, nrec * nrec))
         xwt = xwt.reshape((nrows, nants, nants, nchan, nrec * nrec))
     
-    pointsource_vis = BlockVisibility(data=None, frequency=vis.frequency, channel_bandwidth=vis.channel_bandwidth,
-                                      phasecentre=vis.phasecentre, configuration=vis.configuration,
-                                      uvw=vis.uvw, time=vis.time, integration_time=vis.integration_time, vis=x,
-                                      weight=xwt)
-    return pointsource_vis
+    return x, xwt
 
 
 def integrate_visibility_by_channel(vis: BlockVisibility) -> BlockVisibility:
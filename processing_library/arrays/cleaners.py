@@ -41,19 +41,28 @@ def hogbom(dirty, psf, window, gain, thresh, niter, fracthresh, prefix=''):
     res = numpy.array(dirty)
     pmax = psf.max()
     assert pmax > 0.0
+
+    # Compress the window into an active set. Peak search and residual updates are then confined
+    # to the window, and the residual outside is brought up to date once at the end.
+    active_set = create_active_set(window)
+    if active_set is not None:
+        box = active_set[1]
+        log.info("hogbom %s Window fill factor %.3f, active box %s" %
+                 (prefix, len(active_set[0]) / float(dirty.size), str(box)))
+        assert len(active_set[0]) > 0, "Window does not allow any clean components"
+
     log.info('hogbom %s: Timing for setup: %.3f (s) for dirty shape %s, PSF shape %s' %
              (prefix, time.time() - starttime, str(dirty.shape), str(psf.shape)))
     starttime = time.time()
     aiter = 0
     for i in range(niter):
         aiter = i + 1
-        if window is not None:
-            mx, my = numpy.unravel_index((numpy.fabs(res * window)).argmax(), dirty.shape)
-        else:
-            mx, my = numpy.unravel_index((numpy.fabs(res)).argmax(), dirty.shape)
+        mx, my, _ = find_max_abs_active(res, active_set)
         mval = res[mx, my] * gain / pmax
         comps[mx, my] += mval
         a1o, a2o = overlapIndices(dirty, psf, mx, my)
+        if active_set is not None:
+            a1o, a2o = restrict_overlap(a1o, a2o, box)
         if niter < 10 or i % (niter // 10) == 0:
             log.info("hogbom %s Minor cycle %d, peak %s at [%d, %d]" % (prefix, i, res[mx, my], mx, my))
         res[a1o[0]:a1o[1], a1o[2]:a1o[3]] -= psf[a2o[0]:a2o[1], a2o[2]:a2o[3]] * mval
@@ -61,6 +70,11 @@ def hogbom(dirty, psf, window, gain, thresh, niter, fracthresh, prefix=''):
             log.info("hogbom %s Stopped at iteration %d, peak %s at [%d, %d]" % (prefix, i, res[mx, my], mx, my))
             break
     log.info("hogbom %s End of minor cycle" % prefix)
+
+    if active_set is not None and box != (0, dirty.shape[0], 0, dirty.shape[1]):
+        inside = numpy.array(res[box[0]:box[1], box[2]:box[3]])
+        res = dirty - convolve_components(comps, psf)
+        res[box[0]:box[1], box[2]:box[3]] = inside
     
     dtime = time.time() - starttime
     log.info('%s Timing for clean: %.3f (s) for dirty %s, PSF %s , %d iterations, time per clean %.3f (ms)' %
@@ -75,6 +89,7 @@ def hogbom_complex(dirty_q, dirty_u, psf_q, psf_u, window, gain, thresh, niter,
     This uses the complex Hogbom CLEAN for polarised data (2016MNRAS.462.3483P)
 
     The starting-point for the code was the standard Hogbom clean algorithm available in ARL.
+    The PSF is assumed to be the same in Q and U. Only the central part of the PSFs is compared.
 
     Args:
     dirty_q (numpy array): The dirty Q Image, i.e., the Q Image to be deconvolved.
@@ -93,42 +108,127 @@ def hogbom_complex(dirty_q, dirty_u, psf_q, psf_u, window, gain, thresh, niter,
     res.real: real residual image.
     res.imag: imaginary residual image.
     """
+    assert psf_q.shape == psf_u.shape
+    cx, cy = psf_q.shape[0] // 2, psf_q.shape[1] // 2
+    assert numpy.all(psf_q[cx - 7:cx + 8, cy - 7:cy + 8] == psf_u[cx - 7:cx + 8, cy - 7:cy + 8]), \
+        "PSF in Q and U must be the same"
     
+    # Form complex Q+iU from the polarisation data:
+    comps, res = hogbom_polarisation([dirty_q + 1j * dirty_u], [psf_q], window, gain, thresh, niter, fracthresh,
+                                     prefix='hogbom_complex')
+    return comps[0].real, comps[0].imag, res[0].real, res[0].imag
+
+
+def hogbom_polarisation(dirty_planes, psfs, window, gain, thresh, niter, fracthresh, prefix=''):
+    """ Clean the point spread function from a number of real or complex planes in one pass
+
+    This is used to clean I, Q+iU (using complex Hogbom CLEAN 2016MNRAS.462.3483P) and V for a channel
+    together. The planes share the window, and the peak search and residual updates are confined to the
+    box enclosing it as in hogbom. Each plane keeps an image of the absolute residual over the box that is
+    updated only where the PSF is subtracted. The planes are independent so the result for each plane is
+    the same as a separate Hogbom clean.
+
+    :param dirty_planes: List of dirty planes, real or complex
+    :param psfs: List of point spread-functions, one per plane
+    :param window: Regions where clean components are allowed. If None, entire dirty Image is allowed
+    :param gain: The "loop gain", i.e., the fraction of the brightest pixel that is removed in each iteration
+    :param thresh: Cleaning stops when the maximum of the absolute deviation of the residual is less than this value
+    :param niter: Maximum number of components to make in each plane if the threshold `thresh` is not hit
+    :param fracthresh: Fractional threshold, relative to the peak of each plane
+    :param prefix: Prefix to log messages to provide context
+    :return: list of clean component planes, list of residual planes
+    """
+    starttime = time.time()
     assert 0.0 < gain < 2.0
     assert niter > 0
-    
-    # Form complex Q+iU from the polarisation data:
-    dirty_complex = dirty_q + 1j * dirty_u
 
-    log.info("hogbom_mod: Max abs in dirty image = %.6f" % numpy.max(numpy.abs(dirty_complex)))
-    absolutethresh = max(thresh, fracthresh * numpy.absolute(dirty_complex).max())
-    log.info("hogbom_mod: Start of minor cycle")
-    log.info("hogbom_mod: This minor cycle will stop at %d iterations or peak < %s" % (niter, absolutethresh))
+    nplanes = len(dirty_planes)
+    assert len(psfs) == nplanes, "Require one PSF per plane"
+    pmax = [psf.max() for psf in psfs]
+    for plane in range(nplanes):
+        assert pmax[plane] > 0.0, "PSF for plane %d is zero" % plane
     
-    comps = numpy.zeros(dirty_complex.shape, dtype='complex128')
-    res = numpy.array(dirty_complex)
+    res = [numpy.array(dirty) for dirty in dirty_planes]
+    comps = [numpy.zeros_like(r) for r in res]
+    shape = res[0].shape
     
-    assert numpy.all(psf_q == psf_u)
+    active_set = create_active_set(window)
+    if active_set is not None:
+        box = active_set[1]
+        log.info("hogbom_polarisation %s: Window fill factor %.3f, active box %s" %
+                 (prefix, len(active_set[0]) / float(res[0].size), str(box)))
+        assert len(active_set[0]) > 0, "Window does not allow any clean components"
+        mask = numpy.array(window[box[0]:box[1], box[2]:box[3]] != 0, dtype='float')
+    else:
+        box = (0, shape[0], 0, shape[1])
+        mask = None
     
-    pmax = psf_q.max()
-    assert pmax > 0.0
-    log.info("hogbom: Max abs in dirty Image = %.6f" % numpy.absolute(res).max())
+    # Each plane keeps the absolute residual over the box enclosing the window, zero where components are
+    # not allowed. Only the patch under the subtracted PSF is refreshed, so the peak search is an argmax
+    # over this buffer with no temporaries.
+    boxshape = (box[1] - box[0], box[3] - box[2])
+    absres = numpy.zeros([nplanes, boxshape[0], boxshape[1]])
+    absolutethresh = numpy.zeros([nplanes])
+    for plane in range(nplanes):
+        absolutethresh[plane] = max(thresh, fracthresh * numpy.abs(res[plane]).max())
+        numpy.absolute(res[plane][box[0]:box[1], box[2]:box[3]], out=absres[plane])
+        if mask is not None:
+            absres[plane] *= mask
+        log.info("hogbom_polarisation %s: plane %d max abs in dirty image = %.6f, minor cycle will stop at %d "
+                 "iterations or peak < %.6f" % (prefix, plane, numpy.abs(res[plane]).max(), niter,
+                                                absolutethresh[plane]))
+
+    log.info('hogbom_polarisation %s: Timing for setup: %.3f (s) for dirty shape %s, PSF shape %s, %d planes' %
+             (prefix, time.time() - starttime, str(shape), str(psfs[0].shape), nplanes))
+    starttime = time.time()
+    
+    active = list(range(nplanes))
+    aiter = 0
     for i in range(niter):
-        if window is not None:
-            mx, my = numpy.unravel_index((numpy.absolute(res * window)).argmax(), dirty_complex.shape)
-        else:
-            mx, my = numpy.unravel_index((numpy.absolute(res)).argmax(), dirty_complex.shape)
-        mval = res[mx, my] * gain / pmax
-        comps[mx, my] += mval
-        a1o, a2o = overlapIndices(dirty_complex, psf_q, mx, my)
-        if niter < 10 or i % (niter // 10) == 0:
-            log.info("hogbom: Minor cycle %d, peak %s at [%d, %d]" % (i, res[mx, my], mx, my))
-        res[a1o[0]:a1o[1], a1o[2]:a1o[3]] -= psf_q[a2o[0]:a2o[1], a2o[2]:a2o[3]] * mval
-        if numpy.abs(res[mx, my]) < absolutethresh:
-            log.info("hogbom: Stopped at iteration %d, peak %s at [%d, %d]" % (i, res[mx, my], mx, my))
+        if len(active) == 0:
             break
-    log.info("hogbom: End of minor cycle")
-    return comps.real, comps.imag, res.real, res.imag
+        for plane in list(active):
+            aiter += 1
+            psf = psfs[plane]
+            bx, by = numpy.unravel_index(absres[plane].argmax(), boxshape)
+            mx, my = bx + box[0], by + box[2]
+            mval = res[plane][mx, my] * gain / pmax[plane]
+            comps[plane][mx, my] += mval
+            a1o, a2o = overlapIndices(res[plane], psf, mx, my)
+            a1o, a2o = restrict_overlap(a1o, a2o, box)
+            if niter < 10 or i % (niter // 10) == 0:
+                log.info("hogbom_polarisation %s: plane %d minor cycle %d, peak %s at [%d, %d]" %
+                         (prefix, plane, i, res[plane][mx, my], mx, my))
+            patch = res[plane][a1o[0]:a1o[1], a1o[2]:a1o[3]]
+            patch -= psf[a2o[0]:a2o[1], a2o[2]:a2o[3]] * mval
+            bxlo, bxhi, bylo, byhi = a1o[0] - box[0], a1o[1] - box[0], a1o[2] - box[2], a1o[3] - box[2]
+            abspatch = absres[plane, bxlo:bxhi, bylo:byhi]
+            numpy.absolute(patch, out=abspatch)
+            if mask is not None:
+                abspatch *= mask[bxlo:bxhi, bylo:byhi]
+            if numpy.abs(res[plane][mx, my]) < absolutethresh[plane]:
+                log.info("hogbom_polarisation %s: plane %d stopped at iteration %d, peak %s at [%d, %d]" %
+                         (prefix, plane, i, res[plane][mx, my], mx, my))
+                active.remove(plane)
+    log.info("hogbom_polarisation %s: End of minor cycle" % prefix)
+
+    if active_set is not None and box != (0, shape[0], 0, shape[1]):
+        for plane in range(nplanes):
+            inside = numpy.array(res[plane][box[0]:box[1], box[2]:box[3]])
+            if numpy.iscomplexobj(comps[plane]):
+                model = convolve_components(comps[plane].real, psfs[plane]) + \
+                        1j * convolve_components(comps[plane].imag, psfs[plane])
+            else:
+                model = convolve_components(comps[plane], psfs[plane])
+            res[plane] = dirty_planes[plane] - model
+            res[plane][box[0]:box[1], box[2]:box[3]] = inside
+
+    dtime = time.time() - starttime
+    log.info('hogbom_polarisation %s: Timing for clean: %.3f (s) for dirty %s, PSF %s , %d iterations, '
+             'time per clean %.3f (ms)' % (prefix, dtime, str(shape), str(psfs[0].shape), aiter,
+                                           1000.0 * dtime / max(aiter, 1)))
+
+    return comps, res
 
 
 def overlapIndices(res, psf, peakx, peaky):
@@ -162,7 +262,102 @@ def argmax(a):
     return numpy.unravel_index(a.argmax(), a.shape)
 
 
-def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=''):
+def create_active_set(window):
+    """ Compress a window into the set of pixels where clean components are allowed
+
+    The active set is the flat indices of the allowed pixels plus the bounding box that
+    encloses them. Searching and updating only the active set costs in proportion to the
+    fill factor of the window rather than to the size of the image.
+
+    :param window: 2D window, non-zero where clean components are allowed. None means no window
+    :return: (flat indices, (xlo, xhi, ylo, yhi)) or None if there is no window
+    """
+    if window is None:
+        return None
+    allowed = numpy.flatnonzero(window)
+    if len(allowed) == 0:
+        return allowed, (0, 0, 0, 0)
+    x, y = numpy.unravel_index(allowed, window.shape)
+    return allowed, (int(x.min()), int(x.max()) + 1, int(y.min()), int(y.max()) + 1)
+
+
+def find_max_abs_active(a, active_set):
+    """ Find the location and value of the absolute maximum of a 2D array within an active set
+
+    :param a: array to be searched
+    :param active_set: Active set from create_active_set, or None to search all of a
+    :return: x, y, absolute value at peak
+    """
+    if active_set is None:
+        mx, my = numpy.unravel_index(numpy.abs(a).argmax(), a.shape)
+        return mx, my, numpy.abs(a[mx, my])
+    allowed = active_set[0]
+    if len(allowed) == 0:
+        return 0, 0, 0.0
+    values = numpy.abs(numpy.take(a, allowed))
+    peak = values.argmax()
+    mx, my = numpy.unravel_index(allowed[peak], a.shape)
+    return mx, my, values[peak]
+
+
+def restrict_overlap(lhs, rhs, box):
+    """ Restrict the overlap indices from overlapIndices to a bounding box
+
+    :param lhs: limits in the residual
+    :param rhs: limits in the psf
+    :param box: bounding box (xlo, xhi, ylo, yhi) in the residual
+    :return: (limits in residual, limits in psf), empty if there is no overlap
+    """
+    xlo, xhi = max(lhs[0], box[0]), min(lhs[1], box[1])
+    ylo, yhi = max(lhs[2], box[2]), min(lhs[3], box[3])
+    xhi = max(xlo, xhi)
+    yhi = max(ylo, yhi)
+    return (xlo, xhi, ylo, yhi), \
+           (rhs[0] + xlo - lhs[0], rhs[1] - lhs[1] + xhi, rhs[2] + ylo - lhs[2], rhs[3] - lhs[3] + yhi)
+
+
+def convolve_components(comps, psf):
+    """ Convolve a component image by the psf, aligned as in the minor cycle subtraction
+
+    This is the sum of all the psf subtractions made at the components, clipped as in
+    overlapIndices, evaluated with one zero-padded FFT.
+
+    :param comps: component image
+    :param psf: point spread function
+    :return: convolved image, same shape as comps
+    """
+    nx, ny = comps.shape
+    wx, wy = psf.shape[0] // 2, psf.shape[1] // 2
+    kernel = psf[:2 * wx, :2 * wy]
+    shape = [nx + 2 * wx, ny + 2 * wy]
+    convolved = numpy.fft.irfft2(numpy.fft.rfft2(comps, shape) * numpy.fft.rfft2(kernel, shape), shape)
+    return convolved[wx:wx + nx, wy:wy + ny]
+
+
+def create_msclean_psf_stack(psf, scales):
+    """ Calculate the scale convolved PSFs used by msclean
+    
+    These depend only on the PSF and the scales, so may be calculated once for repeated calls to msclean.
+    
+    :param psf: The point spread-function
+    :param scales: Scales (in pixels width) to be used
+    :return: scale stack for the PSF, scale-scale convolved PSFs, coupling matrix, all for unit peak PSF
+    """
+    lpsf = psf / psf.max()
+    
+    pscaleshape = [len(scales), lpsf.shape[0], lpsf.shape[1]]
+    pscalestack = create_scalestack(pscaleshape, scales, norm=True)
+    psf_scalescalestack = convolve_convolve_scalestack(pscalestack, numpy.array(lpsf))
+    
+    # Evaluate the coupling matrix between the various scale sizes.
+    coupling_matrix = numpy.zeros([len(scales), len(scales)])
+    for iscale in numpy.arange(len(scales)):
+        for iscale1 in numpy.arange(len(scales)):
+            coupling_matrix[iscale, iscale1] = numpy.max(psf_scalescalestack[iscale, iscale1, :, :])
+    return pscalestack, psf_scalescalestack, coupling_matrix
+
+
+def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix='', psf_stack=None):
     """ Perform multiscale clean
 
     Multiscale CLEAN (IEEE Journal of Selected Topics in Sig Proc, 2008 vol. 2 pp. 793-801)
@@ -178,6 +373,7 @@ def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=
     :param thresh: Cleaning stops when the maximum of the absolute deviation of the residual is less than this value
     :param niter: Maximum number of components to make if the threshold "thresh" is not hit
     :param scales: Scales (in pixels width) to be used
+    :param psf_stack: PSF stacks from create_msclean_psf_stack, calculated here if None
     :return: clean component image, residual image
     """
     
@@ -197,7 +393,6 @@ def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=
     dmax = dirty.max()
     dpeak = argmax(dirty)
     log.info("msclean %s: Peak of Dirty = %.6f Jy/beam at %s " % (prefix, dmax, dpeak))
-    lpsf = psf / pmax
     ldirty = dirty / pmax
 
     # Create the scale images and form all the various products we need. We
@@ -208,17 +403,11 @@ def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=
     scaleshape = [len(scales), ldirty.shape[0], ldirty.shape[1]]
     scalestack = create_scalestack(scaleshape, scales, norm=True)
 
-    pscaleshape = [len(scales), lpsf.shape[0], lpsf.shape[1]]
-    pscalestack = create_scalestack(pscaleshape, scales, norm=True)
-
     res_scalestack = convolve_scalestack(scalestack, numpy.array(ldirty))
-    psf_scalescalestack = convolve_convolve_scalestack(pscalestack, numpy.array(lpsf))
-
-    # Evaluate the coupling matrix between the various scale sizes.
-    coupling_matrix = numpy.zeros([len(scales), len(scales)])
-    for iscale in numpy.arange(len(scales)):
-        for iscale1 in numpy.arange(len(scales)):
-            coupling_matrix[iscale, iscale1] = numpy.max(psf_scalescalestack[iscale, iscale1, :, :])
+    if psf_stack is None:
+        psf_stack = create_msclean_psf_stack(psf, scales)
+    pscalestack, psf_scalescalestack, coupling_matrix = psf_stack
+    
     log.info("msclean %s: Coupling matrix =\n %s" % (prefix, coupling_matrix))
 
     # The window is scale dependent - we form it by smoothing and thresholding
@@ -226,13 +415,18 @@ def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=
     # edge of the Image.
 
     if window is None:
-        windowstack = None
+        active_sets = None
+        box = None
     else:
         windowstack = numpy.zeros_like(scalestack)
         windowstack[convolve_scalestack(scalestack, window) > 0.9] = 1.0
-
-    if windowstack is not None:
         assert numpy.sum(windowstack) > 0
+        active_sets = [create_active_set(windowstack[iscale]) for iscale in range(len(scales))]
+        # Only the zero scale residual is returned so the other scales need only be kept up to date
+        # over the box enclosing all the active sets
+        box = union_box([active_set[1] for active_set in active_sets])
+        log.info("msclean %s: Window fill factor %.3f, active box %s" %
+                 (prefix, numpy.sum(windowstack[0]) / float(dirty.size), str(box)))
 
     log.info("msclean %s: Max abs in dirty Image = %.6f Jy/beam" % (prefix, numpy.fabs(res_scalestack[0, :, :]).max()))
     absolutethresh = max(thresh, fracthresh * numpy.fabs(res_scalestack[0, :, :]).max())
@@ -247,7 +441,7 @@ def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=
     for i in range(niter):
         aiter = i + 1
         # Find peak over all smoothed images
-        mx, my, mscale = find_max_abs_stack(res_scalestack, windowstack, coupling_matrix)
+        mx, my, mscale = find_max_abs_stack(res_scalestack, active_sets, coupling_matrix)
         # Find the values to subtract, accounting for the coupling matrix
         mval = res_scalestack[mscale, mx, my] / coupling_matrix[mscale, mscale]
         if niter < 10 or i % (niter // 10) == 0:
@@ -262,9 +456,14 @@ def msclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, prefix=
         lhs, rhs = overlapIndices(dirty, psf, mx, my)
         if numpy.abs(mval) > 0:
             # Cross subtract from other scales
-            for iscale in range(len(scales)):
-                res_scalestack[iscale, lhs[0]:lhs[1], lhs[2]:lhs[3]] -= \
-                    psf_scalescalestack[iscale, mscale, rhs[0]:rhs[1], rhs[2]:rhs[3]] * gain * mval
+            res_scalestack[0, lhs[0]:lhs[1], lhs[2]:lhs[3]] -= \
+                psf_scalescalestack[0, mscale, rhs[0]:rhs[1], rhs[2]:rhs[3]] * gain * mval
+            slhs, srhs = lhs, rhs
+            if box is not None:
+                slhs, srhs = restrict_overlap(lhs, rhs, box)
+            for iscale in range(1, len(scales)):
+                res_scalestack[iscale, slhs[0]:slhs[1], slhs[2]:slhs[3]] -= \
+                    psf_scalescalestack[iscale, mscale, srhs[0]:srhs[1], srhs[2]:srhs[3]] * gain * mval
             comps[lhs[0]:lhs[1], lhs[2]:lhs[3]] += \
                 pscalestack[mscale, rhs[0]:rhs[1], rhs[2]:rhs[3]] * gain * mval
         else:
@@ -360,10 +559,22 @@ def convolve_convolve_scalestack(scalestack, img):
     return convolved
 
 
-def find_max_abs_stack(stack, windowstack, couplingmatrix):
+def union_box(boxes):
+    """ Find the bounding box enclosing a number of bounding boxes
+
+    :param boxes: list of (xlo, xhi, ylo, yhi), empty boxes are ignored
+    :return: (xlo, xhi, ylo, yhi)
+    """
+    boxes = [b for b in boxes if b[1] > b[0] and b[3] > b[2]]
+    if len(boxes) == 0:
+        return 0, 0, 0, 0
+    return min(b[0] for b in boxes), max(b[1] for b in boxes), min(b[2] for b in boxes), max(b[3] for b in boxes)
+
+
+def find_max_abs_stack(stack, active_sets, couplingmatrix):
     """Find the location and value of the absolute maximum in this stack
     :param stack: stack to be searched
-    :param windowstack: Window for the search
+    :param active_sets: Active set for the search for each scale (see create_active_set), or None
     :param couplingmatrix: Coupling matrix between difference scales
     :return: x, y, scale
 
@@ -374,18 +585,15 @@ def find_max_abs_stack(stack, windowstack, couplingmatrix):
     py = 0
     nscales = stack.shape[0]
     assert nscales > 0
-    pshape = [stack.shape[1], stack.shape[2]]
     for iscale in range(nscales):
-        if windowstack is not None:
-            resid = stack[iscale, :, :] * windowstack[iscale, :, :] / couplingmatrix[iscale, iscale]
-        else:
-            resid = stack[iscale, :, :] / couplingmatrix[iscale, iscale]
-
         # Find the peak in the scaled residual image
-        mx, my = numpy.unravel_index(numpy.abs(resid).argmax(), pshape)
+        if active_sets is not None:
+            mx, my, thisabsmax = find_max_abs_active(stack[iscale, :, :], active_sets[iscale])
+        else:
+            mx, my, thisabsmax = find_max_abs_active(stack[iscale, :, :], None)
+        thisabsmax /= numpy.abs(couplingmatrix[iscale, iscale])
 
         # Is this the peak over all scales?
-        thisabsmax = numpy.abs(resid[mx, my])
         if thisabsmax > pabsmax:
             px = mx
             py = my
@@ -466,7 +674,31 @@ def spheroidal_function(vnu):
     return value
 
 
-def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, findpeak='ARL', prefix=''):
+def create_msmfsclean_psf_stack(psf, scales):
+    """ Calculate the scale and moment convolved PSFs used by msmfsclean
+    
+    These depend only on the PSF and the scales, so may be calculated once for repeated calls to msmfsclean.
+    
+    :param psf: The point spread-function moments [2 * nmoments, ny, nx]
+    :param scales: Scales (in pixels width) to be used
+    :return: scale stack for the PSF, scale-scale moment-moment PSF, Hessian and its inverse, all for unit peak PSF
+    """
+    lpsf = psf / psf.max()
+    
+    pscaleshape = [len(scales), lpsf.shape[1], lpsf.shape[2]]
+    pscalestack = create_scalestack(pscaleshape, scales, norm=True)
+    
+    # Calculate scale scale moment moment psf, Hessian, and inverse of Hessian
+    # scale scale moment moment psf is needed for update of scale-moment residuals
+    # Hessian is needed in calculation of optimum for any iteration
+    # Inverse Hessian is needed to calculate principal solution in moment-space
+    ssmmpsf = calculate_scale_scale_moment_moment_psf(lpsf, pscalestack)
+    hsmmpsf, ihsmmpsf = calculate_scale_inverse_moment_moment_hessian(ssmmpsf)
+    return pscalestack, ssmmpsf, hsmmpsf, ihsmmpsf
+
+
+def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, findpeak='ARL', prefix='',
+               psf_stack=None):
     """ Perform image plane multiscale multi frequency clean
 
     This algorithm is documented as Algorithm 1 in: U. Rau and T. J. Cornwell, “A multi-scale multi-frequency
@@ -488,6 +720,7 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
     :param fracthresh: Fractional stopping threshold
     :param findpeak: Method of finding peak in mfsclean: 'Algorithm1'|'CASA'|'ARL', Default is ARL.
     :param prefix: Prefix to log messages to provide context
+    :param psf_stack: PSF stacks from create_msmfsclean_psf_stack, calculated here if None
     :return: clean component image, residual image
     """
     
@@ -508,7 +741,6 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
     dmax = dirty.max()
     dpeak = argmax(dirty)
     log.info("mmclean %s: Peak of Dirty = %.6f Jy/beam at %s " % (prefix, dmax, dpeak))
-    lpsf = psf / pmax
     ldirty = dirty / pmax
 
     nmoments, ny, nx = dirty.shape
@@ -518,18 +750,12 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
     scaleshape = [nscales, ldirty.shape[1], ldirty.shape[2]]
     scalestack = create_scalestack(scaleshape, scales, norm=True)
 
-    pscaleshape = [nscales, lpsf.shape[1], lpsf.shape[2]]
-    pscalestack = create_scalestack(pscaleshape, scales, norm=True)
-
     # Calculate scale convolutions of moment residuals
     smresidual = calculate_scale_moment_residual(ldirty, scalestack)
 
-    # Calculate scale scale moment moment psf, Hessian, and inverse of Hessian
-    # scale scale moment moment psf is needed for update of scale-moment residuals
-    # Hessian is needed in calculation of optimum for any iteration
-    # Inverse Hessian is needed to calculate principal solution in moment-space
-    ssmmpsf = calculate_scale_scale_moment_moment_psf(lpsf, pscalestack)
-    hsmmpsf, ihsmmpsf = calculate_scale_inverse_moment_moment_hessian(ssmmpsf)
+    if psf_stack is None:
+        psf_stack = create_msmfsclean_psf_stack(psf, scales)
+    pscalestack, ssmmpsf, hsmmpsf, ihsmmpsf = psf_stack
 
     for scale in range(nscales):
         log.debug("mmclean %s: Moment-moment coupling matrix[scale %d] =\n %s" % (prefix, scale, hsmmpsf[scale]))
@@ -539,10 +765,15 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
     # edge of the Image.
 
     if window is None:
-        windowstack = None
+        active_sets = None
+        box = None
     else:
         windowstack = numpy.zeros_like(scalestack)
         windowstack[convolve_scalestack(scalestack, window) > 0.9] = 1.0
+        active_sets = [create_active_set(windowstack[scale]) for scale in range(nscales)]
+        box = union_box([active_set[1] for active_set in active_sets])
+        log.info("mmclean %s: Window fill factor %.3f, active box %s" %
+                 (prefix, numpy.sum(windowstack[0]) / float(nx * ny), str(box)))
 
     log.info("mmclean %s: Max abs in dirty Image = %.6f Jy/beam" % (prefix, numpy.fabs(smresidual[0, 0, :, :]).max()))
     absolutethresh = max(thresh, fracthresh * numpy.fabs(smresidual[0, 0, :, :]).max())
@@ -562,7 +793,7 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
         aiter = i + 1
 
         # Find the optimum scale and location.
-        mscale, mx, my, mval = find_global_optimum(hsmmpsf, ihsmmpsf, smresidual, windowstack, findpeak)
+        mscale, mx, my, mval = find_global_optimum(hsmmpsf, ihsmmpsf, smresidual, active_sets, findpeak)
         scale_counts[mscale] += 1
         scale_flux[mscale] += mval[0]
 
@@ -582,7 +813,7 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
 
         # Update model and residual image
         m_model = update_moment_model(m_model, pscalestack, lhs, rhs, gain, mscale, mval)
-        smresidual = update_scale_moment_residual(smresidual, ssmmpsf, lhs, rhs, gain, mscale, mval)
+        smresidual = update_scale_moment_residual(smresidual, ssmmpsf, lhs, rhs, gain, mscale, mval, box)
 
     log.info("mmclean %s: End of minor cycles" % prefix)
 
@@ -597,15 +828,20 @@ def msmfsclean(dirty, psf, window, gain, thresh, niter, scales, fracthresh, find
     return m_model, pmax * smresidual[0, :, :, :]
 
 
-def find_global_optimum(hsmmpsf, ihsmmpsf, smresidual, windowstack, findpeak):
+def find_global_optimum(hsmmpsf, ihsmmpsf, smresidual, active_sets, findpeak):
     """Find the optimum peak using one of a number of algorithms
 
+    If active sets are given, the principal solution and the peak criterion are evaluated only
+    over the active set for each scale.
     """
+    if active_sets is not None:
+        return find_global_optimum_active(hsmmpsf, ihsmmpsf, smresidual, active_sets, findpeak)
+
     if findpeak == 'Algorithm1':
         # Calculate the principal solution in moment-moment axes. This decouples the moments
         smpsol = calculate_scale_moment_principal_solution(smresidual, ihsmmpsf)
         # Now find the location and scale
-        mx, my, mscale = find_optimum_scale_zero_moment(smpsol, windowstack)
+        mx, my, mscale = find_optimum_scale_zero_moment(smpsol, None)
         mval = smpsol[mscale, :, mx, my]
     elif findpeak == 'CASA':
         # CASA 4.7 version
@@ -620,26 +856,67 @@ def find_global_optimum(hsmmpsf, ihsmmpsf, smresidual, windowstack, findpeak):
                     dchisq[scale, 0, ...] -= hsmmpsf[scale, moment1, moment2] * \
                         smpsol[scale, moment1, ...] * smpsol[scale, moment2, ...]
 
-        mx, my, mscale = find_optimum_scale_zero_moment(dchisq, windowstack)
+        mx, my, mscale = find_optimum_scale_zero_moment(dchisq, None)
         mval = smpsol[mscale, :, mx, my]
 
     else:
         smpsol = calculate_scale_moment_principal_solution(smresidual, ihsmmpsf)
-        mx, my, mscale = find_optimum_scale_zero_moment(smpsol * smresidual, windowstack)
+        mx, my, mscale = find_optimum_scale_zero_moment(smpsol * smresidual, None)
 
         mval = smpsol[mscale, :, mx, my]
 
     return mscale, mx, my, mval
 
 
-def update_scale_moment_residual(smresidual, ssmmpsf, lhs, rhs, gain, mscale, mval):
+def find_global_optimum_active(hsmmpsf, ihsmmpsf, smresidual, active_sets, findpeak):
+    """Find the optimum peak, searching only the active set for each scale
+
+    """
+    nscales, nmoments, nx, ny = smresidual.shape
+    optimum = 0.0
+    mscale, mx, my = 0, 0, 0
+    mval = numpy.zeros(nmoments)
+    for scale in range(nscales):
+        allowed = active_sets[scale][0]
+        if len(allowed) == 0:
+            continue
+        resid = smresidual[scale].reshape([nmoments, nx * ny])[:, allowed]
+        psol = numpy.einsum("mn,mx->nx", ihsmmpsf[scale], resid)
+        if findpeak == 'Algorithm1':
+            criterion = psol[0]
+        elif findpeak == 'CASA':
+            criterion = 2.0 * numpy.sum(psol * resid, axis=0) - \
+                numpy.einsum("mn,mx,nx->x", hsmmpsf[scale], psol, psol)
+        else:
+            criterion = psol[0] * resid[0]
+        criterion = numpy.abs(criterion)
+        peak = criterion.argmax()
+        if criterion[peak] > optimum:
+            optimum = criterion[peak]
+            mscale = scale
+            mx, my = numpy.unravel_index(allowed[peak], [nx, ny])
+            mval = psol[:, peak]
+
+    return mscale, mx, my, mval
+
+
+def update_scale_moment_residual(smresidual, ssmmpsf, lhs, rhs, gain, mscale, mval, box=None):
     """ Update residual by subtracting the effect of model update for each moment
 
+    If a bounding box is given, only the zero scale is updated everywhere. The other scales
+    are only needed for the peak search and so are updated only within the box.
     """
     # Lines 30 - 32 of Algorithm 1.
     nscales, nmoments, _, _ = smresidual.shape
-    smresidual[:, :, lhs[0]:lhs[1], lhs[2]:lhs[3]] -= \
-        gain * numpy.einsum("stqxy,q->stxy", ssmmpsf[mscale, :, :, :, rhs[0]:rhs[1], rhs[2]:rhs[3]], mval)
+    if box is None:
+        smresidual[:, :, lhs[0]:lhs[1], lhs[2]:lhs[3]] -= \
+            gain * numpy.einsum("stqxy,q->stxy", ssmmpsf[mscale, :, :, :, rhs[0]:rhs[1], rhs[2]:rhs[3]], mval)
+    else:
+        smresidual[0, :, lhs[0]:lhs[1], lhs[2]:lhs[3]] -= \
+            gain * numpy.einsum("tqxy,q->txy", ssmmpsf[mscale, 0, :, :, rhs[0]:rhs[1], rhs[2]:rhs[3]], mval)
+        slhs, srhs = restrict_overlap(lhs, rhs, box)
+        smresidual[1:, :, slhs[0]:slhs[1], slhs[2]:slhs[3]] -= \
+            gain * numpy.einsum("stqxy,q->stxy", ssmmpsf[mscale, 1:, :, :, srhs[0]:srhs[1], srhs[2]:srhs[3]], mval)
 
     return smresidual
 
@@ -1,7 +1,8 @@
 """ Functions to solve for antenna/station gain
 
 This uses an iterative substitution algorithm due to Larry D'Addario c 1980'ish. Used
-in the original VLA Dec-10 Antsol.
+in the original VLA Dec-10 Antsol. Alternatively, StefCal (Salvini and Wijnholds 2014) may be
+used for scalar and diagonal gains.
 
 
 For example::
@@ -18,6 +19,8 @@ import numpy
 
 from data_models.memory_data_models import GainTable
 
+from util.stefcal import stefcal
+
 log = logging.getLogger(__name__)
 
 
@@ -56,6 +59,161 @@ def solve_from_X(gt: GainTable, x: numpy.ndarray, xwt: numpy.ndarray, chunk, cro
     return gt
 
 
+def solve_from_X_batch(gt: GainTable, x: numpy.ndarray, xwt: numpy.ndarray, chunks, crosspol, niter, phase_only,
+                       tol, npol) -> GainTable:
+    """ Solve for gains from the point source equivalents of many chunks at once
+
+    The substitution solvers treat channels independently so the chunks are stacked along the channel
+    axis and solved together. The iteration stops when all chunks have converged.
+
+    :param gt:
+    :param x: point source visibility [nchunks, nants, nants, nchan, npol]
+    :param xwt: point source weight [nchunks, nants, nants, nchan, npol]
+    :param chunks: which chunks of the gaintable?
+    :param crosspol:
+    :param niter:
+    :param phase_only:
+    :param tol:
+    :param npol:
+    :return:
+    """
+    nchunks, nants, _, nchan, _ = x.shape
+    _, _, _, nrec, _ = gt.data['gain'].shape
+    
+    def stack(a):
+        # [nchunks, nants, ..., nchan, ...] -> [nants, ..., nchunks * nchan, ...]
+        a = numpy.moveaxis(a, 0, -3)
+        return a.reshape(a.shape[:-3] + (nchunks * nchan,) + a.shape[-1:])
+    
+    def unstack(a):
+        # [nants, nchunks * nchan, nrec, nrec] -> [nchunks, nants, nchan, nrec, nrec]
+        return numpy.moveaxis(a.reshape((nants, nchunks, nchan, nrec, nrec)), 1, 0)
+    
+    xs = stack(x)
+    xwts = stack(xwt)
+    gain = stack(gt.data['gain'][chunks, ...].reshape((nchunks, nants, nchan, nrec * nrec))).reshape(
+        (nants, nchunks * nchan, nrec, nrec))
+    gwt = numpy.zeros(gain.shape)
+    
+    if npol > 1:
+        if crosspol:
+            gain, gwt, _ = solve_antenna_gains_itsubs_matrix(gain, gwt, xs, xwts, phase_only=phase_only,
+                                                             niter=niter, tol=tol)
+            solution_residual = solution_residual_matrix
+        else:
+            gain, gwt, _ = solve_antenna_gains_itsubs_vector(gain, gwt, xs, xwts, phase_only=phase_only,
+                                                             niter=niter, tol=tol)
+            solution_residual = solution_residual_vector
+    else:
+        gain, gwt, _ = solve_antenna_gains_itsubs_scalar(gain, gwt, xs, xwts, phase_only=phase_only,
+                                                         niter=niter, tol=tol)
+        solution_residual = solution_residual_scalar
+    
+    gt.data['gain'][chunks, ...] = unstack(gain)
+    gt.data['weight'][chunks, ...] = unstack(gwt)
+    
+    # The residuals are summed over channels so must be calculated for each chunk separately. The
+    # point source equivalents have been symmetrised in place by the solver.
+    xs = xs.reshape((nants, nants, nchunks, nchan, nrec, nrec))
+    xwts = xwts.reshape((nants, nants, nchunks, nchan, nrec, nrec))
+    for i, chunk in enumerate(chunks):
+        gt.data['residual'][chunk, ...] = solution_residual(gt.data['gain'][chunk], xs[:, :, i], xwts[:, :, i])
+    return gt
+
+
+def solve_from_X_stefcal(gt: GainTable, x: numpy.ndarray, xwt: numpy.ndarray, chunks, crosspol, niter, phase_only,
+                         tol, npol) -> GainTable:
+    """ Solve for gains from the point source equivalents of many chunks at once using StefCal
+
+    :param gt:
+    :param x: point source visibility [nchunks, nants, nants, nchan, npol]
+    :param xwt: point source weight [nchunks, nants, nants, nchan, npol]
+    :param chunks: which chunks of the gaintable?
+    :param crosspol:
+    :param niter:
+    :param phase_only:
+    :param tol:
+    :param npol:
+    :return:
+    """
+    assert not crosspol, "StefCal does not solve for cross polarisation terms"
+    gain, gwt, residual = solve_antenna_gains_stefcal(gt.data['gain'][chunks, ...], x, xwt, niter=niter, tol=tol,
+                                                      phase_only=phase_only)
+    gt.data['gain'][chunks, ...] = gain
+    gt.data['weight'][chunks, ...] = gwt
+    gt.data['residual'][chunks, ...] = residual
+    return gt
+
+
+def solve_antenna_gains_stefcal(gain, x, xwt, niter=30, tol=1e-8, phase_only=True, refant=0):
+    """Solve for the antenna gains of many chunks at once using StefCal
+
+    x(antenna2, antenna1) = gain(antenna1) conj(gain(antenna2))
+
+    The point source equivalents are converted to StefCal's baseline vector form, including both
+    triangles, and the scalar or diagonal gains are solved in parallel for all chunks, channels
+    and receptors. StefCal fixes the reference antenna gain to unity so for amplitude solutions the
+    overall scale is then found by least squares.
+
+    See S. Salvini and S. J. Wijnholds, “Fast gain calibration in radio astronomy using alternating
+    direction implicit methods: Analysis and applications,” Astronomy and Astrophysics, vol. 571, A97, 2014.
+
+    :param gain: gains [nchunks, nants, ...], used as the starting point
+    :param x: Equivalent point source visibility [nchunks, nants, nants, ...]
+    :param xwt: Equivalent point source weight [nchunks, nants, nants, ...]
+    :param niter: Number of iterations
+    :param tol: tolerance on solution change
+    :param phase_only: Do solution for only the phase? (default True)
+    :param refant: Reference antenna for phase (default=0.0)
+    :return: gain [nchunks, nants, ...], weight [nchunks, nants, ...], residual [nchunks, ...]
+    """
+    nchunks, nants, nchan, nrec, _ = gain.shape
+    x = x.reshape(nchunks, nants, nants, nchan, nrec, nrec)
+    xwt = xwt.reshape(nchunks, nants, nants, nchan, nrec, nrec)
+    for chunk in range(nchunks):
+        hermitian_symmetrise(x[chunk], xwt[chunk])
+    
+    # All ordered pairs of distinct antennas: vis(antA, antB) = x(antB, antA)
+    antB, antA = numpy.nonzero(1 - numpy.identity(nants, dtype='int'))
+    rec = numpy.arange(nrec)
+    vis = numpy.moveaxis(x[:, antB, antA][..., rec, rec], 1, -1)
+    weights = numpy.moveaxis(xwt[:, antB, antA][..., rec, rec], 1, -1)
+    init_gain = numpy.moveaxis(gain[..., rec, rec], 1, -1)
+    if phase_only:
+        init_gain = numpy.exp(1j * numpy.angle(init_gain))
+    else:
+        init_gain = numpy.where(numpy.abs(init_gain) > 0.0, init_gain, 1.0)
+    
+    g = stefcal(vis, nants, antA, antB, weights=weights, num_iters=niter, ref_ant=refant,
+                init_gain=init_gain.astype('complex'), tol=tol, phase_only=phase_only)
+    
+    model = g[..., antA] * numpy.conjugate(g[..., antB])
+    if not phase_only:
+        top = numpy.sum(weights * (vis * numpy.conjugate(model)).real, axis=-1)
+        bot = numpy.sum(weights * numpy.abs(model) ** 2, axis=-1)
+        scale = numpy.ones_like(top)
+        mask = (bot > 0.0) & (top > 0.0)
+        scale[mask] = numpy.sqrt(top[mask] / bot[mask])
+        g *= scale[..., numpy.newaxis]
+        model *= (scale ** 2)[..., numpy.newaxis]
+    
+    newgain = numpy.zeros_like(gain, dtype='complex')
+    newgain[..., rec, rec] = numpy.moveaxis(g, -1, 1)
+    gwt = numpy.zeros_like(gain, dtype='float')
+    gwt[..., rec, rec] = numpy.einsum('tbjcr,tbcr->tjcr', xwt[..., rec, rec],
+                                      numpy.abs(newgain[..., rec, rec]) ** 2)
+    
+    # The residual is summed over all baselines, channels and receptors as for the substitution solvers
+    error = vis - model
+    residual = numpy.zeros([nchunks, nchan, nrec, nrec])
+    sumwt = numpy.sum(weights, axis=(1, 2, 3))
+    rsum = numpy.sum(weights * numpy.abs(error) ** 2, axis=(1, 2, 3))
+    rsum[sumwt > 0.0] = numpy.sqrt(rsum[sumwt > 0.0] / sumwt[sumwt > 0.0])
+    rsum[sumwt <= 0.0] = 0.0
+    residual[...] = rsum[:, numpy.newaxis, numpy.newaxis, numpy.newaxis]
+    return newgain, gwt, residual
+
+
 def solve_antenna_gains_itsubs_scalar(gain, gwt, x, xwt, niter=30, tol=1e-8, phase_only=True, refant=0):
     """Solve for the antenna gains
 
@@ -77,13 +235,7 @@ def solve_antenna_gains_itsubs_scalar(gain, gwt, x, xwt, niter=30, tol=1e-8, pha
 
     """
     
-    nants = x.shape[0]
-    for ant1 in range(nants):
-        x[ant1, ant1, ...] = 0.0
-        xwt[ant1, ant1, ...] = 0.0
-        for ant2 in range(ant1 + 1, nants):
-            x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
-            xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
+    hermitian_symmetrise(x, xwt)
     
     for iter in range(niter):
         gainLast = gain
@@ -96,11 +248,33 @@ def solve_antenna_gains_itsubs_scalar(gain, gwt, x, xwt, niter=30, tol=1e-8, pha
         gain = 0.5 * (gain + gainLast)
         change = numpy.max(numpy.abs(gain - gainLast))
         if change < tol:
+            log.debug('solve_antenna_gains_itsubs_scalar: converged after %d iterations' % (iter + 1))
             return gain, gwt, solution_residual_scalar(gain, x, xwt)
     
+    log.debug('solve_antenna_gains_itsubs_scalar: not converged after %d iterations' % niter)
     return gain, gwt, solution_residual_scalar(gain, x, xwt)
 
 
+def hermitian_symmetrise(x, xwt):
+    """Fill the upper triangle of the point source equivalents from the lower triangle, in place
+
+    x(antenna1, antenna2) = conj(x(antenna2, antenna1)) for antenna2 > antenna1, and the
+    autocorrelations are zeroed.
+
+    :param x: Equivalent point source visibility[nants, nants, ...]
+    :param xwt: Equivalent point source weight [nants, nants, ...]
+    :return: x, xwt
+    """
+    nants = x.shape[0]
+    ant1, ant2 = numpy.triu_indices(nants, 1)
+    x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
+    xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
+    diagonal = numpy.arange(nants)
+    x[diagonal, diagonal, ...] = 0.0
+    xwt[diagonal, diagonal, ...] = 0.0
+    return x, xwt
+
+
 def gain_substitution_scalar(gain, x, xwt):
     nants, nchan, nrec, _ = gain.shape
     newgain = numpy.ones_like(gain, dtype='complex')
@@ -109,17 +283,17 @@ def gain_substitution_scalar(gain, x, xwt):
     x = x.reshape(nants, nants, nchan, nrec, nrec)
     xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
     
-    for ant1 in range(nants):
-        top = numpy.sum(x[:, ant1, :, 0, 0] * gain[:, :, 0, 0] * xwt[:, ant1, :, 0, 0], axis=0)
-        bot = numpy.sum((gain[:, :, 0, 0] * numpy.conjugate(gain[:, :, 0, 0]) *
-                         xwt[:, ant1, :, 0, 0]).real, axis=0)
-        
-        if bot.all() > 0.0:
-            newgain[ant1, :, 0, 0] = top / bot
-            gwt[ant1, :, 0, 0] = bot
-        else:
-            newgain[ant1, :, 0, 0] = 0.0
-            gwt[ant1, :, 0, 0] = 0.0
+    # Sum over antenna2 for all antenna1 and channels at once
+    g = gain[:, :, 0, 0]
+    top = numpy.einsum('ijc,ijc,ic->jc', x[..., 0, 0], xwt[..., 0, 0], g)
+    bot = numpy.einsum('ijc,ic->jc', xwt[..., 0, 0], (g * numpy.conjugate(g)).real)
+    
+    # Channels are solved independently, so solution intervals may be stacked along the channel axis
+    mask = bot > 0.0
+    newdiag = numpy.zeros_like(top)
+    newdiag[mask] = top[mask] / bot[mask]
+    newgain[..., 0, 0] = newdiag
+    gwt[..., 0, 0] = numpy.where(mask, bot, 0.0)
     return newgain, gwt
 
 
@@ -151,12 +325,7 @@ def solve_antenna_gains_itsubs_vector(gain, gwt, x, xwt, niter=30, tol=1e-8, pha
     x = x.reshape(newshape)
     xwt = xwt.reshape(newshape)
     
-    for ant1 in range(nants):
-        x[ant1, ant1, ...] = 0.0
-        xwt[ant1, ant1, ...] = 0.0
-        for ant2 in range(ant1 + 1, nants):
-            x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
-            xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
+    hermitian_symmetrise(x, xwt)
     
     gain[..., 0, 1] = 0.0
     gain[..., 1, 0] = 0.0
@@ -172,8 +341,10 @@ def solve_antenna_gains_itsubs_vector(gain, gwt, x, xwt, niter=30, tol=1e-8, pha
         change = numpy.max(numpy.abs(gain - gainLast))
         gain = 0.5 * (gain + gainLast)
         if change < tol:
+            log.debug('solve_antenna_gains_itsubs_vector: converged after %d iterations' % (iter + 1))
             return gain, gwt, solution_residual_vector(gain, x, xwt)
     
+    log.debug('solve_antenna_gains_itsubs_vector: not converged after %d iterations' % niter)
     return gain, gwt, solution_residual_vector(gain, x, xwt)
 
 
@@ -195,21 +366,19 @@ def gain_substitution_vector(gain, x, xwt):
         gain[..., 0, 1] = 0.0
         gain[..., 1, 0] = 0.0
     
-    for ant1 in range(nants):
-        for chan in range(nchan):
-            # Loop over e.g. 'RR', 'LL, or 'xx', 'YY' ignoring cross terms
-            for rec in range(nrec):
-                top = numpy.sum(x[:, ant1, chan, rec, rec] *
-                                gain[:, chan, rec, rec] * xwt[:, ant1, chan, rec, rec], axis=0)
-                bot = numpy.sum((gain[:, chan, rec, rec] * numpy.conjugate(gain[:, chan, rec, rec]) *
-                                 xwt[:, ant1, chan, rec, rec]).real, axis=0)
-                
-                if bot > 0.0:
-                    newgain[ant1, chan, rec, rec] = top / bot
-                    gwt[ant1, chan, rec, rec] = bot
-                else:
-                    newgain[ant1, chan, rec, rec] = 0.0
-                    gwt[ant1, chan, rec, rec] = 0.0
+    # Only e.g. 'RR', 'LL, or 'xx', 'YY' are used, ignoring cross terms
+    rec = numpy.arange(nrec)
+    xdiag = x[..., rec, rec]
+    xwtdiag = xwt[..., rec, rec]
+    g = gain[..., rec, rec]
+    top = numpy.einsum('ijcr,ijcr,icr->jcr', xdiag, xwtdiag, g)
+    bot = numpy.einsum('ijcr,icr->jcr', xwtdiag, (g * numpy.conjugate(g)).real)
+    
+    mask = bot > 0.0
+    newdiag = numpy.zeros_like(top)
+    newdiag[mask] = top[mask] / bot[mask]
+    newgain[..., rec, rec] = newdiag
+    gwt[..., rec, rec] = numpy.where(mask, bot, 0.0)
     
     return newgain, gwt
 
@@ -242,12 +411,7 @@ def solve_antenna_gains_itsubs_matrix(gain, gwt, x, xwt, niter=30, tol=1e-8, pha
     x = x.reshape(newshape)
     xwt = xwt.reshape(newshape)
     
-    for ant1 in range(nants):
-        x[ant1, ant1, ...] = 0.0
-        xwt[ant1, ant1, ...] = 0.0
-        for ant2 in range(ant1 + 1, nants):
-            x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
-            xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
+    hermitian_symmetrise(x, xwt)
     
     gain[..., 0, 1] = 0.0
     gain[..., 1, 0] = 0.0
@@ -260,8 +424,10 @@ def solve_antenna_gains_itsubs_matrix(gain, gwt, x, xwt, niter=30, tol=1e-8, pha
         change = numpy.max(numpy.abs(gain - gainLast))
         gain = 0.5 * (gain + gainLast)
         if change < tol:
+            log.debug('solve_antenna_gains_itsubs_matrix: converged after %d iterations' % (iter + 1))
             return gain, gwt, solution_residual_matrix(gain, x, xwt)
     
+    log.debug('solve_antenna_gains_itsubs_matrix: not converged after %d iterations' % niter)
     return gain, gwt, solution_residual_matrix(gain, x, xwt)
 
 
@@ -275,23 +441,16 @@ def gain_substitution_matrix(gain, x, xwt):
     x = x.reshape(nants, nants, nchan, nrec, nrec)
     xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
     
-    # Write these loops out explicitly. Derivation of these vector equations is tedious but they are
-    # structurally identical to the scalar case with the following changes
-    # Vis -> 2x2 coherency vector, g-> 2x2 Jones matrix, *-> matmul, conjugate->Hermitean transpose (.H)
-    for ant1 in range(nants):
-        for chan in range(nchan):
-            top = 0.0
-            bot = 0.0
-            for ant2 in range(nants):
-                if ant1 != ant2:
-                    xmat = x[ant2, ant1, chan]
-                    xwtmat = xwt[ant2, ant1, chan]
-                    g2 = gain[ant2, chan]
-                    top += xmat * xwtmat * g2
-                    bot += numpy.conjugate(g2) * xwtmat * g2
-            newgain[ant1, chan][bot > 0.0] = top[bot > 0.0] / bot[bot > 0.0]
-            newgain[ant1, chan][bot <= 0.0] = 0.0
-            gwt[ant1, chan] = bot.real
+    # These are structurally identical to the scalar case with the following changes
+    # Vis -> 2x2 coherency vector, g-> 2x2 Jones matrix, applied element by element. The
+    # autocorrelations are excluded from the sums.
+    offdiagonal = (1.0 - numpy.identity(nants))[:, :, numpy.newaxis, numpy.newaxis, numpy.newaxis]
+    top = numpy.einsum('ijcpq,ijcpq,icpq->jcpq', x, xwt * offdiagonal, gain)
+    bot = numpy.einsum('ijcpq,icpq->jcpq', xwt * offdiagonal, (gain * numpy.conjugate(gain)).real)
+    mask = bot > 0.0
+    newgain[mask] = top[mask] / bot[mask]
+    newgain[~mask] = 0.0
+    gwt[...] = bot
     return newgain, gwt
 
 
@@ -309,16 +468,12 @@ def solution_residual_scalar(gain, x, xwt):
     
     xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
     
+    # The sum is over all baselines, channels and receptors
+    error = x[..., 0, 0] - gain[numpy.newaxis, :, :, 0, 0] * numpy.conjugate(gain[:, numpy.newaxis, :, 0, 0])
     residual = numpy.zeros([nchan, nrec, nrec])
     sumwt = numpy.zeros([nchan, nrec, nrec])
-    
-    for ant1 in range(nants):
-        for ant2 in range(nants):
-            for chan in range(nchan):
-                error = x[ant2, ant1, chan, 0, 0] - \
-                    gain[ant1, chan, 0, 0] * numpy.conjugate(gain[ant2, chan, 0, 0])
-                residual += (error * xwt[ant2, ant1, chan, 0, 0] * numpy.conjugate(error)).real
-                sumwt += xwt[ant2, ant1, chan, 0, 0]
+    residual[...] = numpy.sum((error * xwt[..., 0, 0] * numpy.conjugate(error)).real)
+    sumwt[...] = numpy.sum(xwt[..., 0, 0])
     
     residual[sumwt > 0.0] = numpy.sqrt(residual[sumwt > 0.0] / sumwt[sumwt > 0.0])
     residual[sumwt <= 0.0] = 0.0
@@ -346,17 +501,14 @@ def solution_residual_vector(gain, x, xwt):
     xwt[..., 1, 0] = 0.0
     xwt[..., 0, 1] = 0.0
     
+    # The sum is over all baselines, channels and receptors
+    rec = numpy.arange(nrec)
+    g = gain[..., rec, rec]
+    error = x[..., rec, rec] - g[numpy.newaxis, ...] * numpy.conjugate(g[:, numpy.newaxis, ...])
     residual = numpy.zeros([nchan, nrec, nrec])
     sumwt = numpy.zeros([nchan, nrec, nrec])
-    
-    for ant1 in range(nants):
-        for ant2 in range(nants):
-            for chan in range(nchan):
-                for rec in range(nrec):
-                    error = x[ant2, ant1, chan, rec, rec] - \
-                        gain[ant1, chan, rec, rec] * numpy.conjugate(gain[ant2, chan, rec, rec])
-                    residual += (error * xwt[ant2, ant1, chan, rec, rec] * numpy.conjugate(error)).real
-                    sumwt += xwt[ant2, ant1, chan, rec, rec]
+    residual[...] = numpy.sum((error * xwt[..., rec, rec] * numpy.conjugate(error)).real)
+    sumwt[...] = numpy.sum(xwt[..., rec, rec])
     
     residual[sumwt > 0.0] = numpy.sqrt(residual[sumwt > 0.0] / sumwt[sumwt > 0.0])
     residual[sumwt <= 0.0] = 0.0
@@ -375,21 +527,9 @@ def solution_residual_matrix(gain, x, xwt):
     
     nants, _, nchan, nrec, _ = x.shape
     
-    residual = numpy.zeros([nchan, nrec, nrec])
-    sumwt = numpy.zeros([nchan, nrec, nrec])
-    
-    # This is written out in long winded form but should be optimised for
-    # production code!
-    for ant1 in range(nants):
-        for ant2 in range(nants):
-            for chan in range(nchan):
-                for rec1 in range(nrec):
-                    for rec2 in range(nrec):
-                        error = x[ant2, ant1, chan, rec2, rec1] - \
-                            gain[ant1, chan, rec2, rec1] * numpy.conjugate(gain[ant2, chan, rec2, rec1])
-                        residual[chan, rec2, rec1] += (error * xwt[ant2, ant1, chan, rec2, rec1] * numpy.conjugate(
-                            error)).real
-                        sumwt[chan, rec2, rec1] += xwt[ant2, ant1, chan, rec2, rec1]
+    error = x - gain[numpy.newaxis, ...] * numpy.conjugate(gain[:, numpy.newaxis, ...])
+    residual = numpy.sum((error * xwt * numpy.conjugate(error)).real, axis=(0, 1))
+    sumwt = numpy.sum(xwt, axis=(0, 1))
     
     residual[sumwt > 0.0] = numpy.sqrt(residual[sumwt > 0.0] / sumwt[sumwt > 0.0])
     residual[sumwt <= 0.0] = 0.0
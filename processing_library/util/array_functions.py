@@ -108,6 +108,27 @@ def average_chunks2(arr, wts, chunksize):
     return chunks, weights
 
 
+def invert_2x2(m):
+    """ Invert a stack of 2x2 matrices using the closed form
+    
+    Singular matrices (zero determinant) are returned as zero and flagged in the mask.
+    
+    :param m: Array of shape [..., 2, 2]
+    :return: inverse [..., 2, 2], boolean mask [...] True where the matrix was invertible
+    """
+    assert m.shape[-2:] == (2, 2), "Last two axes must be 2x2: %s" % str(m.shape)
+    det = m[..., 0, 0] * m[..., 1, 1] - m[..., 0, 1] * m[..., 1, 0]
+    valid = det != 0.0
+    rdet = numpy.zeros_like(det)
+    rdet[valid] = 1.0 / det[valid]
+    inv = numpy.empty_like(m)
+    inv[..., 0, 0] = m[..., 1, 1] * rdet
+    inv[..., 0, 1] = - m[..., 0, 1] * rdet
+    inv[..., 1, 0] = - m[..., 1, 0] * rdet
+    inv[..., 1, 1] = m[..., 0, 0] * rdet
+    return inv, valid
+
+
 def tukey_filter(x, r):
     """ Calculate the Tukey (tapered cosine) filter
     
@@ -85,6 +85,31 @@ def xyz_to_uvw(xyz, ha, dec):
     return numpy.hstack([u, v, w])
 
 
+def xyz_to_antenna_uvw(ants_xyz, ha, dec):
+    """
+    Rotate :math:`(x,y,z)` antenna positions in earth coordinates to
+    :math:`(u,v,w)` coordinates for each of a set of hour angles at once.
+
+    This is the same rotation as xyz_to_uvw, batched over the hour angles.
+
+    :param ants_xyz: :math:`(x,y,z)` co-ordinates of antennas in array, shape [nants, 3]
+    :param ha: hour angles of phase tracking centre, shape [nha]
+    :param dec: declination of phase tracking centre
+    :return: :math:`(u,v,w)` co-ordinates of antennas, shape [nha, nants, 3]
+    """
+    
+    ha = numpy.atleast_1d(ha)[:, numpy.newaxis]
+    x, y, z = ants_xyz[:, 0], ants_xyz[:, 1], ants_xyz[:, 2]
+    
+    cosha, sinha = numpy.cos(ha), numpy.sin(ha)
+    u = x * cosha - y * sinha
+    v0 = x * sinha + y * cosha
+    w = z * numpy.sin(dec) - v0 * numpy.cos(dec)
+    v = z * numpy.cos(dec) + v0 * numpy.sin(dec)
+    
+    return numpy.stack([u, v, w], axis=-1)
+
+
 def uvw_to_xyz(uvw, ha, dec):
     """
     Rotate :math:`(x,y,z)` positions relative to a sky position at
@@ -118,18 +143,19 @@ def baselines(ants_uvw):
     Compute baselines in uvw co-ordinate system from
     uvw co-ordinate system station positions
 
-    :param ants_uvw: `(u,v,w)` co-ordinates of antennas in array
+    The baselines are ordered (0,1), (0,2), ... (1,2), ... and are ants_uvw[a2] - ants_uvw[a1]. Leading axes
+    before the antenna axis e.g. hour angle are kept.
+
+    :param ants_uvw: `(u,v,w)` co-ordinates of antennas in array, shape [..., nants, 3] or [nants]
     """
     
-    res = []
-    nants = ants_uvw.shape[0]
-    for a1 in range(nants):
-        for a2 in range(a1 + 1, nants):
-            res.append(ants_uvw[a2] - ants_uvw[a1])
-    
-    basel_uvw = numpy.array(res)
+    ants_uvw = numpy.asarray(ants_uvw)
+    if ants_uvw.ndim == 1:
+        a1, a2 = numpy.triu_indices(len(ants_uvw), 1)
+        return ants_uvw[a2] - ants_uvw[a1]
     
-    return basel_uvw
+    a1, a2 = numpy.triu_indices(ants_uvw.shape[-2], 1)
+    return ants_uvw[..., a2, :] - ants_uvw[..., a1, :]
 
 
 def xyz_to_baselines(ants_xyz, ha_range, dec):
@@ -143,8 +169,8 @@ def xyz_to_baselines(ants_xyz, ha_range, dec):
     :param dec: declination of astronomical source [constant, not :math:`f(t)`]
     """
     
-    dist_uvw = numpy.concatenate([baselines(xyz_to_uvw(ants_xyz, hax, dec)) for hax in ha_range])
-    return dist_uvw
+    dist_uvw = baselines(xyz_to_antenna_uvw(ants_xyz, numpy.asarray(ha_range), dec))
+    return dist_uvw.reshape(-1, 3)
 
 
 def skycoord_to_lmn(pos: SkyCoord, phasecentre: SkyCoord):
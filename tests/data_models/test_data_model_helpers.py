@@ -11,14 +11,15 @@ import numpy
 from astropy.coordinates import SkyCoord
 
 from data_models.data_model_helpers import import_visibility_from_hdf5, export_visibility_to_hdf5, \
-    import_blockvisibility_from_hdf5, export_blockvisibility_to_hdf5, \
-    import_gaintable_from_hdf5, export_gaintable_to_hdf5, \
+    import_blockvisibility_from_hdf5, export_blockvisibility_to_hdf5, blockvisibility_hdf5_iter, \
+    visibility_hdf5_iter, import_gaintable_from_hdf5, export_gaintable_to_hdf5, \
     import_image_from_hdf5, export_image_to_hdf5, \
     import_skycomponent_from_hdf5, export_skycomponent_to_hdf5, \
     import_skymodel_from_hdf5, export_skymodel_to_hdf5, \
     import_griddata_from_hdf5, export_griddata_to_hdf5, \
-    import_convolutionfunction_from_hdf5, export_convolutionfunction_to_hdf5
-from data_models.memory_data_models import Skycomponent, SkyModel
+    import_convolutionfunction_from_hdf5, export_convolutionfunction_to_hdf5, \
+    import_deconvolutionstate_from_hdf5, export_deconvolutionstate_to_hdf5
+from data_models.memory_data_models import Skycomponent, SkyModel, DeconvolutionState
 from data_models.polarisation import PolarisationFrame
 from processing_components.calibration.operations import create_gaintable_from_blockvisibility
 from processing_components.imaging.base import predict_skycomponent_visibility
@@ -88,6 +89,54 @@ class TestDataModelHelpers(unittest.TestCase):
         assert numpy.abs(newvis.configuration.location.z.value - self.vis.configuration.location.z.value) < 1e-15
         assert numpy.max(numpy.abs(newvis.configuration.xyz - self.vis.configuration.xyz)) < 1e-15
     
+    def test_readwriteblockvisibility_chunked(self):
+        self.vis = create_blockvisibility(self.lowcore, self.times, self.frequency,
+                                          channel_bandwidth=self.channel_bandwidth,
+                                          phasecentre=self.phasecentre,
+                                          polarisation_frame=PolarisationFrame("linear"),
+                                          weight=1.0)
+        self.vis = predict_skycomponent_visibility(self.vis, self.comp)
+        filename = '%s/test_data_model_helpers_blockvisibility_chunked.hdf' % self.dir
+        export_blockvisibility_to_hdf5(self.vis, filename, time_chunk=1, channel_chunk=1, compression='gzip')
+        newvis = import_blockvisibility_from_hdf5(filename)
+        assert newvis.data.shape == self.vis.data.shape
+        for name in self.vis.data.dtype.names:
+            assert numpy.array_equal(newvis.data[name], self.vis.data[name]), name
+        
+        # Read only some times and channels
+        newvis = import_blockvisibility_from_hdf5(filename, times=slice(1, 3), channels=slice(0, 2))
+        assert numpy.array_equal(newvis.frequency, self.vis.frequency[0:2])
+        assert numpy.array_equal(newvis.time, self.vis.time[1:3])
+        assert numpy.array_equal(newvis.vis, self.vis.vis[1:3, ..., 0:2, :])
+        
+        for chunked in [False, True]:
+            if chunked:
+                export_blockvisibility_to_hdf5(self.vis, filename, time_chunk=2)
+            else:
+                export_blockvisibility_to_hdf5(self.vis, filename)
+            chunks = list(blockvisibility_hdf5_iter(filename, time_chunk=2, channels=slice(2, 3)))
+            assert len(chunks) == 2
+            assert numpy.array_equal(numpy.concatenate([chunk.vis for chunk in chunks]),
+                                     self.vis.vis[..., 2:3, :])
+            assert numpy.array_equal(chunks[1].weight, self.vis.weight[2:, ..., 2:3, :])
+    
+    def test_readwritevisibility_chunked(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth,
+                                     phasecentre=self.phasecentre,
+                                     polarisation_frame=PolarisationFrame("linear"),
+                                     weight=1.0)
+        self.vis = predict_skycomponent_visibility(self.vis, self.comp)
+        filename = '%s/test_data_model_helpers_visibility_chunked.hdf' % self.dir
+        export_visibility_to_hdf5(self.vis, filename, row_chunk=100, compression='lzf')
+        newvis = import_visibility_from_hdf5(filename)
+        for name in self.vis.data.dtype.names:
+            assert numpy.array_equal(newvis.data[name], self.vis.data[name]), name
+        
+        chunks = list(visibility_hdf5_iter(filename, row_chunk=1000))
+        assert sum(chunk.nvis for chunk in chunks) == self.vis.nvis
+        assert numpy.array_equal(numpy.concatenate([chunk.uvw for chunk in chunks]), self.vis.uvw)
+    
     def test_readwritegaintable(self):
         self.vis = create_blockvisibility(self.lowcore, self.times, self.frequency,
                                           channel_bandwidth=self.channel_bandwidth,
@@ -146,5 +195,20 @@ class TestDataModelHelpers(unittest.TestCase):
         assert numpy.max(numpy.abs(cf.data - newcf.data)) < 1e-15
 
 
+    def test_readwritedeconvolutionstate(self):
+        im = create_test_image()
+        state = DeconvolutionState(model=im, residual=im, niter=100, threshold=0.1, algorithm='msclean',
+                                   scales=[0, 3, 10], fingerprint='(1, 1, 256, 256) 0123456789abcdef')
+        export_deconvolutionstate_to_hdf5(state, '%s/test_data_model_helpers_deconvolutionstate.hdf' % self.dir)
+        newstate = import_deconvolutionstate_from_hdf5('%s/test_data_model_helpers_deconvolutionstate.hdf' %
+                                                       self.dir)
+    
+        assert newstate.niter == 100
+        assert newstate.algorithm == 'msclean'
+        assert newstate.scales == [0, 3, 10]
+        assert newstate.fingerprint == state.fingerprint
+        assert newstate.residual.data.shape == im.data.shape
+        assert numpy.max(numpy.abs(newstate.model.data - im.data)) < 1e-15
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+""" Unit tests for the columnar storage of the visibility data models
+
+
+"""
+
+import unittest
+
+import numpy
+
+from data_models.memory_data_models import ColumnarData, Visibility, BlockVisibility
+from data_models.polarisation import PolarisationFrame
+
+
+class TestColumnarData(unittest.TestCase):
+    def setUp(self):
+        self.nvis = 10
+        self.data = ColumnarData([('index', numpy.arange(self.nvis)),
+                                  ('time', numpy.linspace(0.0, 1.0, self.nvis)[::-1].copy()),
+                                  ('uvw', numpy.arange(3 * self.nvis, dtype='float').reshape([self.nvis, 3])),
+                                  ('vis', numpy.ones([self.nvis, 4], dtype='complex'))])
+
+    def test_columns(self):
+        assert self.data.size == self.nvis
+        assert len(self.data) == self.nvis
+        assert self.data.shape == (self.nvis,)
+        assert list(self.data.dtype.names) == ['index', 'time', 'uvw', 'vis']
+        self.data['vis'][...] = 2.0
+        assert numpy.all(self.data['vis'] == 2.0)
+        self.data['vis'] = 3.0
+        assert numpy.all(self.data['vis'] == 3.0)
+
+    def test_rows(self):
+        rows = numpy.arange(self.nvis) % 2 == 0
+        selected = self.data[rows]
+        assert selected.size == numpy.sum(rows)
+        numpy.testing.assert_array_equal(selected['uvw'], self.data['uvw'][rows])
+        selected['vis'][...] = 0.0
+        assert numpy.all(self.data['vis'] != 0.0)
+
+    def test_structured(self):
+        structured = self.data.as_structured()
+        assert structured.dtype['vis'].base == numpy.dtype('>c16')
+        assert structured.dtype['time'] == numpy.dtype('>f8')
+        numpy.testing.assert_array_equal(numpy.asarray(self.data)['uvw'], self.data['uvw'])
+
+        data = ColumnarData.from_structured(structured, copy=True)
+        for name in self.data.dtype.names:
+            assert data[name].dtype.isnative
+            assert data[name].flags['C_CONTIGUOUS']
+            numpy.testing.assert_array_equal(data[name], self.data[name])
+
+        # Without copy the columns are views so updates go back to the structured array
+        view = ColumnarData.from_structured(structured)
+        view['vis'][...] = 5.0
+        assert numpy.all(structured['vis'] == 5.0)
+
+    def test_concatenate_sort(self):
+        data = ColumnarData.concatenate([self.data, self.data])
+        assert data.size == 2 * self.nvis
+        data = data[data.argsort(['time'])]
+        assert numpy.all(numpy.diff(data['time']) >= 0.0)
+        # The sort is stable
+        numpy.testing.assert_array_equal(data['index'][0:2], [self.nvis - 1, self.nvis - 1])
+
+
+class TestVisibilityStorage(unittest.TestCase):
+    def test_visibility(self):
+        nvis = 5
+        vis = Visibility(frequency=numpy.full(nvis, 1e8), channel_bandwidth=numpy.full(nvis, 1e6),
+                         uvw=numpy.zeros([nvis, 3]), time=numpy.zeros(nvis), antenna1=numpy.zeros(nvis),
+                         antenna2=numpy.ones(nvis), vis=numpy.ones([nvis, 1]), weight=numpy.ones([nvis, 1]),
+                         integration_time=1.0, polarisation_frame=PolarisationFrame('stokesI'))
+        for column in [vis.vis, vis.uvw, vis.weight, vis.imaging_weight, vis.time, vis.antenna1]:
+            assert column.dtype.isnative
+            assert column.flags['C_CONTIGUOUS']
+        assert vis.nvis == nvis
+        assert vis.size() > 0.0
+        numpy.testing.assert_array_equal(vis.integration_time, 1.0)
+
+    def test_blockvisibility(self):
+        ntimes, nants, nchan, npol = 3, 4, 2, 4
+        shape = [ntimes, nants, nants, nchan, npol]
+        vis = BlockVisibility(frequency=numpy.linspace(1e8, 1.1e8, nchan), channel_bandwidth=numpy.full(nchan, 1e6),
+                              uvw=numpy.zeros([ntimes, nants, nants, 3]), time=numpy.arange(ntimes),
+                              vis=numpy.ones(shape), weight=numpy.ones(shape), integration_time=numpy.ones(ntimes),
+                              polarisation_frame=PolarisationFrame('linear'))
+        for column in [vis.vis, vis.uvw, vis.weight, vis.time]:
+            assert column.dtype.isnative
+            assert column.flags['C_CONTIGUOUS']
+        assert vis.nvis == ntimes
+        assert vis.nants == nants
+        # A structured array, as used by the C interface, is wrapped without copying
+        wrapped = BlockVisibility(data=vis.data.as_structured(), frequency=vis.frequency,
+                                  channel_bandwidth=vis.channel_bandwidth,
+                                  polarisation_frame=vis.polarisation_frame)
+        numpy.testing.assert_array_equal(wrapped.vis, vis.vis)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -70,6 +70,23 @@ class TestCalibrationContext(unittest.TestCase):
         residual = numpy.max(gaintables['B'].residual)
         assert residual < 6e-5, "Max B residual = %s" % (residual)
 
+    def test_calibrate_function_warm_start(self):
+        self.actualSetup('stokesI', 'stokesI', f=[100.0])
+        gt = create_gaintable_from_blockvisibility(self.vis)
+        gt = simulate_gaintable(gt, phase_error=10.0, amplitude_error=0.1)
+        original = copy_visibility(self.vis)
+        self.vis = apply_gaintable(self.vis, gt)
+        controls = create_calibration_controls()
+        controls['T']['first_selfcal'] = 0
+        controls['G']['first_selfcal'] = 0
+        _, gaintables = calibrate_function(copy_visibility(self.vis), original, calibration_context='TG',
+                                           controls=controls)
+        # Starting from the previous solutions, the same data should give the same solutions
+        _, warm_gaintables = calibrate_function(copy_visibility(self.vis), original, calibration_context='TG',
+                                                controls=controls, gaintables=gaintables)
+        for c in 'TG':
+            numpy.testing.assert_array_almost_equal(warm_gaintables[c].gain, gaintables[c].gain, 4)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+""" Unit tests for model partition calibration
+
+
+"""
+import logging
+import unittest
+
+import astropy.units as u
+import numpy
+from astropy.coordinates import SkyCoord
+
+from data_models.memory_data_models import SkyModel
+from data_models.polarisation import PolarisationFrame
+
+from processing_components.calibration.modelpartition import create_modelpartitions, solve_modelpartitions, \
+    modelpartition_list_predict, modelpartition_list_residual, modelpartition_consensus
+from processing_components.calibration.operations import apply_gaintable, create_gaintable_from_blockvisibility
+from processing_components.imaging.base import predict_skycomponent_visibility
+from processing_components.simulation.testing_support import create_named_configuration, simulate_gaintable
+from processing_components.skycomponent.base import copy_skycomponent
+from processing_components.skycomponent.operations import create_skycomponent
+from processing_components.visibility.base import copy_visibility, create_blockvisibility
+
+log = logging.getLogger(__name__)
+
+
+class TestCalibrationModelPartition(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(180555)
+        
+        lowcore = create_named_configuration('LOWBD2', rmax=300.0)
+        times = numpy.linspace(-numpy.pi / 6.0, numpy.pi / 6.0, 3)
+        frequency = numpy.array([1e8])
+        channel_bandwidth = numpy.array([1e6])
+        self.phasecentre = SkyCoord(ra=+180.0 * u.deg, dec=-60.0 * u.deg, frame='icrs', equinox='J2000')
+        self.vis = create_blockvisibility(lowcore, times, frequency=frequency, channel_bandwidth=channel_bandwidth,
+                                          weight=1.0, phasecentre=self.phasecentre,
+                                          polarisation_frame=PolarisationFrame("stokesI"))
+        
+        directions = [SkyCoord(ra=+181.0 * u.deg, dec=-60.0 * u.deg, frame='icrs', equinox='J2000'),
+                      SkyCoord(ra=+179.0 * u.deg, dec=-59.0 * u.deg, frame='icrs', equinox='J2000')]
+        self.components = [create_skycomponent(direction=direction, flux=numpy.array([[10.0]]),
+                                               frequency=frequency, polarisation_frame=PolarisationFrame('stokesI'))
+                           for direction in directions]
+        
+        # Each component is corrupted by its own gains
+        self.vis.data['vis'][...] = 0.0
+        for sc in self.components:
+            component_vis = copy_visibility(self.vis, zero=True)
+            component_vis = predict_skycomponent_visibility(component_vis, sc)
+            gt = create_gaintable_from_blockvisibility(component_vis)
+            gt = simulate_gaintable(gt, phase_error=0.1, amplitude_error=0.0)
+            component_vis = apply_gaintable(component_vis, gt)
+            self.vis.data['vis'][...] += component_vis.data['vis'][...]
+        
+        self.skymodels = [SkyModel(components=[sc], fixed=True) for sc in self.components]
+    
+    def test_list_residual(self):
+        model_partitions = create_modelpartitions(self.vis, self.skymodels)
+        predictions = modelpartition_list_predict(self.vis, model_partitions)
+        assert predictions.shape == tuple([len(self.skymodels)] + list(self.vis.vis.shape))
+        residual = modelpartition_list_residual(self.vis, predictions)
+        numpy.testing.assert_array_almost_equal(residual, self.vis.vis - numpy.sum(predictions, axis=0))
+    
+    def test_solve_modelpartitions(self):
+        model_partitions = create_modelpartitions(self.vis, self.skymodels)
+        initial_residual = modelpartition_list_residual(self.vis,
+                                                        modelpartition_list_predict(self.vis, model_partitions))
+        model_partitions, residual_vis = solve_modelpartitions(self.vis, model_partitions, niter=10, gain=0.5)
+        assert len(model_partitions) == len(self.skymodels)
+        
+        # The incrementally updated residual must match the residual from the final model partitions
+        residual = modelpartition_list_residual(self.vis, modelpartition_list_predict(self.vis, model_partitions))
+        numpy.testing.assert_array_almost_equal(residual_vis.vis, residual)
+        
+        rms_initial = numpy.std(initial_residual)
+        rms_final = numpy.std(residual_vis.vis)
+        assert rms_final < 0.5 * rms_initial, "Residual rms %.3f, initially %.3f" % (rms_final, rms_initial)
+    
+    def test_consensus(self):
+        skymodels = [SkyModel(components=[copy_skycomponent(sc)]) for sc in self.components]
+        partition_results = list()
+        for scale in [0.5, 1.5]:
+            model_partitions = create_modelpartitions(self.vis, skymodels)
+            for sm, _ in model_partitions:
+                sm.components[0].flux *= scale
+            partition_results.append((model_partitions, self.vis))
+        consensus = modelpartition_consensus(partition_results)
+        assert len(consensus) == len(self.components)
+        for sm, sc in zip(consensus, self.components):
+            numpy.testing.assert_array_almost_equal(sm.components[0].flux, sc.flux)
+            assert sm.components[0].direction.separation(sc.direction).value < 1e-10
+        # The inputs are not changed
+        numpy.testing.assert_array_almost_equal(partition_results[0][0][0][0].components[0].flux,
+                                                0.5 * self.components[0].flux)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,7 +14,7 @@ from data_models.memory_data_models import Skycomponent, GainTable
 from data_models.polarisation import PolarisationFrame
 
 from processing_components.calibration.operations import gaintable_summary, apply_gaintable, create_gaintable_from_blockvisibility, \
-    create_gaintable_from_rows
+    create_gaintable_from_rows, append_gaintable, copy_gaintable, GainTableBuilder
 from processing_components.simulation.testing_support import create_named_configuration, simulate_gaintable
 from processing_components.visibility.base import copy_visibility, create_blockvisibility
 from processing_components.imaging.base import predict_skycomponent_visibility
@@ -123,6 +123,40 @@ class TestCalibrationOperations(unittest.TestCase):
             error = numpy.max(numpy.abs(vis.vis - original.vis))
             assert error < 1e-12, "Error = %s" % (error)
 
+    def test_apply_gaintable_interpolation(self):
+        self.actualSetup('stokesIQUV', 'linear')
+        gt = create_gaintable_from_blockvisibility(self.vis, timeslice=100.0)
+        gt = simulate_gaintable(gt, phase_error=0.1, amplitude_error=0.1)
+        original = copy_visibility(self.vis)
+        for interpolation in ['interval', 'nearest', 'linear']:
+            vis = apply_gaintable(copy_visibility(original), gt, interpolation=interpolation)
+            assert numpy.max(numpy.abs(vis.vis - original.vis)) > 1.0
+            vis = apply_gaintable(vis, gt, inverse=True, interpolation=interpolation)
+            error = numpy.max(numpy.abs(vis.vis - original.vis))
+            assert error < 1e-12, "Error = %s" % (error)
+        
+        # A single channel gaintable applies to all channels
+        gt1 = GainTable(gain=gt.gain[:, :, 0:1], time=gt.time, interval=gt.interval, weight=gt.weight[:, :, 0:1],
+                        residual=gt.residual[:, 0:1], frequency=gt.frequency[0:1], receptor_frame=gt.receptor_frame)
+        for frequency_interpolation in ['nearest', 'linear']:
+            vis = apply_gaintable(copy_visibility(original), gt1, interpolation='linear',
+                                  frequency_interpolation=frequency_interpolation)
+            ratio = vis.vis[..., 0] / original.vis[..., 0]
+            numpy.testing.assert_array_almost_equal(ratio[..., 1], ratio[..., 0], 12)
+    
+    def test_apply_gaintable_per_row(self):
+        self.actualSetup('stokesIQUV', 'linear')
+        gt = create_gaintable_from_blockvisibility(self.vis)
+        gt = simulate_gaintable(gt, phase_error=0.1, amplitude_error=0.1)
+        original = copy_visibility(self.vis)
+        expected = apply_gaintable(copy_visibility(original), gt)
+        # With coarse slices, each row still gets the solution for its own time
+        vis = apply_gaintable(copy_visibility(original), gt, vis_slices=2, interpolation='interval')
+        numpy.testing.assert_array_almost_equal(vis.vis, expected.vis, 12)
+        vis = apply_gaintable(vis, gt, vis_slices=2, inverse=True, interpolation='interval')
+        error = numpy.max(numpy.abs(vis.vis - original.vis))
+        assert error < 1e-12, "Error = %s" % (error)
+    
     def test_apply_gaintable_null(self):
         for spf, dpf in[('stokesI', 'stokesI'), ('stokesIQUV', 'linear'), ('stokesIQUV', 'circular')]:
             self.actualSetup(spf, dpf)
@@ -141,6 +175,24 @@ class TestCalibrationOperations(unittest.TestCase):
             selected_gt = create_gaintable_from_rows(gt, rows, makecopy=makecopy)
             assert selected_gt.ntimes == numpy.sum(numpy.array(rows))
 
+    def test_gaintable_builder(self):
+        self.actualSetup('stokesIQUV', 'linear')
+        gt = create_gaintable_from_blockvisibility(self.vis, timeslice='auto')
+        gt = simulate_gaintable(gt, phase_error=1.0)
+        builder = GainTableBuilder()
+        appended = None
+        for row in range(gt.ntimes):
+            rowgt = create_gaintable_from_rows(gt, gt.time == gt.time[row])
+            builder.append(rowgt)
+            appended = rowgt if appended is None else append_gaintable(appended, copy_gaintable(rowgt))
+        built_gt = builder.finalize()
+        assert built_gt.ntimes == gt.ntimes
+        assert built_gt.receptor_frame == gt.receptor_frame
+        assert built_gt.data.dtype == gt.data.dtype
+        numpy.testing.assert_array_equal(built_gt.gain, gt.gain)
+        numpy.testing.assert_array_equal(built_gt.data, appended.data)
+        assert builder.finalize() is None
+
 
 
 if __name__ == '__main__':
@@ -104,8 +104,34 @@ class TestCalibrationSolvers(unittest.TestCase):
         assert residual < 3e-8, "Max residual = %s" % (residual)
         assert numpy.max(numpy.abs(gtsol.gain - 1.0)) > 0.1
 
+    def test_solve_gaintable_scalar_blocks(self):
+        self.actualSetup('stokesI', 'stokesI', f=[100.0])
+        gt = create_gaintable_from_blockvisibility(self.vis)
+        gt = simulate_gaintable(gt, phase_error=10.0, amplitude_error=0.0)
+        original = copy_visibility(self.vis)
+        self.vis = apply_gaintable(self.vis, gt)
+        gtsol = solve_gaintable(self.vis, original, phase_only=True, niter=200, rows_per_solve=1)
+        gtsol_block = solve_gaintable(self.vis, original, phase_only=True, niter=200, rows_per_solve=16)
+        numpy.testing.assert_array_almost_equal(gtsol.gain, gtsol_block.gain, 6)
+        numpy.testing.assert_array_almost_equal(gtsol.residual, gtsol_block.residual, 6)
+
+    def test_solve_gaintable_scalar_stefcal(self):
+        self.actualSetup('stokesI', 'stokesI', f=[100.0])
+        gt = create_gaintable_from_blockvisibility(self.vis)
+        gt = simulate_gaintable(gt, phase_error=10.0, amplitude_error=0.1)
+        original = copy_visibility(self.vis)
+        self.vis = apply_gaintable(self.vis, gt)
+        gtsol = solve_gaintable(self.vis, original, phase_only=False, niter=200, solver='stefcal')
+        residual = numpy.max(gtsol.residual)
+        assert residual < 3e-8, "Max residual = %s" % (residual)
+        assert numpy.max(numpy.abs(gtsol.gain - 1.0)) > 0.1
+        # Compare with iterative substitution
+        gtsol_itsubs = solve_gaintable(self.vis, original, phase_only=False, niter=200)
+        numpy.testing.assert_array_almost_equal(gtsol.gain, gtsol_itsubs.gain, 6)
+
     def core_solve(self, spf, dpf, phase_error=0.1, amplitude_error=0.0, leakage=0.0,
-                   phase_only=True, niter=200, crosspol=False, residual_tol=1e-6, f=None, vnchan=3):
+                   phase_only=True, niter=200, crosspol=False, residual_tol=1e-6, f=None, vnchan=3,
+                   solver='itsubs'):
         if f is None:
             f = [100.0, 50.0, -10.0, 40.0]
         self.actualSetup(spf, dpf, f=f, vnchan=vnchan)
@@ -114,7 +140,8 @@ class TestCalibrationSolvers(unittest.TestCase):
         gt = simulate_gaintable(gt, phase_error=phase_error, amplitude_error=amplitude_error, leakage=leakage)
         original = copy_visibility(self.vis)
         vis = apply_gaintable(self.vis, gt)
-        gtsol = solve_gaintable(self.vis, original, phase_only=phase_only, niter=niter, crosspol=crosspol, tol=1e-6)
+        gtsol = solve_gaintable(self.vis, original, phase_only=phase_only, niter=niter, crosspol=crosspol, tol=1e-6,
+                                solver=solver)
         vis = apply_gaintable(vis, gtsol, inverse=True)
         residual = numpy.max(gtsol.residual)
         assert residual < residual_tol, "%s %s Max residual = %s" % (spf, dpf, residual)
@@ -141,6 +168,14 @@ class TestCalibrationSolvers(unittest.TestCase):
         self.core_solve('stokesIQUV', 'linear', phase_error=0.1, amplitude_error=0.01,
                         phase_only=False, f=[100.0, 50.0, 0.0, 0.0])
     
+    def test_solve_gaintable_vector_large_phase_only_linear_stefcal(self):
+        self.core_solve('stokesIQUV', 'linear', phase_error=10.0, phase_only=True,
+                        f=[100.0, 50.0, 0.0, 0.0], solver='stefcal')
+    
+    def test_solve_gaintable_vector_both_linear_stefcal(self):
+        self.core_solve('stokesIQUV', 'linear', phase_error=0.1, amplitude_error=0.01,
+                        phase_only=False, f=[100.0, 50.0, 0.0, 0.0], solver='stefcal')
+    
     def test_solve_gaintable_vector_both_circular(self):
         self.core_solve('stokesIQUV', 'circular', phase_error=0.1, amplitude_error=0.01,
                         phase_only=False, f=[100.0, 0.0, 0.0, 50.0])
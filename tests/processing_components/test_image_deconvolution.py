@@ -3,6 +3,7 @@
 
 """
 import logging
+import os
 import unittest
 
 import astropy.units as u
@@ -12,9 +13,10 @@ from astropy.coordinates import SkyCoord
 from data_models.polarisation import PolarisationFrame
 
 from processing_library.arrays.cleaners import overlapIndices
-from processing_library.image.operations import create_image_from_array
+from processing_library.image.operations import create_image_from_array, copy_image
 
-from processing_components.image.deconvolution import deconvolve_cube, restore_cube
+from data_models.data_model_helpers import export_deconvolutionstate_to_hdf5
+from processing_components.image.deconvolution import deconvolve_cube, restore_cube, create_deconvolution_state
 from processing_components.image.operations import export_image_to_fits
 from processing_components.simulation.testing_support import create_test_image, create_named_configuration
 from processing_components.visibility.base import create_visibility
@@ -73,6 +75,13 @@ class TestImageDeconvolution(unittest.TestCase):
     def test_restore(self):
         self.cmodel = restore_cube(self.model, self.psf)
         
+    def test_restore_convolve(self):
+        from astropy.convolution import Gaussian2DKernel, convolve_fft
+        self.cmodel = restore_cube(self.dirty, self.psf, psfwidth=2.0)
+        expected = 2.0 * numpy.pi * 2.0 ** 2 * convolve_fft(self.dirty.data[0, 0], Gaussian2DKernel(2.0),
+                                                             normalize_kernel=False)
+        numpy.testing.assert_array_almost_equal(self.cmodel.data[0, 0], expected, 7)
+    
     def test_deconvolve_hogbom(self):
         self.comp, self.residual = deconvolve_cube(self.dirty, self.psf, niter=10000, gain=0.1, algorithm='hogbom',
                                                    threshold=0.01)
@@ -90,6 +99,48 @@ class TestImageDeconvolution(unittest.TestCase):
         export_image_to_fits(self.cmodel, "%s/test_deconvolve_msclean-clean.fits" % (self.dir))
         assert numpy.max(self.residual.data) < 1.2
 
+    def test_deconvolve_msclean_checkpoint(self):
+        kwargs = {'niter': 1000, 'gain': 0.7, 'algorithm': 'msclean', 'scales': [0, 3, 10, 30], 'threshold': 0.01,
+                  'checkpoint_interval': 300}
+        self.comp, self.residual = deconvolve_cube(self.dirty, self.psf, **kwargs)
+        assert numpy.max(self.residual.data) < 1.2
+        checkpoint_file = "%s/test_deconvolve_msclean_checkpoint.hdf" % (self.dir)
+        comp, residual = deconvolve_cube(self.dirty, self.psf, checkpoint_file=checkpoint_file, **kwargs)
+        assert numpy.max(numpy.abs(comp.data - self.comp.data)) < 1e-7
+        assert numpy.max(numpy.abs(residual.data - self.residual.data)) < 1e-7
+        # The checkpoint is removed once the deconvolution is complete
+        assert not os.path.exists(checkpoint_file)
+    
+    def test_deconvolve_msclean_checkpoint_resume(self):
+        kwargs = {'gain': 0.7, 'algorithm': 'msclean', 'scales': [0, 3, 10, 30], 'threshold': 0.01,
+                  'checkpoint_interval': 300}
+        self.comp, self.residual = deconvolve_cube(self.dirty, self.psf, niter=1000, **kwargs)
+        
+        # Resume from the state left by an interrupted deconvolution
+        state = create_deconvolution_state(self.dirty, self.psf, **kwargs)
+        deconvolve_cube(self.dirty, self.psf, niter=300, deconvolution_state=state, **kwargs)
+        assert state.niter == 300
+        comp, residual = deconvolve_cube(self.dirty, self.psf, niter=1000, deconvolution_state=state, **kwargs)
+        assert numpy.max(numpy.abs(comp.data - self.comp.data)) < 1e-7
+        assert numpy.max(numpy.abs(residual.data - self.residual.data)) < 1e-7
+        
+        # Resume from a checkpoint file
+        checkpoint_file = "%s/test_deconvolve_msclean_checkpoint_resume.hdf" % (self.dir)
+        state = create_deconvolution_state(self.dirty, self.psf, **kwargs)
+        deconvolve_cube(self.dirty, self.psf, niter=300, deconvolution_state=state, **kwargs)
+        export_deconvolutionstate_to_hdf5(state, checkpoint_file)
+        comp, residual = deconvolve_cube(self.dirty, self.psf, niter=1000, checkpoint_file=checkpoint_file,
+                                         checkpoint_resume=True, **kwargs)
+        assert numpy.max(numpy.abs(comp.data - self.comp.data)) < 1e-7
+        assert not os.path.exists(checkpoint_file)
+        
+        # A state for a different dirty image cannot be resumed
+        state = create_deconvolution_state(self.dirty, self.psf, **kwargs)
+        dirty = copy_image(self.dirty)
+        dirty.data *= 2.0
+        with self.assertRaises(ValueError):
+            deconvolve_cube(dirty, self.psf, niter=1000, deconvolution_state=state, **kwargs)
+
     def test_deconvolve_msclean_1scale(self):
         
         self.comp, self.residual = deconvolve_cube(self.dirty, self.psf, niter=10000, gain=0.1, algorithm='msclean',
@@ -109,6 +160,14 @@ class TestImageDeconvolution(unittest.TestCase):
         export_image_to_fits(self.cmodel, "%s/test_deconvolve_hogbom_innerquarter-clean.fits" % (self.dir))
         assert numpy.max(self.residual.data) < 1.2
     
+    def test_deconvolve_hogbom_mask(self):
+        
+        self.comp, self.residual = deconvolve_cube(self.dirty, self.psf, mask=self.innerquarter, niter=10000,
+                                                   gain=0.1, algorithm='hogbom', threshold=0.01)
+        export_image_to_fits(self.residual, "%s/test_deconvolve_hogbom_mask-residual.fits" % (self.dir))
+        assert numpy.sum(self.comp.data[self.innerquarter.data == False]) == 0.0
+        assert numpy.max(self.residual.data) < 1.2
+    
     def test_deconvolve_msclean_inner_quarter(self):
         
         self.comp, self.residual = deconvolve_cube(self.dirty, self.psf, window='quarter', niter=1000, gain=0.7,
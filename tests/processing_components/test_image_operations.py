@@ -132,6 +132,23 @@ class TestImage(unittest.TestCase):
         error = numpy.std(reconstructed_cube.data - original_cube.data)
         assert error < 0.2
 
+    def test_calculate_image_frequency_moments_weights(self):
+        frequency = numpy.linspace(0.9e8, 1.1e8, 9)
+        cube = create_image(npixel=128, cellsize=0.001, polarisation_frame=PolarisationFrame("stokesI"),
+                            frequency=frequency, channel_bandwidth=2.5e6 * numpy.ones([9]))
+        cube.data[...] = numpy.random.uniform(size=cube.shape)
+        moment_cube = calculate_image_frequency_moments(cube, nmoments=3)
+        for moment in range(3):
+            expected = numpy.zeros(cube.shape[1:])
+            for chan in range(len(frequency)):
+                weight = numpy.power((frequency[chan] - 1e8) / 1e8, moment)
+                expected += cube.data[chan] * weight
+            numpy.testing.assert_array_almost_equal(moment_cube.data[moment], expected, 7)
+        out = numpy.zeros(moment_cube.shape, dtype='float32')
+        moment_cube32 = calculate_image_frequency_moments(cube, nmoments=3, out=out)
+        assert moment_cube32.data is out
+        numpy.testing.assert_array_almost_equal(moment_cube32.data, moment_cube.data, 4)
+
     def test_create_w_term_image(self):
         m31image = create_test_image(cellsize=0.001)
         im = create_w_term_like(m31image, w=20000.0, remove_shift=True)
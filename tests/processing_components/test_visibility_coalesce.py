@@ -13,7 +13,8 @@ from data_models.polarisation import PolarisationFrame
 
 from processing_components.simulation.testing_support import create_named_configuration
 from processing_components.visibility.coalesce import coalesce_visibility, decoalesce_visibility, \
-    convert_blockvisibility_to_visibility
+    convert_blockvisibility_to_visibility, average_in_blocks
+from processing_library.util.array_functions import average_chunks2
 from processing_components.visibility.base import create_blockvisibility, create_visibility_from_rows
 from processing_components.visibility.iterators import vis_timeslice_iter
 
@@ -53,6 +54,51 @@ class TestCoalesce(unittest.TestCase):
         dvis = decoalesce_visibility(cvis, overwrite=True)
         assert dvis.nvis == self.blockvis.nvis
 
+    def test_convert_decoalesce_polarised(self):
+        bvis = create_blockvisibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
+                                      weight=1.0, polarisation_frame=PolarisationFrame('linear'),
+                                      channel_bandwidth=self.channel_bandwidth)
+        bvis.data['vis'] = numpy.random.normal(size=bvis.vis.shape) + 1j * numpy.random.normal(size=bvis.vis.shape)
+        original = bvis.vis.copy()
+        cvis = convert_blockvisibility_to_visibility(bvis)
+        assert cvis.nvis == len(self.times) * bvis.nants * (bvis.nants - 1) * len(self.frequency) // 2
+        dvis = decoalesce_visibility(cvis, overwrite=True)
+        a2, a1 = numpy.tril_indices(bvis.nants, -1)
+        numpy.testing.assert_array_equal(dvis.vis[:, a2, a1, ...], original[:, a2, a1, ...])
+
+    def test_convert_list_frequency(self):
+        # Callers such as ingest_unittest_visibility pass frequency and channel_bandwidth as lists
+        bvis = create_blockvisibility(self.lowcore, self.times, list(self.frequency), phasecentre=self.phasecentre,
+                                      weight=1.0, polarisation_frame=PolarisationFrame('stokesI'),
+                                      channel_bandwidth=list(self.channel_bandwidth))
+        cvis = convert_blockvisibility_to_visibility(bvis)
+        expected = convert_blockvisibility_to_visibility(self.blockvis)
+        assert cvis.nvis == expected.nvis
+        numpy.testing.assert_array_equal(cvis.frequency, expected.frequency)
+        numpy.testing.assert_array_equal(cvis.channel_bandwidth, expected.channel_bandwidth)
+        numpy.testing.assert_array_almost_equal(cvis.uvw, expected.uvw, 12)
+
+    def test_average_in_blocks(self):
+        numpy.random.seed(180555)
+        bvis = self.blockvis
+        vis = numpy.random.normal(size=bvis.vis.shape) + 1j * numpy.random.normal(size=bvis.vis.shape)
+        wts = numpy.random.uniform(0.0, 1.0, bvis.weight.shape)
+        cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex = \
+            average_in_blocks(vis, bvis.uvw, wts, bvis.time, bvis.integration_time, bvis.frequency,
+                              bvis.channel_bandwidth, time_coal=1.0, max_time_coal=8, frequency_coal=1.0,
+                              max_frequency_coal=2)
+        # Each baseline must be averaged as by average_chunks2 over its own blocks
+        for a2, a1 in [(1, 0), (5, 2), (bvis.nants - 1, 0)]:
+            rows = (ca2 == a2) & (ca1 == a1)
+            nrows = numpy.sum(rows)
+            for chunk_size in [(ta, fa) for ta in range(1, 9) for fa in range(1, 3)]:
+                expected, expected_wts = average_chunks2(vis[:, a2, a1, :, 0], wts[:, a2, a1, :, 0], chunk_size)
+                if expected.size == nrows and numpy.allclose(expected.flatten(), cvis[rows, 0]):
+                    numpy.testing.assert_array_almost_equal(expected_wts.flatten(), cwts[rows, 0])
+                    break
+            else:
+                assert False, "Baseline (%d, %d) not averaged consistently with average_chunks2" % (a2, a1)
+
     def test_coalesce_decoalesce(self):
         cvis = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
         assert numpy.min(cvis.frequency) == numpy.min(self.frequency)
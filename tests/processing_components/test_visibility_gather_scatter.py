@@ -12,9 +12,10 @@ from astropy.coordinates import SkyCoord
 from processing_components.simulation.testing_support import create_named_configuration
 from processing_components.visibility.gather_scatter import visibility_gather_time, visibility_gather_w, \
     visibility_scatter_time, visibility_scatter_w, visibility_scatter_channel, \
-    visibility_gather_channel
-from processing_components.visibility.iterators import vis_wslices, vis_timeslices
-from processing_components.visibility.base import create_visibility, create_blockvisibility
+    visibility_gather_channel, visibility_scatter, visibility_gather
+from processing_components.visibility.iterators import vis_wslices, vis_timeslices, vis_timeslice_iter
+from processing_components.visibility.base import create_visibility, create_blockvisibility, \
+    create_visibility_from_rows
 
 import logging
 
@@ -66,6 +67,39 @@ class TestVisibilityGatherScatter(unittest.TestCase):
         assert self.vis.nvis == newvis.nvis
         assert numpy.max(numpy.abs(newvis.vis)) > 0.0
 
+    def test_vis_scatter_gather_timeslice_view(self):
+        self.actualSetUp()
+        vis_slices = vis_timeslices(self.vis, 'auto')
+        original = numpy.copy(self.vis.vis)
+        for makecopy in [True, False]:
+            vis_list = visibility_scatter(self.vis, vis_timeslice_iter, vis_slices, makecopy=makecopy)
+            for subvis in vis_list:
+                assert numpy.may_share_memory(subvis.vis, self.vis.vis) != makecopy
+                subvis.data['vis'][...] *= 2.0
+            if makecopy:
+                numpy.testing.assert_array_equal(self.vis.vis, original)
+            newvis = visibility_gather(vis_list, self.vis, vis_timeslice_iter, vis_slices)
+            numpy.testing.assert_array_equal(newvis.vis, 2.0 * original)
+            self.vis.data['vis'][...] = original
+
+    def test_create_visibility_from_rows_view(self):
+        self.actualSetUp()
+        time = numpy.unique(self.vis.time)[3]
+        rows = self.vis.time == time
+        index = numpy.flatnonzero(rows)
+        for selection in [rows, index, slice(index[0], index[-1] + 1)]:
+            subvis = create_visibility_from_rows(self.vis, selection, makecopy=False)
+            assert subvis.nvis == numpy.sum(rows)
+            assert numpy.may_share_memory(subvis.vis, self.vis.vis)
+            numpy.testing.assert_array_equal(subvis.time, time)
+        # Rows that are not contiguous are copied
+        rows = self.vis.antenna1 == 0
+        subvis = create_visibility_from_rows(self.vis, rows, makecopy=False)
+        assert subvis.nvis == numpy.sum(rows)
+        assert not numpy.may_share_memory(subvis.vis, self.vis.vis)
+        numpy.testing.assert_array_equal(subvis.vis, self.vis.vis[rows])
+        assert create_visibility_from_rows(self.vis, numpy.zeros(self.vis.nvis, dtype=bool)) is None
+
     def test_vis_scatter_gather_channel(self):
         self.actualSetUp()
         nchan = len(self.blockvis.frequency)
@@ -8,7 +8,8 @@ import unittest
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 from processing_components.simulation.testing_support import create_named_configuration
-from processing_components.visibility.iterators import vis_timeslice_iter, vis_wslice_iter, vis_null_iter, vis_timeslices, vis_wslices
+from processing_components.visibility.iterators import vis_timeslice_iter, vis_wslice_iter, vis_null_iter, vis_timeslices, vis_wslices, \
+    vis_sort_index
 from processing_components.visibility.base import create_visibility, create_visibility_from_rows
 
 import logging
@@ -52,7 +53,7 @@ class TestVisibilityIterators(unittest.TestCase):
             total_rows += visslice.nvis
             assert visslice.vis[0].real == visslice.time[0]
             assert len(rows)
-            assert numpy.sum(rows) < self.vis.nvis
+            assert len(rows) < self.vis.nvis
         assert total_rows == self.vis.nvis, "Total rows iterated %d, Original rows %d" % (total_rows, self.vis.nvis)
 
 
@@ -76,5 +77,36 @@ class TestVisibilityIterators(unittest.TestCase):
             assert numpy.sum(visslice.nvis) < self.vis.nvis
         assert total_rows == self.vis.nvis, "Total rows iterated %d, Original rows %d" % (total_rows, self.vis.nvis)
 
+    def test_vis_slice_iterators_unsorted(self):
+        self.actualSetUp()
+        # Shuffle the rows so that neither time nor w is in order
+        order = numpy.random.RandomState(180555).permutation(self.vis.nvis)
+        vis = create_visibility_from_rows(self.vis, order)
+        
+        timemin, timemax = numpy.min(vis.time), numpy.max(vis.time)
+        boxes = numpy.linspace(timemin, timemax, 5)
+        for box, rows in zip(boxes, vis_timeslice_iter(vis, 5)):
+            expected = numpy.flatnonzero(numpy.abs(vis.time - box) <= 0.5 * (boxes[1] - boxes[0]))
+            numpy.testing.assert_array_equal(rows, expected)
+        
+        nchunks = vis_wslices(vis, wslice=10.0)
+        wmaxabs = numpy.max(numpy.abs(vis.w))
+        boxes = numpy.linspace(-wmaxabs, wmaxabs, nchunks)
+        total_rows = 0
+        for box, rows in zip(boxes, vis_wslice_iter(vis, nchunks)):
+            expected = numpy.flatnonzero(numpy.abs(vis.w - box) < 0.5 * (boxes[1] - boxes[0]))
+            numpy.testing.assert_array_equal(rows, expected)
+            total_rows += len(rows)
+        assert total_rows == vis.nvis
+        
+        # The sort index is cached on the data and recomputed if the values change
+        index = vis_sort_index(vis, 'w')
+        assert vis_sort_index(vis, 'w') is index
+        vis.data['uvw'][:, 2] *= -1.0
+        index = vis_sort_index(vis, 'w')
+        assert numpy.all(numpy.diff(vis.w[index]) >= 0.0)
+        assert vis_sort_index(self.vis, 'time') is None
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,9 +6,12 @@ import sys
 import unittest
 import logging
 
+import numpy
+
 from data_models.parameters import arl_path
 
-from processing_components.visibility.base import create_blockvisibility_from_ms, create_visibility_from_ms
+from processing_components.visibility.base import create_blockvisibility_from_ms, create_visibility_from_ms, \
+    create_blockvisibility_from_ms_iterator
 from processing_components.visibility.operations import integrate_visibility_by_channel
 
 log = logging.getLogger(__name__)
@@ -40,6 +43,21 @@ class TestCreateMS(unittest.TestCase):
             assert v.vis.data.shape[-1] == 4
             assert v.polarisation_frame.type == "circular"
 
+    def test_create_iterator(self):
+        if not self.casacore_available:
+            return
+        
+        msfile = arl_path("data/vis/ASKAP_example.ms")
+        vis = create_blockvisibility_from_ms(msfile, range(16, 32))[0]
+        for prefetch in [False, True]:
+            chunks = list(create_blockvisibility_from_ms_iterator(msfile, ntimes=3, channum=range(16, 32),
+                                                                  prefetch=prefetch))
+            assert sum(len(chunk.time) for chunk in chunks) == len(vis.time)
+            for chunk in chunks:
+                assert chunk.vis.shape[-2] == 16
+                assert chunk.polarisation_frame.type == "linear"
+            assert numpy.array_equal(numpy.concatenate([chunk.vis for chunk in chunks]), vis.vis)
+
     def test_create_list_spectral(self):
         if not self.casacore_available:
             return
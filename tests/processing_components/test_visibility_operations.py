@@ -19,7 +19,7 @@ from processing_components.simulation.testing_support import create_named_config
 from processing_components.imaging.base import predict_skycomponent_visibility
 from processing_components.visibility.coalesce import convert_blockvisibility_to_visibility
 from processing_components.visibility.operations import append_visibility, qa_visibility, \
-    sum_visibility, subtract_visibility
+    sum_visibility, subtract_visibility, divide_visibility, concatenate_visibility, VisibilityBuilder
 from processing_components.visibility.base import copy_visibility, create_visibility, create_blockvisibility, create_visibility_from_rows,\
     phaserotate_visibility
 
@@ -112,6 +112,42 @@ class TestVisibilityOperations(unittest.TestCase):
             assert self.vis.nvis == len(self.vis.time)
             assert self.vis.nvis == len(self.vis.frequency)
 
+    def test_visibility_builder(self):
+        for create in [create_visibility, create_blockvisibility]:
+            vis_list = [create(self.lowcore, self.times[i:i + 3], self.frequency,
+                               channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0)
+                        for i in range(0, len(self.times), 3)]
+            builder = VisibilityBuilder(capacity=1)
+            for vis in vis_list:
+                builder.append(vis)
+            fullvis = builder.finalize()
+            assert isinstance(fullvis, type(vis_list[0]))
+            assert fullvis.nvis == sum(vis.nvis for vis in vis_list)
+            for name in vis_list[0].data.dtype.names:
+                numpy.testing.assert_array_equal(fullvis.data[name],
+                                                 numpy.concatenate([vis.data[name] for vis in vis_list]))
+                assert fullvis.data[name].flags['C_CONTIGUOUS']
+            fullvis.data['vis'][...] = 1.0
+            assert numpy.all(vis_list[0].vis == 0.0)
+            assert builder.finalize() is None
+
+    def test_concatenate_visibility(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                     weight=1.0)
+        # Split into interleaved sets of rows so that the concatenation is not in index order
+        vis_list = [create_visibility_from_rows(self.vis, numpy.arange(self.vis.nvis) % 3 == i) for i in range(3)]
+        for sort in [True, False]:
+            newvis = concatenate_visibility([create_visibility_from_rows(vis, numpy.ones(vis.nvis, dtype='bool'))
+                                             for vis in vis_list], sort=sort)
+            assert newvis.nvis == self.vis.nvis
+            if sort:
+                for name in self.vis.data.dtype.names:
+                    numpy.testing.assert_array_equal(newvis.data[name], self.vis.data[name])
+            else:
+                numpy.testing.assert_array_equal(newvis.data['index'],
+                                                 numpy.concatenate([vis.data['index'] for vis in vis_list]))
+
     def test_copy_visibility(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency,
                                      channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
@@ -191,6 +227,23 @@ class TestVisibilityOperations(unittest.TestCase):
         self.assertAlmostEqual(qa.data['maxabs'], 0.0, 7)
 
 
+    def test_divide_visibility(self):
+        self.vis = create_blockvisibility(self.lowcore, self.times, self.frequency,
+                                          channel_bandwidth=self.channel_bandwidth,
+                                          phasecentre=self.phasecentre, weight=1.0,
+                                          polarisation_frame=PolarisationFrame("linear"))
+        self.vis.data['vis'][..., :] = [2.0 + 0.0j, 0.0j, 0.0j, 2.0 + 0.0j]
+        self.othervis = copy_visibility(self.vis)
+        self.othervis.data['vis'][..., :] = [1.0 + 0.0j, 0.0j, 0.0j, 1.0 + 0.0j]
+        # Make one model matrix singular: the corresponding weight should be zeroed
+        self.othervis.data['vis'][0, 1, 0, 0, :] = [1.0 + 0.0j, 2.0 + 0.0j, 2.0 + 0.0j, 4.0 + 0.0j]
+        self.ratiovis = divide_visibility(self.vis, self.othervis)
+        assert self.ratiovis.nvis == self.vis.nvis
+        assert numpy.max(numpy.abs(self.ratiovis.vis)) == 2.0, numpy.max(numpy.abs(self.ratiovis.vis))
+        assert_allclose(self.ratiovis.vis[0, 2, 1, 0], [2.0, 0.0, 0.0, 2.0])
+        assert_allclose(self.ratiovis.weight[0, 1, 0, 0], 0.0)
+        assert_allclose(self.ratiovis.weight[0, 2, 1, 0], [1.0, 0.0, 0.0, 1.0])
+
     def test_qa(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency,
                                      channel_bandwidth=self.channel_bandwidth,
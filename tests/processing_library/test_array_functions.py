@@ -7,7 +7,7 @@ import numpy
 import logging
 
 from processing_library.util.array_functions import average_chunks_jit as average_chunks
-from processing_library.util.array_functions import average_chunks2, average_chunks_jit
+from processing_library.util.array_functions import average_chunks2, average_chunks_jit, invert_2x2
 
 log = logging.getLogger(__name__)
 
@@ -90,5 +90,15 @@ class TestArray_functions(unittest.TestCase):
         numpy.testing.assert_array_equal(cwts, cwts_jit)
 
 
+    def test_invert_2x2(self):
+        m = numpy.random.randn(5, 3, 2, 2) + 1j * numpy.random.randn(5, 3, 2, 2)
+        m[2, 1] = numpy.array([[1.0, 2.0], [2.0, 4.0]])
+        minv, valid = invert_2x2(m)
+        assert not valid[2, 1]
+        assert numpy.sum(valid) == 14
+        numpy.testing.assert_array_equal(minv[2, 1], 0.0)
+        numpy.testing.assert_array_almost_equal(minv[valid], numpy.linalg.inv(m[valid]), 12)
+
+
 if __name__ == '__main__':
     unittest.main()
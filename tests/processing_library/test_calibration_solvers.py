@@ -0,0 +1,65 @@
+""" Unit tests for the antenna gain solvers
+
+
+"""
+import unittest
+
+import numpy
+
+from processing_library.calibration.solvers import hermitian_symmetrise, solve_antenna_gains_itsubs_scalar, \
+    solve_antenna_gains_itsubs_matrix
+
+
+class TestCalibrationSolvers(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(180555)
+        self.nants = 20
+        self.nchan = 3
+    
+    def point_source_equivalent(self, gain):
+        # x(antenna2, antenna1) = gain(antenna1) conj(gain(antenna2)), lower triangle only
+        x = numpy.einsum('jcpq,icpq->ijcpq', gain, numpy.conjugate(gain))
+        x[numpy.triu_indices(self.nants)] = 0.0
+        xwt = numpy.ones(x.shape)
+        xwt[numpy.triu_indices(self.nants)] = 0.0
+        return x, xwt
+    
+    def test_hermitian_symmetrise(self):
+        x = numpy.random.randn(self.nants, self.nants, self.nchan, 4) + \
+            1j * numpy.random.randn(self.nants, self.nants, self.nchan, 4)
+        xwt = numpy.random.uniform(size=x.shape)
+        x, xwt = hermitian_symmetrise(x, xwt)
+        numpy.testing.assert_array_equal(x, numpy.conjugate(numpy.swapaxes(x, 0, 1)))
+        numpy.testing.assert_array_equal(xwt, numpy.swapaxes(xwt, 0, 1))
+        for ant in range(self.nants):
+            assert numpy.all(x[ant, ant] == 0.0)
+            assert numpy.all(xwt[ant, ant] == 0.0)
+    
+    def test_solve_scalar(self):
+        phase = numpy.random.uniform(-1.0, 1.0, [self.nants, self.nchan, 1, 1])
+        phase -= phase[0]
+        truegain = numpy.exp(1j * phase)
+        x, xwt = self.point_source_equivalent(truegain)
+        gain = numpy.ones_like(truegain)
+        gain, gwt, residual = solve_antenna_gains_itsubs_scalar(gain, numpy.zeros(gain.shape),
+                                                                x.reshape([self.nants, self.nants, self.nchan, 1]),
+                                                                xwt.reshape([self.nants, self.nants, self.nchan, 1]),
+                                                                niter=100, tol=1e-12)
+        numpy.testing.assert_array_almost_equal(gain, truegain, 6)
+        assert numpy.max(residual) < 1e-6, residual
+    
+    def test_solve_matrix(self):
+        truegain = numpy.zeros([self.nants, self.nchan, 2, 2], dtype='complex')
+        truegain[..., 0, 0] = 1.0 + 0.1 * numpy.random.randn(self.nants, self.nchan)
+        truegain[..., 1, 1] = 1.0 + 0.1 * numpy.random.randn(self.nants, self.nchan)
+        x, xwt = self.point_source_equivalent(truegain)
+        gain = numpy.ones_like(truegain)
+        gain, gwt, residual = solve_antenna_gains_itsubs_matrix(gain, numpy.zeros(gain.shape),
+                                                                x.reshape([self.nants, self.nants, self.nchan, 4]),
+                                                                xwt.reshape([self.nants, self.nants, self.nchan, 4]),
+                                                                niter=200, tol=1e-12, phase_only=False)
+        assert numpy.max(residual) < 1e-6, residual
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,7 +10,7 @@ from astropy.coordinates import SkyCoord
 from numpy.testing import assert_allclose
 
 from processing_library.util.coordinate_support import xyz_to_uvw, xyz_at_latitude, simulate_point, baselines, uvw_to_xyz, \
-    skycoord_to_lmn
+    skycoord_to_lmn, xyz_to_antenna_uvw, xyz_to_baselines
 
 
 class TestCoordinates(unittest.TestCase):
@@ -101,6 +101,21 @@ class TestCoordinates(unittest.TestCase):
         for i in range(10):
             test(numpy.repeat(numpy.array(range(10 + i)), 3))
     
+    def test_xyz_to_baselines(self):
+        # The batched rotation and broadcast baselines agree with a loop over hour angle and antennas
+        ants_xyz = numpy.random.RandomState(17).normal(size=[7, 3]) * 1000.0
+        ha_range = numpy.linspace(-numpy.pi / 4, numpy.pi / 4, 5)
+        dec = numpy.radians(-45.0)
+        ants_uvw = xyz_to_antenna_uvw(ants_xyz, ha_range, dec)
+        assert ants_uvw.shape == (5, 7, 3)
+        expected = list()
+        for iha, ha in enumerate(ha_range):
+            assert_allclose(ants_uvw[iha], xyz_to_uvw(ants_xyz, ha, dec), rtol=0.0, atol=0.0)
+            for a1 in range(7):
+                for a2 in range(a1 + 1, 7):
+                    expected.append(ants_uvw[iha, a2] - ants_uvw[iha, a1])
+        assert_allclose(xyz_to_baselines(ants_xyz, ha_range, dec), numpy.array(expected), rtol=0.0, atol=0.0)
+    
     def test_simulate_point(self):
         # Prepare a synthetic layout
         uvw = numpy.concatenate(numpy.concatenate(numpy.transpose(numpy.mgrid[-3:4, -3:4, 0:1])))
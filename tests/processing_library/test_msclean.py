@@ -7,7 +7,8 @@ import numpy
 import logging
 
 from processing_library.arrays.cleaners import create_scalestack, convolve_scalestack, convolve_convolve_scalestack,\
-    argmax
+    argmax, create_active_set, find_max_abs_active, convolve_components, hogbom, msclean, hogbom_polarisation, \
+    hogbom_complex, overlapIndices
 
 log = logging.getLogger(__name__)
 
@@ -46,3 +47,139 @@ class TestImageMSClean(unittest.TestCase):
         # convolution
         numpy.testing.assert_array_almost_equal(result[1, 1, 75, 31], self.scalestack[2, self.npixel // 2,
                                                                                       self.npixel // 2], 2)
+
+    def test_active_set(self):
+        window = numpy.zeros([self.npixel, self.npixel])
+        window[64:96, 100:140] = 1.0
+        img = numpy.zeros([self.npixel, self.npixel])
+        img[10, 10] = 10.0
+        img[70, 120] = -2.0
+        active_set = create_active_set(window)
+        assert len(active_set[0]) == 32 * 40
+        assert active_set[1] == (64, 96, 100, 140)
+        mx, my, peak = find_max_abs_active(img, active_set)
+        assert (mx, my) == (70, 120)
+        assert peak == 2.0
+        assert create_active_set(None) is None
+
+    def test_hogbom_window(self):
+        psf = numpy.zeros([self.npixel, self.npixel])
+        psf[self.npixel // 2 - 5:self.npixel // 2 + 6, self.npixel // 2 - 5:self.npixel // 2 + 6] = 0.5
+        psf[self.npixel // 2, self.npixel // 2] = 1.0
+        dirty = numpy.zeros([self.npixel, self.npixel])
+        dirty[75, 31] = 1.0
+        dirty[100, 120] = 2.0
+        dirty = convolve_components(dirty, psf)
+        window = numpy.zeros([self.npixel, self.npixel])
+        window[64:96, 20:40] = 1.0
+        comps, residual = hogbom(dirty, psf, window, 0.1, 0.0, 100, 0.01)
+        assert numpy.sum(comps[window == 0.0]) == 0.0
+        numpy.testing.assert_array_almost_equal(residual, dirty - convolve_components(comps, psf), 7)
+
+    def test_msclean_window(self):
+        psf = numpy.zeros([self.npixel, self.npixel])
+        psf[self.npixel // 2, self.npixel // 2] = 1.0
+        dirty = numpy.zeros([self.npixel, self.npixel])
+        dirty[75, 31] = 1.0
+        dirty[100, 120] = 2.0
+        window = numpy.zeros([self.npixel, self.npixel])
+        window[64:96, 20:40] = 1.0
+        comps, residual = msclean(dirty, psf, window, 0.7, 0.0, 100, [0], 0.01)
+        assert numpy.sum(comps[window == 0.0]) == 0.0
+        numpy.testing.assert_array_almost_equal(residual[100, 120], 2.0, 7)
+        assert numpy.abs(residual[75, 31]) < 0.01
+
+    def test_hogbom_polarisation(self):
+        psf = numpy.zeros([self.npixel, self.npixel])
+        psf[self.npixel // 2 - 5:self.npixel // 2 + 6, self.npixel // 2 - 5:self.npixel // 2 + 6] = 0.5
+        psf[self.npixel // 2, self.npixel // 2] = 1.0
+        planes = list()
+        for plane in range(4):
+            dirty = numpy.zeros([self.npixel, self.npixel])
+            dirty[75 + plane, 31] = 1.0
+            dirty[100, 120 - plane] = 2.0 - 0.5 * plane
+            planes.append(convolve_components(dirty, psf))
+        comps, residuals = hogbom_polarisation([planes[0], planes[1] + 1j * planes[2], planes[3]], [psf, psf, psf],
+                                               None, 0.1, 0.0, 100, 0.01)
+        for plane in [0, 3]:
+            comp, residual = hogbom(planes[plane], psf, None, 0.1, 0.0, 100, 0.01)
+            numpy.testing.assert_array_almost_equal(comps[plane // 2 + plane % 2], comp, 12)
+            numpy.testing.assert_array_almost_equal(residuals[plane // 2 + plane % 2], residual, 12)
+        comp_q, comp_u, residual_q, residual_u = hogbom_complex(planes[1], planes[2], psf, psf, None, 0.1, 0.0,
+                                                                100, 0.01)
+        numpy.testing.assert_array_almost_equal(comps[1].real, comp_q, 12)
+        numpy.testing.assert_array_almost_equal(residuals[1].imag, residual_u, 12)
+
+    def test_hogbom_polarisation_window(self):
+        # Each plane has its own PSF, and components are confined to the window
+        psfs = list()
+        for plane in range(3):
+            psf = numpy.zeros([self.npixel, self.npixel])
+            psf[self.npixel // 2 - 5 - plane:self.npixel // 2 + 6 + plane,
+                self.npixel // 2 - 5:self.npixel // 2 + 6] = 0.4 + 0.1 * plane
+            psf[self.npixel // 2, self.npixel // 2] = 1.0 + plane
+            psfs.append(psf)
+        window = numpy.zeros([self.npixel, self.npixel])
+        window[64:96, 20:40] = 1.0
+        planes = list()
+        for plane in range(3):
+            dirty = numpy.zeros([self.npixel, self.npixel])
+            dirty[75 + plane, 31] = 1.0
+            dirty[100, 120 - plane] = 2.0 - 0.5 * plane
+            planes.append(convolve_components(dirty, psfs[plane]))
+        planes[1] = planes[1] + 1j * numpy.roll(planes[1], 2, axis=0)
+        comps, residuals = hogbom_polarisation(planes, psfs, window, 0.1, 0.0, 100, 0.01)
+        for plane in [0, 2]:
+            comp, residual = hogbom(planes[plane], psfs[plane], window, 0.1, 0.0, 100, 0.01)
+            numpy.testing.assert_array_almost_equal(comps[plane], comp, 12)
+            numpy.testing.assert_array_almost_equal(residuals[plane], residual, 12)
+        for comp in comps:
+            assert numpy.sum(numpy.abs(comp[window == 0.0])) == 0.0
+        # The residual outside the window is the dirty image less the components convolved with the PSF
+        model = convolve_components(comps[1].real, psfs[1]) + 1j * convolve_components(comps[1].imag, psfs[1])
+        numpy.testing.assert_array_almost_equal(residuals[1], planes[1] - model, 12)
+
+    def test_hogbom_polarisation_reference(self):
+        # Compare with a direct loop that searches and subtracts over the whole of each plane
+        def reference(dirty_planes, psfs, window, gain, niter, fracthresh):
+            comps, residuals = list(), list()
+            for dirty, psf in zip(dirty_planes, psfs):
+                res = numpy.array(dirty)
+                comp = numpy.zeros_like(res)
+                absolutethresh = fracthresh * numpy.abs(res).max()
+                for i in range(niter):
+                    absres = numpy.abs(res)
+                    if window is not None:
+                        absres = absres * window
+                    mx, my = numpy.unravel_index(absres.argmax(), res.shape)
+                    mval = res[mx, my] * gain / psf.max()
+                    comp[mx, my] += mval
+                    a1o, a2o = overlapIndices(res, psf, mx, my)
+                    res[a1o[0]:a1o[1], a1o[2]:a1o[3]] -= psf[a2o[0]:a2o[1], a2o[2]:a2o[3]] * mval
+                    if numpy.abs(res[mx, my]) < absolutethresh:
+                        break
+                comps.append(comp)
+                residuals.append(res)
+            return comps, residuals
+        
+        npixel = 64
+        rs = numpy.random.RandomState(180555)
+        psfs = list()
+        planes = list()
+        for plane in range(3):
+            psf = numpy.zeros([npixel, npixel])
+            psf[npixel // 2 - 4:npixel // 2 + 5, npixel // 2 - 3 - plane:npixel // 2 + 4 + plane] = 0.3
+            psf[npixel // 2, npixel // 2] = 1.0
+            psfs.append(psf)
+            dirty = numpy.zeros([npixel, npixel])
+            dirty[rs.randint(8, 56, 5), rs.randint(8, 56, 5)] = rs.uniform(1.0, 2.0, 5)
+            planes.append(convolve_components(dirty, psf))
+        planes[1] = planes[1] + 1j * numpy.roll(planes[1], 3, axis=1)
+        window = numpy.zeros([npixel, npixel])
+        window[10:50, 16:40] = 1.0
+        for w in [None, window]:
+            comps, residuals = hogbom_polarisation(planes, psfs, w, 0.1, 0.0, 50, 0.01)
+            expected_comps, expected_residuals = reference(planes, psfs, w, 0.1, 50, 0.01)
+            for plane in range(3):
+                numpy.testing.assert_array_almost_equal(comps[plane], expected_comps[plane], 12)
+                numpy.testing.assert_array_almost_equal(residuals[plane], expected_residuals[plane], 10)
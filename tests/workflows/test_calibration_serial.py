@@ -0,0 +1,92 @@
+""" Unit tests for calibration workflows
+
+
+"""
+
+import logging
+import unittest
+
+import numpy
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from data_models.polarisation import PolarisationFrame
+
+from wrappers.serial.calibration.operations import create_gaintable_from_blockvisibility, apply_gaintable
+from wrappers.serial.imaging.base import predict_skycomponent_visibility
+from wrappers.serial.skycomponent.operations import create_skycomponent
+from wrappers.serial.simulation.testing_support import create_named_configuration, simulate_gaintable
+from wrappers.serial.visibility.base import copy_visibility, create_blockvisibility
+
+from workflows.serial.calibration.calibration_serial import calibrate_list_serial_workflow
+
+log = logging.getLogger(__name__)
+
+
+class TestCalibrationSerial(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(180555)
+
+        lowcore = create_named_configuration('LOWBD2-CORE')
+        times = (numpy.pi / 43200.0) * numpy.linspace(0.0, 30.0, 3)
+        phasecentre = SkyCoord(ra=+180.0 * u.deg, dec=-35.0 * u.deg, frame='icrs', equinox='J2000')
+        compdirection = SkyCoord(ra=+181.0 * u.deg, dec=-35.0 * u.deg, frame='icrs', equinox='J2000')
+
+        # One visibility per frequency window, all corrupted by the same gains
+        self.model_vislist = list()
+        self.vis_list = list()
+        gt = None
+        for frequency in [1.0e8, 1.1e8]:
+            model_vis = create_blockvisibility(lowcore, times, numpy.array([frequency]),
+                                               channel_bandwidth=numpy.array([1e7]), phasecentre=phasecentre,
+                                               weight=1.0, polarisation_frame=PolarisationFrame('stokesI'))
+            comp = create_skycomponent(direction=compdirection, flux=numpy.array([[100.0]]),
+                                       frequency=numpy.array([frequency]),
+                                       polarisation_frame=PolarisationFrame('stokesI'))
+            model_vis = predict_skycomponent_visibility(model_vis, comp)
+            if gt is None:
+                gt = create_gaintable_from_blockvisibility(model_vis)
+                gt = simulate_gaintable(gt, phase_error=1.0, amplitude_error=0.0)
+            self.model_vislist.append(model_vis)
+            self.vis_list.append(apply_gaintable(copy_visibility(model_vis), gt))
+
+    def test_calibrate_list_warm_start(self):
+        for global_solution in [False, True]:
+            original_vislist = [copy_visibility(vis) for vis in self.vis_list]
+            gt_list = [None for vis in self.vis_list]
+            calibrated_vislist, gt_list = calibrate_list_serial_workflow(self.vis_list, self.model_vislist,
+                                                                         calibration_context='T',
+                                                                         global_solution=global_solution,
+                                                                         gt_list=gt_list)
+            assert len(calibrated_vislist) == len(self.vis_list)
+            assert len(gt_list) == len(self.vis_list)
+            for vis, calibrated_vis, model_vis, original_vis in zip(self.vis_list, calibrated_vislist,
+                                                                    self.model_vislist, original_vislist):
+                # The data are calibrated on a copy, leaving the original data unchanged
+                numpy.testing.assert_array_equal(vis.vis, original_vis.vis)
+                numpy.testing.assert_array_almost_equal(calibrated_vis.vis, model_vis.vis, 6)
+
+            # The next major cycle calibrates the original data again, starting from these gaintables, so the
+            # solution is unchanged rather than close to unity
+            new_calibrated_vislist, new_gt_list = calibrate_list_serial_workflow(self.vis_list, self.model_vislist,
+                                                                                 calibration_context='T',
+                                                                                 global_solution=global_solution,
+                                                                                 gt_list=gt_list, iteration=1)
+            for gaintables, new_gaintables in zip(gt_list, new_gt_list):
+                assert numpy.max(numpy.abs(numpy.angle(gaintables['T'].gain))) > 0.1
+                numpy.testing.assert_array_almost_equal(new_gaintables['T'].gain, gaintables['T'].gain, 6)
+            for calibrated_vis, new_calibrated_vis in zip(calibrated_vislist, new_calibrated_vislist):
+                numpy.testing.assert_array_almost_equal(new_calibrated_vis.vis, calibrated_vis.vis, 6)
+
+    def test_calibrate_list_return(self):
+        for global_solution in [False, True]:
+            calibrated_vislist = calibrate_list_serial_workflow([copy_visibility(vis) for vis in self.vis_list],
+                                                                self.model_vislist, calibration_context='T',
+                                                                global_solution=global_solution)
+            assert len(calibrated_vislist) == len(self.vis_list)
+            for calibrated_vis, model_vis in zip(calibrated_vislist, self.model_vislist):
+                numpy.testing.assert_array_almost_equal(calibrated_vis.vis, model_vis.vis, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
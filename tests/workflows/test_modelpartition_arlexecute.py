@@ -27,7 +27,11 @@ from wrappers.arlexecute.skycomponent.operations import apply_beam_to_skycompone
 from wrappers.arlexecute.visibility.base import copy_visibility, create_blockvisibility
 from wrappers.arlexecute.visibility.coalesce import convert_blockvisibility_to_visibility
 
-# from workflows.arlexecute.calibration.modelpartition_arlexecute import solve_modelpartition_list_arlexecute_workflow
+from wrappers.serial.calibration.modelpartition import create_modelpartitions, solve_modelpartitions
+from wrappers.arlexecute.skycomponent.operations import create_skycomponent
+from workflows.arlexecute.calibration.modelpartition_arlexecute import \
+    solve_modelpartition_list_arlexecute_workflow, solve_modelpartition_consensus_list_arlexecute_workflow
+from workflows.arlexecute.imaging.imaging_arlexecute import invert_list_arlexecute_workflow
 
 log = logging.getLogger(__name__)
 
@@ -45,6 +49,34 @@ class TestCalibrationSkyModelcal(unittest.TestCase):
     def tearDown(self):
         arlexecute.close()
     
+    def simpleSetup(self):
+        
+        lowcore = create_named_configuration('LOWBD2', rmax=300.0)
+        times = numpy.linspace(-numpy.pi / 6.0, numpy.pi / 6.0, 3)
+        frequency = numpy.array([1e8])
+        channel_bandwidth = numpy.array([1e6])
+        phasecentre = SkyCoord(ra=+180.0 * u.deg, dec=-60.0 * u.deg, frame='icrs', equinox='J2000')
+        self.vis = create_blockvisibility(lowcore, times, frequency=frequency, channel_bandwidth=channel_bandwidth,
+                                          weight=1.0, phasecentre=phasecentre,
+                                          polarisation_frame=PolarisationFrame("stokesI"))
+        
+        directions = [SkyCoord(ra=+181.0 * u.deg, dec=-60.0 * u.deg, frame='icrs', equinox='J2000'),
+                      SkyCoord(ra=+179.0 * u.deg, dec=-59.0 * u.deg, frame='icrs', equinox='J2000')]
+        self.components = [create_skycomponent(direction=direction, flux=numpy.array([[10.0]]),
+                                               frequency=frequency, polarisation_frame=PolarisationFrame('stokesI'))
+                           for direction in directions]
+        
+        # Each component is corrupted by its own gains
+        for sc in self.components:
+            component_vis = copy_visibility(self.vis, zero=True)
+            component_vis = predict_skycomponent_visibility(component_vis, sc)
+            gt = create_gaintable_from_blockvisibility(component_vis)
+            gt = simulate_gaintable(gt, phase_error=0.1, amplitude_error=0.0)
+            component_vis = apply_gaintable(component_vis, gt)
+            self.vis.data['vis'][...] += component_vis.data['vis'][...]
+        
+        self.skymodels = [SkyModel(components=[sc], fixed=True) for sc in self.components]
+    
     def actualSetup(self, vnchan=1, doiso=True, ntimes=5, flux_limit=2.0, zerow=True, fixed=False):
         
         nfreqwin = vnchan
@@ -112,25 +144,38 @@ class TestCalibrationSkyModelcal(unittest.TestCase):
         
         self.skymodels = [SkyModel(components=[cm], fixed=fixed) for cm in self.components]
     
-    @unittest.skip("Not converted to arlexecute")
     def test_modelpartition_solve_arlexecute(self):
         
-        self.actualSetup(doiso=True)
-        
-        self.skymodel_list = [arlexecute.execute(SkyModel, nout=1)(components=[cm])
-                              for cm in self.components]
-        
-        # modelpartition_list = solve_modelpartition_list_arlexecute_workflow(self.vis, skymodel_list=self.skymodel_list, niter=30,
-        #                                                                     gain=0.25)
-        # skymodel, residual_vis = arlexecute.compute(modelpartition_list, sync=True)
-        #
-        # residual_vis = convert_blockvisibility_to_visibility(residual_vis)
-        # residual_vis, _, _ = weight_visibility(residual_vis, self.beam)
-        # dirty, sumwt = invert_list_arlexecute_workflow(residual_vis, self.beam, context='2d')
-        # export_image_to_fits(dirty, "%s/test_modelpartition-%s-final-iso-residual.fits" % (self.dir, arlexecute.type()))
-        #
-        # qa = qa_image(dirty)
-        # assert qa.data['rms'] < 3.2e-3, qa
+        self.simpleSetup()
+        model_partitions = create_modelpartitions(self.vis, self.skymodels)
+        serial_model_partitions, serial_residual_vis = solve_modelpartitions(self.vis, model_partitions, niter=3,
+                                                                             tol=0.0, gain=0.5)
+        
+        result = solve_modelpartition_list_arlexecute_workflow(self.vis, self.skymodels, niter=3, gain=0.5)
+        model_partitions, residual_vis = arlexecute.compute(result, sync=True)
+        
+        assert len(model_partitions) == len(serial_model_partitions)
+        numpy.testing.assert_array_almost_equal(residual_vis.vis, serial_residual_vis.vis)
+        for (sm, gt), (serial_sm, serial_gt) in zip(model_partitions, serial_model_partitions):
+            numpy.testing.assert_array_almost_equal(gt.gain, serial_gt.gain)
+            numpy.testing.assert_array_almost_equal(sm.components[0].flux, serial_sm.components[0].flux)
+    
+    def test_modelpartition_consensus_arlexecute(self):
+        
+        self.simpleSetup()
+        model_partitions = create_modelpartitions(self.vis, self.skymodels)
+        serial_model_partitions, _ = solve_modelpartitions(self.vis, model_partitions, niter=2, tol=0.0, gain=0.5)
+        
+        skymodel_list = solve_modelpartition_consensus_list_arlexecute_workflow([self.vis, self.vis],
+                                                                               [self.skymodels, self.skymodels],
+                                                                               niter=2, coniter=1, gain=0.5)
+        skymodel_list = arlexecute.compute(skymodel_list, sync=True)
+        
+        # Both visibilities are the same so the consensus is the solution for either
+        assert len(skymodel_list) == 2
+        for skymodels in skymodel_list:
+            for sm, (serial_sm, _) in zip(skymodels, serial_model_partitions):
+                numpy.testing.assert_array_almost_equal(sm.components[0].flux, serial_sm.components[0].flux)
 
 
 if __name__ == '__main__':
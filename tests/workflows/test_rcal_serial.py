@@ -5,6 +5,8 @@
 
 import logging
 import sys
+import threading
+import time
 import unittest
 
 import numpy
@@ -23,7 +25,7 @@ from wrappers.serial.skycomponent.operations import create_skycomponent, insert_
 from wrappers.serial.simulation.testing_support import create_named_configuration, simulate_gaintable
 from wrappers.serial.visibility.base import create_blockvisibility, create_visibility
 
-from wrappers.serial.calibration.rcal import rcal
+from wrappers.serial.calibration.rcal import rcal, rcal_stream
 
 log = logging.getLogger(__name__)
 
@@ -128,6 +130,36 @@ class TestPipelinesFunctions(unittest.TestCase):
         for igt, gt in enumerate(rcal(vis=self.vis, components=self.comps)):
             assert numpy.max(gt.residual) < 4e-5
 
+    def test_RCAL_stream(self):
+        self.setupVis(add_errors=True, block=True, freqwin=5)
+        vis_iter = (self.vis for i in range(3))
+        statistics = list()
+        for igt, gt in enumerate(rcal_stream(vis_iter, components=self.comps, rate=100.0, queue_size=1,
+                                             statistics=statistics)):
+            assert numpy.max(gt.residual) < 4e-5
+        assert igt == 2
+        assert len(statistics) == 3
+        for stats in statistics:
+            assert stats['latency'] >= stats['solve']
+
+    def test_RCAL_stream_close(self):
+        self.setupVis(add_errors=True, block=True, freqwin=5)
+        release = threading.Event()
+        
+        def blocking_iter():
+            yield self.vis
+            # The reader thread is stuck here, as when waiting on a slow source
+            release.wait(60.0)
+            yield self.vis
+        
+        stream = rcal_stream(blocking_iter(), components=self.comps, join_timeout=0.5)
+        gt = next(stream)
+        assert numpy.max(gt.residual) < 4e-5
+        start = time.time()
+        stream.close()
+        assert time.time() - start < 5.0
+        release.set()
+
 
 if __name__ == '__main__':
     unittest.main()
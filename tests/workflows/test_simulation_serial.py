@@ -11,7 +11,7 @@ from astropy.coordinates import SkyCoord
 
 from data_models.memory_data_models import BlockVisibility
 
-from workflows.serial.simulation.simulation_serial import simulate_list_serial_workflow
+from workflows.serial.simulation.simulation_serial import simulate_list_serial_workflow, corrupt_list_serial_workflow
 
 log = logging.getLogger(__name__)
 
@@ -35,3 +35,19 @@ class TestSimulationArlexecuteSupport(unittest.TestCase):
         assert isinstance(vt, BlockVisibility)
         assert vt.nvis > 0
  
+
+    def test_corrupt_vis_list(self):
+        def corrupt(seed):
+            vis_list = simulate_list_serial_workflow(frequency=self.frequency, channel_bandwidth=self.channel_bandwidth,
+                                                     times=self.times)
+            for vis in vis_list:
+                vis.data['vis'][...] = 1.0
+            return corrupt_list_serial_workflow(vis_list, phase_error=1.0, seed=seed)
+        
+        vis_list = corrupt(180555)
+        assert len(vis_list) == len(self.frequency)
+        # Each window has its own random stream
+        assert numpy.max(numpy.abs(vis_list[0].vis - vis_list[1].vis)) > 0.0
+        # and the streams are reproducible
+        for vis, other in zip(vis_list, corrupt(180555)):
+            numpy.testing.assert_array_equal(vis.vis, other.vis)
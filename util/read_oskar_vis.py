@@ -6,10 +6,11 @@ import collections
 import numpy
 import os
 
-from astropy.coordinates import ICRS, EarthLocation
-from astropy.wcs import WCS
+import astropy.units as u
+from astropy.coordinates import ICRS, EarthLocation, SkyCoord
 
-from arl.data.data_models import *
+from data_models.memory_data_models import Visibility, BlockVisibility, Configuration
+from data_models.polarisation import PolarisationFrame
 
 
 class OskarBinary(object):
@@ -19,9 +20,9 @@ class OskarBinary(object):
     see:
         http://www.oerc.ox.ac.uk/~ska/oskar2/OSKAR-Binary-File-Format.pdf
 
-    TODO:
-        - Split data reading from indexing to be able to deal with very large
-          files and make reading a sub-set of the data faster.
+    The file is indexed once when opened: only the block headers are read.
+    The block payloads are numpy views on a memory map of the file, so
+    data are only read from disk when they are used.
     """
 
     # noinspection PyRedeclaration
@@ -53,11 +54,13 @@ class OskarBinary(object):
         self.file_handle = open(file_name, 'rb')
         self.bin_ver = 0
         self.record = collections.OrderedDict()
+        self.memmap = numpy.memmap(file_name, dtype='u1', mode='r')
         self.read()
 
     def __del__(self):
         """Destructor."""
-        self.file_handle.close()
+        if hasattr(self, 'file_handle'):
+            self.file_handle.close()
 
     def read_header(self):
         """Read header."""
@@ -127,58 +130,53 @@ class OskarBinary(object):
         return block
 
     def read_block_data(self, block):
-        """."""
+        """Set the block data as a view on the memory map of the file.
+
+        The payload starts at the current position of the file handle,
+        which is moved past it without reading.
+        """
         f = self.file_handle
+        offset = f.tell()
 
         # Data size of the block payload.
         data_size = block['block_size']
         if block['flag_crc']:
             data_size -= 4
 
-        # Read the block payload.
+        # Byte order of the payload.
+        if block['flag_endian']:
+            order = '>'
+        else:
+            order = '<'
+
+        complex_type = self.is_set(block['data_type'], self.DataType.Complex)
+        matrix_type = self.is_set(block['data_type'], self.DataType.Matrix)
+
         if self.is_set(block['data_type'], self.DataType.Char):
             name = 'char'
             n = data_size
-            data = f.read(data_size)
+            data = bytes(self.memmap[offset:offset + data_size])
 
         elif self.is_set(block['data_type'], self.DataType.Int):
             name = 'int'
             n = data_size // block['element_size']
-            data = struct.unpack('i' * n, f.read(data_size))
-
-        elif self.is_set(block['data_type'], self.DataType.Single):
-            if self.is_set(block['data_type'], self.DataType.Matrix):
-                if self.is_set(block['data_type'], self.DataType.Complex):
-                    name = 'single complex matrix'
-                    n = data_size // block['element_size'] * 2 * 4
-                else:
-                    name = 'single matrix'
-                    n = data_size // block['element_size'] * 4
+            data = self.view(offset, order + 'i4', n)
+
+        elif self.is_set(block['data_type'], self.DataType.Single) or \
+                self.is_set(block['data_type'], self.DataType.Double):
+            if self.is_set(block['data_type'], self.DataType.Single):
+                name, itemsize = 'single', 4
             else:
-                if self.is_set(block['data_type'], self.DataType.Complex):
-                    name = 'single complex'
-                    n = data_size // block['element_size'] * 2
-                else:
-                    name = 'single'
-                    n = data_size // block['element_size']
-            data = struct.unpack('f' * n, f.read(data_size))
-
-        elif self.is_set(block['data_type'], self.DataType.Double):
-            if self.is_set(block['data_type'], self.DataType.Matrix):
-                if self.is_set(block['data_type'], self.DataType.Complex):
-                    name = 'double complex matrix'
-                    n = data_size // block['element_size'] * 2 * 4
-                else:
-                    name = 'double matrix'
-                    n = data_size // block['element_size'] * 4
+                name, itemsize = 'double', 8
+            if complex_type:
+                name += ' complex'
+                dtype = '%sc%d' % (order, 2 * itemsize)
             else:
-                if self.is_set(block['data_type'], self.DataType.Complex):
-                    name = 'double complex'
-                    n = data_size // block['element_size'] * 2
-                else:
-                    name = 'double'
-                    n = data_size // block['element_size']
-            data = struct.unpack('d ' * n, f.read(data_size))
+                dtype = '%sf%d' % (order, itemsize)
+            if matrix_type:
+                name += ' matrix'
+            n = data_size // itemsize
+            data = self.view(offset, dtype, data_size // numpy.dtype(dtype).itemsize)
 
         else:
             raise ValueError('ERROR: Unknown binary data type detected.')
@@ -186,34 +184,24 @@ class OskarBinary(object):
         # Add the data block into the block dictionary.
         block['data_type_name'] = name
         block['data_length'] = n
+        block['offset'] = offset
         block['data'] = numpy.squeeze(data)
 
-        if (self.is_set(block['data_type'], self.DataType.Double) or
-                self.is_set(block['data_type'], self.DataType.Single)) \
-                and block['data'].shape != ():
-            assert len(block['data'].shape) == 1, \
-                'Unexpected Matrix like block data shape detected ' \
-                '@ block number %i id:(%i.%i.%i)' % (block['number'],
-                                                     block['group'],
-                                                     block['tag'],
-                                                     block['index'])
-            # Convert complex data to python complex type
-            if self.is_set(block['data_type'], self.DataType.Complex):
-                block['data'] = numpy.array([complex(v[0], v[1]) for v
-                                             in block['data'].reshape(n // 2, 2)
-                                             ])
-                block['block_length'] = n / 2
-            # Wrap matrix data into 2 x 2 blocks.
-            if self.is_set(block['data_type'], self.DataType.Matrix):
-                n = block['block_length']
-                block['data'] = block['data'].reshape(n // 4, 2, 2)
+        if complex_type and block['data'].shape != ():
+            block['block_length'] = n // 2
+        # Wrap matrix data into 2 x 2 blocks.
+        if matrix_type and block['data'].shape != ():
+            block['data'] = block['data'].reshape(-1, 2, 2)
 
-        if block['flag_crc']:
-            # TODO(BM) implement CRC check. e.g. http://goo.gl/IfyyOO
-            f.read(4)
+        f.seek(block['block_size'], 1)
+
+    def view(self, offset, dtype, count):
+        """Return count elements of dtype at offset in the file, without copying."""
+        return numpy.frombuffer(self.memmap, dtype=dtype, count=count,
+                                offset=offset)
 
     def read_data(self):
-        """."""
+        """Index the blocks."""
         f = self.file_handle
         block_id = 0
         while f.read(3) == b'TBG':
@@ -357,37 +345,49 @@ class OskarVis(OskarBinary):
         # for index in block_dims:
         #     print index, block_dims[index]['data']
 
-    def uvw(self, flatten=False):
+    def block_dims(self, index):
+        """Return (time start, number of times) of a visibility block."""
+        block_dims = self.record[self.Group.VisBlock][self.VisBlock.Dims][index]['data']
+        block_time_start = block_dims[0]
+        block_times = block_dims[2]
+        block_baselines = block_dims[4]
+        assert block_baselines == self.num_baselines, \
+            "Data dimension mismatch"
+        assert block_times <= self.block_length, \
+            "Invalid block length ?!."
+        return int(block_time_start), int(block_times)
+
+    def block_data(self, tag, index):
+        """Return the data of a visibility block as a view with shape
+        (times, baselines, ...) on the memory map of the file."""
+        _, block_times = self.block_dims(index)
+        data = self.record[self.Group.VisBlock][tag][index]['data']
+        data = data[0:self.num_baselines * block_times]
+        return data.reshape((block_times, self.num_baselines) + data.shape[1:])
+
+    def block_uvw(self, index):
+        """Return the uu, vv, ww of a visibility block, shape (times, baselines)."""
         # FIXME(BM) handle channels?
         # FIXME(BM) uvw coordinates when auto-correlations are present.
-        group = self.Group.VisBlock
-        tag_uu = self.VisBlock.UU
-        tag_vv = self.VisBlock.VV
-        tag_ww = self.VisBlock.WW
+        return (self.block_data(self.VisBlock.UU, index),
+                self.block_data(self.VisBlock.VV, index),
+                self.block_data(self.VisBlock.WW, index))
+
+    def block_amplitudes(self, index):
+        """Return the cross-correlations of a visibility block, shape
+        (times, baselines) or (times, baselines, 2, 2) for linear polarisation."""
+        assert self.pol_type in (self.PolarisationType.I, self.PolarisationType.Linear), \
+            "Unexpected polarisation type."
+        return self.block_data(self.VisBlock.CrossCorrelation, index)
+
+    def uvw(self, flatten=False):
         uu = numpy.empty((self.num_times, self.num_baselines), dtype='f8')
         vv = numpy.empty((self.num_times, self.num_baselines), dtype='f8')
         ww = numpy.empty((self.num_times, self.num_baselines), dtype='f8')
         for index in range(0, self.num_blocks):
-            block_dims = self.record[group][self.VisBlock.Dims][index]['data']
-            block_times = block_dims[2]
-            block_time_start = block_dims[0]
-            block_baselines = block_dims[4]
-            assert block_baselines == self.num_baselines, \
-                "Data dimension mismatch"
-            assert block_times <= self.block_length, \
-                "Invalid block length ?!."
-            uu_block = self.record[group][tag_uu][index]['data']
-            uu_block = uu_block[0:block_baselines * block_times]
-            uu_block = uu_block.reshape((block_times, block_baselines))
-            uu[block_time_start:block_time_start + block_times, :] = uu_block
-            vv_block = self.record[group][tag_vv][index]['data']
-            vv_block = vv_block[0:block_baselines * block_times]
-            vv_block = vv_block.reshape((block_times, block_baselines))
-            vv[block_time_start:block_time_start + block_times, :] = vv_block
-            ww_block = self.record[group][tag_ww][index]['data']
-            ww_block = ww_block[0:block_baselines * block_times]
-            ww_block = ww_block.reshape((block_times, block_baselines))
-            ww[block_time_start:block_time_start + block_times, :] = ww_block
+            block_time_start, block_times = self.block_dims(index)
+            times = slice(block_time_start, block_time_start + block_times)
+            uu[times], vv[times], ww[times] = self.block_uvw(index)
         # FIXME(BM): The data starts flat so if flatten, just don't reshape?
         if flatten:
             uu = uu.flatten()
@@ -396,51 +396,20 @@ class OskarVis(OskarBinary):
         return uu, vv, ww
 
     def amplitudes(self, flatten=False):
-        group = self.Group.VisBlock
-        tag = self.VisBlock.CrossCorrelation
-        tag_dims = self.VisBlock.Dims
-
         if self.pol_type == self.PolarisationType.I:
-            amp = numpy.empty((self.num_times, self.num_baselines), dtype='c16')
-            for index in range(0, self.num_blocks):
-                block_dims = self.record[group][tag_dims][index]['data']
-                block_time_start = block_dims[0]
-                block_times = block_dims[2]
-                block_baselines = block_dims[4]
-                assert block_baselines == self.num_baselines, \
-                    "Data dimension mismatch"
-                assert block_times <= self.block_length, \
-                    "Invalid block length ?!."
-                amp_block = self.record[group][tag][index]['data']
-                amp_block = amp_block[0:block_baselines * block_times]
-                amp_block = amp_block.reshape((block_times, block_baselines))
-                amp[block_time_start:block_time_start + block_times, :] = \
-                    amp_block
-            if flatten:
-                amp = amp.flatten()
-            return amp
-
+            shape = (self.num_times, self.num_baselines)
         elif self.pol_type == self.PolarisationType.Linear:
-            amp = numpy.empty((self.num_times, self.num_baselines, 2, 2),
-                              dtype='c16')
-            for index in range(0, self.num_blocks):
-                block_dims = self.record[group][tag_dims][index]['data']
-                block_time_start = block_dims[0]
-                block_times = block_dims[2]
-                block_baselines = block_dims[4]
-                assert block_baselines == self.num_baselines, \
-                    "Data dimension mismatch"
-                assert block_times <= self.block_length, \
-                    "Invalid block length ?!."
-                amp_block = self.record[group][tag][index]['data']
-                amp_block = amp_block[0:block_baselines * block_times]
-                amp_block = amp_block.reshape((block_times, block_baselines,
-                                               2, 2))
-                amp[block_time_start:block_time_start + block_times, :] = \
-                    amp_block
-            if flatten:
-                amp = amp.reshape(self.num_baselines * self.num_times, 2, 2)
-            return amp
+            shape = (self.num_times, self.num_baselines, 2, 2)
+        else:
+            return None
+        amp = numpy.empty(shape, dtype='c16')
+        for index in range(0, self.num_blocks):
+            block_time_start, block_times = self.block_dims(index)
+            amp[block_time_start:block_time_start + block_times] = \
+                self.block_amplitudes(index)
+        if flatten:
+            amp = amp.reshape((self.num_baselines * self.num_times,) + shape[2:])
+        return amp
 
     def stokes_i(self, flatten=True):
         amp = self.amplitudes(flatten)
@@ -489,6 +458,11 @@ class OskarVis(OskarBinary):
         freq_inc = self.record[group][tag][index]['data']
         return start_freq + channel * freq_inc
 
+    def channel_bandwidth(self):
+        group = self.Group.VisHeader
+        tag = self.VisHeader.ChannelBandwidth
+        return self.record[group][tag][0]['data']
+
     def print_summary(self, verbose=False):
         print('No. times     : %i' % self.num_times)
         print('No. channels  : %i' % self.num_channels)
@@ -525,28 +499,94 @@ def import_visibility_from_oskar(oskar_file: str) -> Visibility:
     oskar_vis = OskarVis(oskar_file)
     ra, dec = oskar_vis.phase_centre()
     a1, a2 = oskar_vis.stations(flatten=True)
+    nvis = len(a1)
+    
+    # Construct visibilities
+    return Visibility(
+        frequency=numpy.full(nvis, oskar_vis.frequency(0)),
+        channel_bandwidth=numpy.full(nvis, oskar_vis.channel_bandwidth()),
+        phasecentre=SkyCoord(frame=ICRS, ra=ra, dec=dec, unit=u.deg),
+        configuration=oskar_configuration(oskar_vis),
+        uvw=numpy.transpose(oskar_vis.uvw(flatten=True)),
+        time=oskar_vis.times(flatten=True),
+        antenna1=a1,
+        antenna2=a2,
+        vis=oskar_vis.amplitudes(flatten=True).reshape(nvis, -1),
+        weight=numpy.ones([nvis, oskar_polarisation_frame(oskar_vis).npol]),
+        polarisation_frame=oskar_polarisation_frame(oskar_vis))
+
+
+def import_blockvisibility_from_oskar_iterator(oskar_file: str):
+    """ Iterate through an OSKAR visibility file, one OSKAR block of times at a time
+
+    The blocks are read through a memory map so only the block being converted is read from disk. Only single
+    channel files are supported.
+
+    :param oskar_file: Name of OSKAR visibility file
+    :returns: BlockVisibility for each block
+    """
+    oskar_vis = OskarVis(oskar_file)
+    assert oskar_vis.num_channels == 1, "Only single channel OSKAR files are supported"
+    ra, dec = oskar_vis.phase_centre()
+    phasecentre = SkyCoord(frame=ICRS, ra=ra, dec=dec, unit=u.deg)
+    configuration = oskar_configuration(oskar_vis)
+    polarisation_frame = oskar_polarisation_frame(oskar_vis)
+    nants = int(oskar_vis.num_stations)
+    npol = polarisation_frame.npol
+    station1, station2 = oskar_vis.stations(flatten=True)
+    station1, station2 = station1[:oskar_vis.num_baselines], station2[:oskar_vis.num_baselines]
+    times = oskar_vis.times()[:, 0]
+    integration_time = oskar_vis.record[oskar_vis.Group.VisHeader][oskar_vis.VisHeader.TimeIntegration][0]['data']
     
-    # Make configuration
+    for index in range(oskar_vis.num_blocks):
+        block_time_start, block_times = oskar_vis.block_dims(index)
+        # Baselines are held in the lower triangle [time, a2, a1] with a2 > a1
+        bv_uvw = numpy.zeros([block_times, nants, nants, 3])
+        for i, coord in enumerate(oskar_vis.block_uvw(index)):
+            bv_uvw[:, station2, station1, i] = coord
+        bv_vis = numpy.zeros([block_times, nants, nants, 1, npol], dtype='complex')
+        bv_vis[:, station2, station1, 0, :] = oskar_vis.block_amplitudes(index).reshape(block_times,
+                                                                                         len(station1), npol)
+        bv_weight = numpy.zeros([block_times, nants, nants, 1, npol])
+        bv_weight[:, station2, station1, ...] = 1.0
+        
+        yield BlockVisibility(uvw=bv_uvw,
+                              time=times[block_time_start:block_time_start + block_times],
+                              frequency=numpy.array([oskar_vis.frequency(0)]),
+                              channel_bandwidth=numpy.array([oskar_vis.channel_bandwidth()]),
+                              vis=bv_vis,
+                              weight=bv_weight,
+                              integration_time=numpy.full(block_times, integration_time),
+                              configuration=configuration,
+                              phasecentre=phasecentre,
+                              polarisation_frame=polarisation_frame)
+
+
+def oskar_configuration(oskar_vis: OskarVis) -> Configuration:
+    """ Make the Configuration of an OSKAR visibility file
+
+    :param oskar_vis: OskarVis
+    :returns: Configuration
+    """
     location = EarthLocation(lon=oskar_vis.telescope_lon,
                              lat=oskar_vis.telescope_lat,
                              height=oskar_vis.telescope_alt)
     antxyz = numpy.transpose([oskar_vis.station_x,
                               oskar_vis.station_y,
                               oskar_vis.station_z])
-    config = Configuration(
+    return Configuration(
         name=oskar_vis.telescope_path,
         location=location,
         xyz=antxyz
     )
-    
-    # Construct visibilities
-    return Visibility(
-        frequency=[oskar_vis.frequency(i) for i in range(oskar_vis.num_channels)],
-        phasecentre=SkyCoord(frame=ICRS, ra=ra, dec=dec, unit=u.deg),
-        configuration=config,
-        uvw=numpy.transpose(oskar_vis.uvw(flatten=True)),
-        time=oskar_vis.times(flatten=True),
-        antenna1=a1,
-        antenna2=a2,
-        vis=oskar_vis.amplitudes(flatten=True),
-        weight=numpy.ones(a1.shape))
+
+
+def oskar_polarisation_frame(oskar_vis: OskarVis) -> PolarisationFrame:
+    """ Return the polarisation frame of an OSKAR visibility file
+
+    :param oskar_vis: OskarVis
+    :returns: PolarisationFrame
+    """
+    if oskar_vis.pol_type == oskar_vis.PolarisationType.Linear:
+        return PolarisationFrame('linear')
+    return PolarisationFrame('stokesI')
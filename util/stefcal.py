@@ -4,10 +4,15 @@
 # 22 April 2013
 #
 
+import logging
+
 import numpy as np
 
+log = logging.getLogger(__name__)
+
 
-def stefcal(vis, num_ants, antA, antB, weights=1.0, num_iters=10, ref_ant=0, init_gain=None):
+def stefcal(vis, num_ants, antA, antB, weights=1.0, num_iters=10, ref_ant=0, init_gain=None, tol=None,
+            phase_only=False):
     """Solve for antenna gains using StefCal (array dot product version).
 
     The observed visibilities are provided in a NumPy array of any shape and
@@ -41,6 +46,10 @@ def stefcal(vis, num_ants, antA, antB, weights=1.0, num_iters=10, ref_ant=0, ini
         Index of reference antenna that will be forced to have a gain of 1.0
     init_gain : array of complex, shape(num_ants,) or None, optional
         Initial gain vector (all equal to 1.0 by default)
+    tol : float or None, optional
+        Stop when the maximum absolute gain change falls below this value
+    phase_only : bool, optional
+        Constrain the gains to unit amplitude
 
     Returns
     -------
@@ -56,30 +65,53 @@ def stefcal(vis, num_ants, antA, antB, weights=1.0, num_iters=10, ref_ant=0, ini
 
     """
     # Each row of this array contains the indices of baselines with the same antA
-    baselines_per_antA = np.array([(antA == m).nonzero()[0] for m in range(num_ants)])
+    counts = np.bincount(antA, minlength=num_ants)
+    if np.all(counts == counts[0]):
+        baselines_per_antA = np.argsort(antA, kind='stable').reshape(num_ants, counts[0])
+    else:
+        baselines_per_antA = np.array([(antA == m).nonzero()[0] for m in range(num_ants)])
     # Each row of this array contains corresponding antB indices with same antA
     antB_per_antA = antB[baselines_per_antA]
+    weights = np.broadcast_to(weights, vis.shape)
     weighted_vis = weights * vis
     weighted_vis = weighted_vis[..., baselines_per_antA]
+    weights = weights[..., baselines_per_antA]
     # Initial estimate of gain vector
     gain_shape = tuple(list(vis.shape[:-1]) + [num_ants])
-    g_curr = np.ones(gain_shape, dtype=np.complex) if init_gain is None else init_gain
+    g_curr = np.ones(gain_shape, dtype=complex) if init_gain is None else init_gain
     for n in range(num_iters):
         # Basis vector (collection) represents gain_B* times model (assumed 1)
         g_basis = g_curr[..., antB_per_antA]
         # Do scalar least-squares fit of basis vector to vis vector for whole collection in parallel
-        g_new = (g_basis * weighted_vis).sum(axis=-1) / (g_basis.conj() * g_basis).sum(axis=-1)
+        top = (g_basis * weighted_vis).sum(axis=-1)
+        bot = (weights * (g_basis.conj() * g_basis).real).sum(axis=-1)
+        g_new = np.zeros(gain_shape, dtype=complex)
+        np.divide(top, bot, out=g_new, where=bot > 0.0)
         # Normalise g_new to match g_curr so that taking their average and diff
         # make sense (without copy() the elements of g_new are mangled up)
-        g_new /= g_new[..., ref_ant][..., np.newaxis].copy()
-        print
-        "Iteration %d: mean absolute gain change = %f" % \
-        (n + 1, 0.5 * np.abs(g_new - g_curr).mean())
+        g_ref = g_new[..., ref_ant][..., np.newaxis].copy()
+        g_ref[g_ref == 0.0] = 1.0
+        g_new /= g_ref
+        if phase_only:
+            g_new = _unit_amplitude(g_new)
+        change = np.max(np.abs(g_new - g_curr))
+        log.debug("stefcal: Iteration %d: mean absolute gain change = %f" %
+                  (n + 1, 0.5 * np.abs(g_new - g_curr).mean()))
         # Avoid getting stuck during iteration
         g_curr = 0.5 * (g_new + g_curr)
+        if phase_only:
+            g_curr = _unit_amplitude(g_curr)
+        if tol is not None and change < tol:
+            break
     return g_curr
 
 
+def _unit_amplitude(g):
+    """Scale non-zero gains to unit amplitude"""
+    amp = np.abs(g)
+    return np.where(amp > 0.0, g / np.where(amp > 0.0, amp, 1.0), g)
+
+
 def mean(a, axis=None):
     if a.dtype.kind == 'c':
         r = np.sqrt(a.real ** 2 + a.imag ** 2).mean(axis=axis)
@@ -148,7 +180,7 @@ if __name__ == '__main__':
     Rn = noise_power * np.eye(N)
     R = ggH + Rn
     
-    vis = np.zeros((M, len(antA)), dtype=np.complex)
+    vis = np.zeros((M, len(antA)), dtype=complex)
     for m in range(M):
         # Generate random sample covariance matrix V from true covariance R
         L = np.linalg.cholesky(R)
@@ -1,12 +1,63 @@
 import logging
+import struct
 import unittest
 
 from util.read_oskar_vis import *
 
-from arl.data.parameters import arl_path
+from data_models.parameters import arl_path
 
 log = logging.getLogger(__name__)
 
+
+def write_oskar_vis(file_name, uu, vv, ww, amp, pol_type=1, block_length=2):
+    """Write a minimal single channel OSKAR version 2 visibility file.
+
+    uu, vv, ww have shape (times, baselines), amp has shape (times, baselines)
+    or (times, baselines, 2, 2).
+    """
+    num_times, num_baselines = uu.shape
+    num_stations = int(round((1 + numpy.sqrt(1 + 8 * num_baselines)) / 2))
+
+    def block(f, data_type, group, tag, index, payload, element_size):
+        f.write(b'TBG')
+        f.write(struct.pack('<BBBBBiq', element_size, 0, data_type, group, tag, index, len(payload)))
+        f.write(payload)
+
+    def ints(values):
+        return numpy.asarray(values, dtype='<i4').tobytes()
+
+    def doubles(values):
+        return numpy.asarray(values, dtype='<f8').tobytes()
+
+    header = [
+        (1, 1, b'telescope\0', 1),
+        (2, 2, ints([6]), 4), (3, 2, ints([0]), 4), (4, 2, ints([1]), 4),
+        (5, 2, ints([0]), 4), (6, 2, ints([0]), 4), (7, 2, ints([block_length]), 4),
+        (8, 2, ints([num_times]), 4), (9, 2, ints([1]), 4), (10, 2, ints([1]), 4),
+        (11, 2, ints([num_stations]), 4), (12, 2, ints([pol_type]), 4),
+        (21, 2, ints([0]), 4), (22, 8, doubles([15.0, -35.0]), 8),
+        (23, 8, doubles([1e8]), 8), (24, 8, doubles([1e6]), 8), (25, 8, doubles([1e6]), 8),
+        (26, 8, doubles([58000.0]), 8), (27, 8, doubles([10.0]), 8), (28, 8, doubles([10.0]), 8),
+        (29, 8, doubles([116.7]), 8), (30, 8, doubles([-26.7]), 8), (31, 8, doubles([300.0]), 8),
+        (32, 8, doubles(numpy.arange(num_stations)), 8), (33, 8, doubles(numpy.zeros(num_stations)), 8),
+        (34, 8, doubles(numpy.zeros(num_stations)), 8)]
+
+    with open(file_name, 'wb') as f:
+        f.write(b'OSKARBIN\0' + struct.pack('B', 2) + bytes(54))
+        for tag, data_type, payload, element_size in header:
+            block(f, data_type, 11, tag, 0, payload, element_size)
+        for index, start in enumerate(range(0, num_times, block_length)):
+            times = slice(start, min(start + block_length, num_times))
+            ntimes = times.stop - times.start
+            block(f, 2, 12, 1, index, ints([start, 0, ntimes, 1, num_baselines, num_stations]), 4)
+            if amp.ndim == 4:
+                block(f, 8 | 32 | 64, 12, 3, index, numpy.asarray(amp[times], dtype='<c16').tobytes(), 64)
+            else:
+                block(f, 8 | 32, 12, 3, index, numpy.asarray(amp[times], dtype='<c16').tobytes(), 16)
+            for tag, coord in [(4, uu), (5, vv), (6, ww)]:
+                block(f, 8, 12, tag, index, doubles(coord[times]), 8)
+
+
 class TestOskar(unittest.TestCase):
 
     @unittest.skip("Not compliant with data model")
@@ -17,5 +68,32 @@ class TestOskar(unittest.TestCase):
             self.assertEqual(len(numpy.unique(vis.antenna1))+1, len(vis.configuration.xyz))
             self.assertEqual(len(numpy.unique(vis.antenna2))+1, len(vis.configuration.xyz))
 
+    def test_blockvisibility_from_oskar(self):
+        num_times, num_stations = 5, 4
+        num_baselines = num_stations * (num_stations - 1) // 2
+        rs = numpy.random.RandomState(1805550721)
+        uu, vv, ww = [rs.normal(size=[num_times, num_baselines]) for _ in range(3)]
+        for pol_type, shape in [(1, ()), (10, (2, 2))]:
+            amp = rs.normal(size=(num_times, num_baselines) + shape) + 1j * rs.normal(size=(num_times, num_baselines) + shape)
+            oskar_file = arl_path('test_results/test_oskar_%d.vis' % pol_type)
+            write_oskar_vis(oskar_file, uu, vv, ww, amp, pol_type=pol_type)
+
+            oskar_vis = OskarVis(oskar_file)
+            assert oskar_vis.num_blocks == 3
+            numpy.testing.assert_array_equal(oskar_vis.uvw()[2], ww)
+            numpy.testing.assert_array_equal(oskar_vis.amplitudes(), amp)
+
+            vis = import_visibility_from_oskar(oskar_file)
+            assert vis.nvis == num_times * num_baselines
+            numpy.testing.assert_array_equal(vis.vis, amp.reshape(vis.nvis, -1))
+
+            chunks = list(import_blockvisibility_from_oskar_iterator(oskar_file))
+            assert [len(chunk.time) for chunk in chunks] == [2, 2, 1]
+            bvis = numpy.concatenate([chunk.vis for chunk in chunks])
+            a1, a2 = oskar_vis.stations()
+            numpy.testing.assert_array_equal(bvis[:, a2[0], a1[0], 0, :], amp.reshape(num_times, num_baselines, -1))
+            numpy.testing.assert_array_equal(chunks[1].uvw[:, a2[0], a1[0], 0], uu[2:4])
+
+
 if __name__ == '__main__':
     unittest.main()
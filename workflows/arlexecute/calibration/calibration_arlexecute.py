@@ -3,29 +3,45 @@
 """
 
 from wrappers.arlexecute.execution_support.arlexecute import arlexecute
-from wrappers.arlexecute.calibration.calibration_control import calibrate_function
-from wrappers.arlexecute.calibration.operations import apply_gaintable
+from wrappers.arlexecute.calibration.calibration_control import calibrate_function, apply_calibration_function
+from wrappers.arlexecute.visibility.base import copy_visibility
 from wrappers.arlexecute.visibility.gather_scatter import visibility_gather_channel
 from wrappers.arlexecute.visibility.operations import divide_visibility, integrate_visibility_by_channel
 
 def calibrate_list_arlexecute_workflow(vis_list, model_vislist, calibration_context='TG', global_solution=True,
-                                       **kwargs):
+                                       gt_list=None, **kwargs):
     """ Create a set of components for (optionally global) calibration of a list of visibilities
 
     If global solution is true then visibilities are gathered to a single visibility data set which is then
     self-calibrated. The resulting gaintable is then effectively scattered out for application to each visibility
     set. If global solution is false then the solutions are performed locally.
+    
+    If gt_list is given, one dict(gaintables) (or None) for each visibility, then the solutions start from
+    these gaintables, e.g. those from the previous major cycle. For a global solution, the first is used. The
+    visibilities are not altered in this case so that the same uncalibrated data can be calibrated again, and the
+    new gt_list is also returned.
 
     :param vis_list:
     :param model_vislist:
     :param calibration_context: String giving terms to be calibrated e.g. 'TGB'
     :param global_solution: Solve for global gains
+    :param gt_list: List of dict(gaintables) from a previous calibration
     :param kwargs: Parameters for functions in components
-    :return:
+    :return: list of calibrated visibilities, and if gt_list is given, the list of dict(gaintables)
     """
     
-    def solve_and_apply(vis, modelvis=None):
-        return calibrate_function(vis, modelvis, calibration_context=calibration_context, **kwargs)[0]
+    def solve(vis, modelvis=None, gaintables=None):
+        return calibrate_function(vis, modelvis, calibration_context=calibration_context, gaintables=gaintables,
+                                  **kwargs)
+    
+    def apply(vis, gaintables):
+        return apply_calibration_function(vis, gaintables, calibration_context=calibration_context, **kwargs)
+    
+    def solve_copy(vis, modelvis, gaintables):
+        return solve(copy_visibility(vis), modelvis, gaintables)
+    
+    def apply_copy(vis, gaintables):
+        return apply(copy_visibility(vis), gaintables)
     
     if global_solution:
         point_vislist = [arlexecute.execute(divide_visibility, nout=len(vis_list))(vis_list[i],
@@ -33,11 +49,21 @@ def calibrate_list_arlexecute_workflow(vis_list, model_vislist, calibration_cont
                          for i, _ in enumerate(vis_list)]
         global_point_vis_list = arlexecute.execute(visibility_gather_channel, nout=1)(point_vislist)
         global_point_vis_list = arlexecute.execute(integrate_visibility_by_channel, nout=1)(global_point_vis_list)
-        # This is a global solution so we only compute one gain table
-        _, gt_list = arlexecute.execute(solve_and_apply, pure=True, nout=2)(global_point_vis_list)
-        return [arlexecute.execute(apply_gaintable, nout=len(vis_list))(v, gt_list, inverse=True)
-                for v in vis_list]
+        # This is a global solution so we only compute one set of gaintables
+        previous_gaintables = gt_list[0] if gt_list is not None else None
+        _, gaintables = arlexecute.execute(solve, pure=True, nout=2)(global_point_vis_list, None,
+                                                                     previous_gaintables)
+        if gt_list is not None:
+            return [arlexecute.execute(apply_copy, nout=1)(v, gaintables) for v in vis_list], \
+                   [gaintables for v in vis_list]
+        
+        return [arlexecute.execute(apply, nout=1)(v, gaintables) for v in vis_list]
     else:
         
-        return [arlexecute.execute(solve_and_apply, nout=len(vis_list))(vis_list[i], model_vislist[i])
+        if gt_list is not None:
+            results = [arlexecute.execute(solve_copy, nout=2)(vis_list[i], model_vislist[i], gt_list[i])
+                       for i, v in enumerate(vis_list)]
+            return [result[0] for result in results], [result[1] for result in results]
+        
+        return [arlexecute.execute(solve, nout=2)(vis_list[i], model_vislist[i])[0]
                 for i, v in enumerate(vis_list)]
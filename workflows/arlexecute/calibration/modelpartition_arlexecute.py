@@ -2,48 +2,94 @@
 
 This works as follows:
 
+The data models for all partitions are predicted and the residual (observed data minus the summed data models) is
+formed. Each iteration then runs the E and M steps for all partitions in parallel, predicts the new data models once
+per partition, and forms the new residual.
+
+For several visibilities, each is solved independently and the consensus of the fitted skymodels is the starting
+point for the next round.
+
 """
 
 import logging
 
-from wrappers.arlexecute.calibration.modelpartition import solve_modelpartitions, create_modelpartitions
-from wrappers.arlexecute.calibration.operations import copy_gaintable, create_gaintable_from_blockvisibility
+from wrappers.arlexecute.calibration.modelpartition import create_modelpartitions, modelpartition_predict, \
+    modelpartition_list_residual, modelpartition_residual_visibility, modelpartition_expectation_step, \
+    modelpartition_maximisation_step, modelpartition_consensus
 from wrappers.arlexecute.execution_support.arlexecute import arlexecute
-from wrappers.arlexecute.skymodel.operations import copy_skymodel
-from wrappers.arlexecute.visibility.base import copy_visibility
 
 log = logging.getLogger(__name__)
 
 
+def solve_modelpartition_list_arlexecute_workflow(vis, skymodel_list, niter=10, tol=1e-8, gain=0.25, **kwargs):
+    """ Solve using modelpartition, dask.delayed wrapper
+
+    Solve by iterating, performing E step and M step. The M steps for the partitions are independent and so run
+    in parallel. Since the graph is constructed in advance, all niter iterations are performed and tol is not used.
+
+    :param vis: Initial visibility
+    :param skymodel_list: List of sky models, one per partition
+    :param niter: Number of iterations
+    :param gain: Gain in step
+    :param kwargs:
+    :return: A graph to calculate the (skymodel, gaintable) tuples and the residual visibility
+    """
+    nparts = len(skymodel_list)
+    modelpartition_list = arlexecute.execute(create_modelpartitions, nout=nparts)(vis, skymodel_list, **kwargs)
+    modelpartition_list = [modelpartition_list[i] for i in range(nparts)]
+
+    prediction_list = [arlexecute.execute(modelpartition_predict)(vis, csm, **kwargs)
+                       for csm in modelpartition_list]
+    residual = arlexecute.execute(modelpartition_list_residual)(vis, prediction_list)
+
+    for iter in range(niter):
+        evis_list = [arlexecute.execute(modelpartition_expectation_step)(vis, residual, prediction)
+                     for prediction in prediction_list]
+        modelpartition_list = [arlexecute.execute(modelpartition_maximisation_step)(evis, csm, gain=gain,
+                                                                                   **kwargs)
+                               for evis, csm in zip(evis_list, modelpartition_list)]
+        prediction_list = [arlexecute.execute(modelpartition_predict)(vis, csm, **kwargs)
+                           for csm in modelpartition_list]
+        residual = arlexecute.execute(modelpartition_list_residual)(vis, prediction_list)
+
+    residual_vis = arlexecute.execute(modelpartition_residual_visibility)(vis, residual)
+    return arlexecute.execute((modelpartition_list, residual_vis))
+
+
 def solve_modelpartition_consensus_list_arlexecute_workflow(vislist, skymodel_list, niter=10, coniter=10, tol=1e-8,
-                                                       gain=0.25, **kwargs):
+                                                            gain=0.25, **kwargs):
     """ Solve using modelpartition with consensus optimisation, dask.delayed wrapper
 
-    Solve by iterating, performing E step and M step.
+    Solve each visibility by iterating, performing E step and M step, then replace the skymodels for every
+    visibility by their consensus, and repeat.
 
     :param vis_list: Initial visibility
     :param skymodel_list: List of sky models, one per vis
+    :param niter: Number of iterations for each visibility
+    :param coniter: Number of consensus iterations
     :param kwargs:
-    :return: A dask graph to calculate the individual data models and the residual visibility
+    :return: A graph to calculate the consensus skymodels, one list per vis
     """
-    model_partitions = [arlexecute.execute(create_modelpartitions, nout=2)(vislist[i], skymodel_list[i],**kwargs)
-                        for i, _ in enumerate(vislist)]
     for iter in range(coniter):
-        partition_results = [arlexecute.execute(solve_modelpartition, nout=2)(vislist[i], skymodel_list[i],
-                                                                              niter=niter, tol=1e-8, gain=0.25,
-                                                                              **kwargs)
+        partition_results = [solve_modelpartition_list_arlexecute_workflow(vislist[i], skymodel_list[i],
+                                                                           niter=niter, tol=tol, gain=gain,
+                                                                           **kwargs)
                              for i, _ in enumerate(vislist)]
-        skymodel_list = calculate_modelpartition_consensus_arlexecute_workflow(partition_results)
-    
-    return arlexecute.execute((skymodel_list)(skymodel_list))
+        skymodel_list = calculate_modelpartition_consensus_arlexecute_workflow(partition_results, skymodel_list)
+
+    return skymodel_list
+
 
-def calculate_modelpartition_consensus_arlexecute_workflow(partition_results, **kwargs):
+def calculate_modelpartition_consensus_arlexecute_workflow(partition_results, skymodel_list, **kwargs):
     """ Find consensus of models
-    
-    :param partition_results: List of (vis, skymodel)
-    :param skymodel_list:
+
+    :param partition_results: List, one per vis, of graphs for the (model partitions, residual visibility) tuple
+    :param skymodel_list: List, one per vis, of lists of skymodels
     :param kwargs:
-    :return:
+    :return: List, one per vis, of lists of graphs for the consensus skymodels
 
     """
-    return skymodel_list
+    nparts = len(skymodel_list[0])
+    consensus = arlexecute.execute(modelpartition_consensus, nout=nparts)(partition_results)
+    consensus = [consensus[part] for part in range(nparts)]
+    return [consensus for _ in skymodel_list]
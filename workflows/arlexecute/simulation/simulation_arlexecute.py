@@ -12,7 +12,8 @@ from data_models.polarisation import PolarisationFrame
 from wrappers.arlexecute.execution_support.arlexecute import arlexecute
 
 from wrappers.arlexecute.calibration.operations import apply_gaintable, create_gaintable_from_blockvisibility
-from wrappers.arlexecute.simulation.testing_support import create_named_configuration, simulate_gaintable
+from wrappers.arlexecute.simulation.testing_support import create_named_configuration, simulate_gaintable, \
+    create_random_streams
 from wrappers.arlexecute.visibility.base import create_blockvisibility, create_visibility
 
 log = logging.getLogger(__name__)
@@ -108,19 +109,27 @@ def simulate_list_arlexecute_workflow(config='LOWBD2',
     return vis_list
 
 
-def corrupt_list_arlexecute_workflow(vis_list, gt_list=None, **kwargs):
+def corrupt_list_arlexecute_workflow(vis_list, gt_list=None, seed=None, **kwargs):
     """ Create a graph to apply gain errors to a vis_list
 
+    Each gaintable is simulated from its own random stream so that the result for each vis does not depend on the
+    execution order.
+
     :param vis_list:
-    :param gt_list: Optional gain table graph
+    :param gt_list: Optional gain table graph, one per vis
+    :param seed: Seed for the random streams
     :param kwargs:
     :return:
     """
     
-    def corrupt_vis(vis, gt, **kwargs):
+    def corrupt_vis(vis, gt, rng, **kwargs):
         if gt is None:
             gt = create_gaintable_from_blockvisibility(vis, **kwargs)
-            gt = simulate_gaintable(gt, **kwargs)
+            gt = simulate_gaintable(gt, rng=rng, **kwargs)
         return apply_gaintable(vis, gt)
     
-    return [arlexecute.execute(corrupt_vis, nout=1)(vis_list, gt_list, **kwargs) for vis_list in vis_list]
+    if gt_list is None:
+        gt_list = [None for vis in vis_list]
+    rng_list = create_random_streams(seed, len(vis_list))
+    
+    return [arlexecute.execute(corrupt_vis, nout=1)(vis, gt, rng, **kwargs) for vis, gt, rng in zip(vis_list, gt_list, rng_list)]
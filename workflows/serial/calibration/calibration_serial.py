@@ -2,40 +2,58 @@
 
 """
 
-from processing_components.calibration.calibration_control import calibrate_function
-from processing_components.calibration.operations import apply_gaintable
+from processing_components.calibration.calibration_control import calibrate_function, apply_calibration_function
+from processing_components.visibility.base import copy_visibility
 from processing_components.visibility.gather_scatter import visibility_gather_channel
 from processing_components.visibility.operations import divide_visibility, integrate_visibility_by_channel
 
 
 def calibrate_list_serial_workflow(vis_list, model_vislist, calibration_context='TG', global_solution=True,
-                                   **kwargs):
+                                   gt_list=None, **kwargs):
     """ Create a set of components for (optionally global) calibration of a list of visibilities
 
     If global solution is true then visibilities are gathered to a single visibility data set which is then
     self-calibrated. The resulting gaintable is then effectively scattered out for application to each visibility
     set. If global solution is false then the solutions are performed locally.
+    
+    If gt_list is given, one dict(gaintables) (or None) for each visibility, then the solutions start from
+    these gaintables, e.g. those from the previous major cycle. For a global solution, the first is used. The
+    visibilities are not altered in this case so that the same uncalibrated data can be calibrated again, and the
+    new gt_list is also returned.
 
     :param vis_list:
     :param model_vislist:
     :param calibration_context: String giving terms to be calibrated e.g. 'TGB'
     :param global_solution: Solve for global gains
+    :param gt_list: List of dict(gaintables) from a previous calibration
     :param kwargs: Parameters for functions in components
-    :return:
+    :return: list of calibrated visibilities, and if gt_list is given, the list of dict(gaintables)
     """
     
-    def solve_and_apply(vis, modelvis=None):
-        return calibrate_function(vis, modelvis, calibration_context=calibration_context, **kwargs)[0]
-    
     if global_solution:
         point_vislist = [divide_visibility(vis_list[i], model_vislist[i])
                          for i, _ in enumerate(vis_list)]
         global_point_vis_list = visibility_gather_channel(point_vislist)
         global_point_vis_list = integrate_visibility_by_channel(global_point_vis_list)
-        # This is a global solution so we only compute one gain table
-        _, gt_list = solve_and_apply(global_point_vis_list)
-        return [apply_gaintable(v, gt_list, inverse=True)
+        # This is a global solution so we only compute one set of gaintables
+        previous_gaintables = gt_list[0] if gt_list is not None else None
+        _, gaintables = calibrate_function(global_point_vis_list, None, calibration_context=calibration_context,
+                                           gaintables=previous_gaintables, **kwargs)
+        if gt_list is not None:
+            return [apply_calibration_function(copy_visibility(v), gaintables,
+                                               calibration_context=calibration_context, **kwargs)
+                    for v in vis_list], [gaintables for v in vis_list]
+        
+        return [apply_calibration_function(v, gaintables, calibration_context=calibration_context, **kwargs)
                 for v in vis_list]
     else:
         
-        return [solve_and_apply(vis_list[i], model_vislist[i]) for i, v in enumerate(vis_list)]
+        if gt_list is not None:
+            results = [calibrate_function(copy_visibility(vis_list[i]), model_vislist[i], gaintables=gt_list[i],
+                                          calibration_context=calibration_context, **kwargs)
+                       for i, v in enumerate(vis_list)]
+            return [result[0] for result in results], [result[1] for result in results]
+        
+        return [calibrate_function(vis_list[i], model_vislist[i], calibration_context=calibration_context,
+                                   **kwargs)[0]
+                for i, v in enumerate(vis_list)]
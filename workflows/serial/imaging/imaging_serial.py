@@ -269,7 +269,12 @@ def deconvolve_list_serial_workflow(dirty_list, psf_list, model_imagelist, prefi
                 "deconvolve_list_serial_workflow %s: cleaning - peak %.6f > 1.1 * threshold %.6f" % (lprefix, this_peak,
                                                                                                 gthreshold))
             kwargs['threshold'] = gthreshold
-            result, _ = deconvolve_cube(dirty, psf, prefix=lprefix, **kwargs)
+            facet_kwargs = dict(kwargs)
+            checkpoint_file = get_parameter(kwargs, 'checkpoint_file', None)
+            if checkpoint_file is not None:
+                # Each facet is checkpointed separately so that a lost worker can resume its own facet
+                facet_kwargs['checkpoint_file'] = '%s.facet%d' % (checkpoint_file, facet)
+            result, _ = deconvolve_cube(dirty, psf, prefix=lprefix, **facet_kwargs)
             
             if result.data.shape[0] == model.data.shape[0]:
                 result.data += model.data
@@ -25,13 +25,18 @@ def ical_list_serial_workflow(vis_list, model_imagelist, context='2d', calibrati
     """
     psf_imagelist = invert_list_serial_workflow(vis_list, model_imagelist, dopsf=True, context=context, **kwargs)
     
+    # Each major cycle calibrates the original data starting from the gaintables found in the previous cycle
+    original_vislist = vis_list
+    gt_list = [None for v in vis_list]
+    
     model_vislist = zero_list_serial_workflow(vis_list)
     model_vislist = predict_list_serial_workflow(model_vislist, model_imagelist, context=context, **kwargs)
     if do_selfcal:
         # Make the predicted visibilities, selfcalibrate against it correcting the gains, then
         # form the residual visibility, then make the residual image
-        vis_list = calibrate_list_serial_workflow(vis_list, model_vislist,
-                                                      calibration_context=calibration_context, **kwargs)
+        vis_list, gt_list = calibrate_list_serial_workflow(original_vislist, model_vislist,
+                                                           calibration_context=calibration_context, gt_list=gt_list,
+                                                           **kwargs)
         residual_vislist = subtract_list_serial_workflow(vis_list, model_vislist)
         residual_imagelist = invert_list_serial_workflow(residual_vislist, model_imagelist, dopsf=True,
                                                              context=context,
@@ -52,9 +57,9 @@ def ical_list_serial_workflow(vis_list, model_imagelist, context='2d', calibrati
                 model_vislist = zero_list_serial_workflow(vis_list)
                 model_vislist = predict_list_serial_workflow(model_vislist, deconvolve_model_imagelist,
                                                                  context=context, **kwargs)
-                vis_list = calibrate_list_serial_workflow(vis_list, model_vislist,
-                                                              calibration_context=calibration_context,
-                                                              iteration=cycle, **kwargs)
+                vis_list, gt_list = calibrate_list_serial_workflow(original_vislist, model_vislist,
+                                                                   calibration_context=calibration_context,
+                                                                   gt_list=gt_list, iteration=cycle, **kwargs)
                 residual_vislist = subtract_list_serial_workflow(vis_list, model_vislist)
                 residual_imagelist = invert_list_serial_workflow(residual_vislist, model_imagelist, dopsf=False,
                                                                      context=context, **kwargs)
@@ -7,6 +7,7 @@ from processing_components.calibration.operations import gaintable_summary
 from processing_components.calibration.operations import create_gaintable_from_blockvisibility
 from processing_components.calibration.operations import apply_gaintable
 from processing_components.calibration.operations import append_gaintable
+from processing_components.calibration.operations import GainTableBuilder
 from processing_components.calibration.operations import copy_gaintable
 from processing_components.calibration.operations import create_gaintable_from_rows
 from processing_components.calibration.operations import qa_gaintable
\ No newline at end of file
@@ -12,6 +12,7 @@ from processing_components.simulation.testing_support import create_low_test_sky
 from processing_components.simulation.testing_support import replicate_image
 from processing_components.simulation.testing_support import create_blockvisibility_iterator
 from processing_components.simulation.testing_support import simulate_gaintable
+from processing_components.simulation.testing_support import create_random_streams
 from processing_components.simulation.testing_support import ingest_unittest_visibility
 from processing_components.simulation.testing_support import create_unittest_components
 from processing_components.simulation.testing_support import create_unittest_model
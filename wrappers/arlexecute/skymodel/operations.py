@@ -3,3 +3,4 @@
 """
 from processing_components.skymodel.operations import copy_skymodel
 from processing_components.skymodel.operations import solve_skymodel
+from processing_components.skymodel.operations import predict_skymodel_visibility
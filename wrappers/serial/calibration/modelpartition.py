@@ -3,5 +3,12 @@
 See the SDP document "Model Partition Calibration View Packet"
 
 """
-from processing_components.calibration.modelpartition import create_modelpartition
-from processing_components.calibration.modelpartition import solve_modelpartition
+from processing_components.calibration.modelpartition import create_modelpartitions
+from processing_components.calibration.modelpartition import solve_modelpartitions
+from processing_components.calibration.modelpartition import modelpartition_predict
+from processing_components.calibration.modelpartition import modelpartition_list_predict
+from processing_components.calibration.modelpartition import modelpartition_list_residual
+from processing_components.calibration.modelpartition import modelpartition_residual_visibility
+from processing_components.calibration.modelpartition import modelpartition_expectation_step
+from processing_components.calibration.modelpartition import modelpartition_maximisation_step
+from processing_components.calibration.modelpartition import modelpartition_consensus
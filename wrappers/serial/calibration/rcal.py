@@ -1,4 +1,4 @@
 """ Real time calibration pipeline
 
 """
-from processing_components.calibration.rcal import rcal
\ No newline at end of file
+from processing_components.calibration.rcal import rcal, rcal_stream
\ No newline at end of file
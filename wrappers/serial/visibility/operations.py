@@ -2,6 +2,7 @@
 
 """
 from processing_components.visibility.operations import append_visibility
+from processing_components.visibility.operations import VisibilityBuilder
 from processing_components.visibility.operations import sort_visibility
 from processing_components.visibility.operations import concatenate_visibility
 from processing_components.visibility.operations import sum_visibility